@@ -12,12 +12,18 @@ from flask import (
     session,
 )
 from functools import wraps
+import executors
 from model import Model
+from model_pool import ModelPool
+from scheduler import DecodeScheduler
+from conversation_store import SORT_COLUMNS, ConversationStore
+from session_store import SessionStore, Transcript
+from training_history import TrainingHistory
+from training_jobs import TrainingJobs
 import os
 import argparse
 import json
 import secrets
-import yaml
 from pathlib import Path
 from datetime import datetime
 import resource
@@ -26,65 +32,30 @@ app = Flask(__name__, static_folder="static")
 app.secret_key = os.environ.get("SECRET_KEY", secrets.token_hex(16))
 
 ADMIN_PASSWORD = None  # Set via --admin-password flag or ADMIN_PASSWORD env var
-TRAINING_HISTORY_PATH = Path(__file__).parent / "data" / "training_history.yml"
+TRAINING_HISTORY_PATH = Path(__file__).parent / "data" / "training_history.jsonl"
+# Pre-JSONL history, imported into TRAINING_HISTORY_PATH the first time it's created
+LEGACY_TRAINING_HISTORY_PATH = Path(__file__).parent / "data" / "training_history.yml"
+CONVERSATIONS_DB_PATH = Path(__file__).parent / "data" / "conversations.db"
+# Pre-SQLite per-session JSON files, imported when the database is first created
 CONVERSATIONS_DIR = Path(__file__).parent / "data" / "conversations"
+# Report probability changes and the L2 update norm for /api/train steps (two
+# extra forward passes per step; "0" skips them); requests can override with
+# "diagnostics"
+TRAINING_DIAGNOSTICS = os.environ.get("TRAINING_DIAGNOSTICS", "1") == "1"
 
 
-def load_training_history():
-    """Load training history from YAML file."""
-    if not TRAINING_HISTORY_PATH.exists():
-        return {"steps": []}
-    with open(TRAINING_HISTORY_PATH) as f:
-        return yaml.safe_load(f) or {"steps": []}
-
-
-def save_training_step(step_data: dict):
-    """Append a training step to the YAML file."""
-    history = load_training_history()
-    step_data["id"] = len(history["steps"]) + 1
-    history["steps"].append(step_data)
-    TRAINING_HISTORY_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(TRAINING_HISTORY_PATH, "w") as f:
-        yaml.dump(history, f, default_flow_style=False)
+def checkpoint_file(step: dict) -> Path:
+    """A training step's checkpoint path ("checkpoint" field, else step_<id>)."""
+    checkpoints_dir = Path(os.environ.get("CHECKPOINTS_DIR", "checkpoints"))
+    name = step.get("checkpoint", f"step_{step['id']}")
+    return checkpoints_dir / f"{name}.pt"
 
 
-def safe_conversation_path(session_id):
-    """Return a safe file path for a session, or None if the ID is invalid."""
-    # Sanitize: only allow alphanumeric, underscore, hyphen
-    safe_id = "".join(c for c in session_id if c.isalnum() or c in ("_", "-"))
-    if not safe_id:
-        return None
-    filepath = CONVERSATIONS_DIR / f"{safe_id}.json"
-    # Verify resolved path is within CONVERSATIONS_DIR
-    if not filepath.resolve().is_relative_to(CONVERSATIONS_DIR.resolve()):
-        return None
-    return filepath
-
-
-def save_conversation(session_id, history, user_agent=None):
-    """Persist a conversation to disk."""
-    CONVERSATIONS_DIR.mkdir(parents=True, exist_ok=True)
-    filepath = safe_conversation_path(session_id)
-    if not filepath:
-        return
-    now = datetime.now().isoformat()
-    # Preserve created_at and user_agent from first save
-    created_at = now
-    existing_ua = None
-    if filepath.exists():
-        try:
-            existing = json.loads(filepath.read_text())
-            created_at = existing.get("created_at", now)
-            existing_ua = existing.get("user_agent")
-        except (json.JSONDecodeError, KeyError):
-            pass
-    filepath.write_text(json.dumps({
-        "session_id": session_id,
-        "created_at": created_at,
-        "updated_at": now,
-        "history": history,
-        "user_agent": existing_ua or user_agent,
-    }, indent=2))
+def page_args():
+    """(offset, limit) from the query string; limit None means all."""
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = request.args.get("limit", type=int)
+    return offset, limit
 
 
 def admin_required(f):
@@ -99,9 +70,28 @@ def admin_required(f):
 
 # Initialize model
 model = None
+training_history = None  # TrainingHistory, opened at startup
+conversation_store = None  # ConversationStore, opened at startup
+pool = None  # ModelPool of per-session checkpoint replicas
+
+# /api/train jobs, run in order on the model's training worker
+training_jobs = TrainingJobs()
+
+
+def load_session(session_id):
+    """Persisted (history, checkpoint) of a session, for SessionStore rehydration."""
+    loaded = conversation_store.load_session(session_id)
+    if loaded is None:
+        return None
+    history, checkpoint = loaded
+    if checkpoint and not Path(checkpoint).exists():
+        print(f"[sessions] Pinned checkpoint {checkpoint} is gone; using the default")
+        checkpoint = None
+    return history, checkpoint
+
 
-# Store conversation history per session (in production, use a proper session store)
-conversations = {}
+# Active chat sessions: history, its token IDs and the pinned checkpoint
+sessions = SessionStore(load=load_session)
 
 
 @app.route("/api/generate", methods=["POST"])
@@ -127,51 +117,62 @@ def generate():
         try:
             # Get conversation history for this session
             nonlocal history
-            if not history and session_id in conversations:
-                history = conversations[session_id]
-
-            # Start building new history
+            chat = sessions.get(session_id)
+            if not history:
+                history = chat.history
+            # Reuse the session's token IDs when the client's history matches
+            history_tokens = chat.tokens if history == chat.history else None
+            if history_tokens is None and history and not auto_start:
+                history_tokens = model.tokenizer.encode(history)
+
+            # Start building new history; its token IDs are extended with it
+            # one segment at a time (see Transcript)
+            encode = model.tokenizer.encode
             if auto_start:
                 # MikeGPT starts first: use <|ConversationStart|><|Me|> as the prompt
-                new_history = "<|ConversationStart|><|Me|>"
-                prompt_for_model = new_history
+                transcript = Transcript(encode, "<|ConversationStart|><|Me|>")
             else:
                 # Normal mode: user sends first message
                 if not history:
-                    new_history = f"<|ConversationStart|><|Them|>{user_message}"
+                    transcript = Transcript(
+                        encode, f"<|ConversationStart|><|Them|>{user_message}"
+                    )
                 else:
-                    new_history = history + f"<|Them|>{user_message}"
-                prompt_for_model = new_history
+                    transcript = Transcript(encode, history, history_tokens)
+                    transcript.append(f"<|Them|>{user_message}")
+            prompt_for_model = transcript.text
 
-            # Stream each response as it's generated
-            for response, token_ids in model.generate_response_stream(
+            # Stream each response as it's generated, from the session's checkpoint
+            session_model = pool.get(chat.checkpoint)
+            for response, token_ids in session_model.generate_response_stream(
                 history if not auto_start else "",
                 user_message,
                 auto_start=auto_start,
                 auto_start_prompt=prompt_for_model if auto_start else None,
+                history_tokens=history_tokens if not auto_start else None,
             ):
                 # Update history for this response
                 if response.startswith("<|") and response.endswith("|>"):
-                    new_history += f"{response}"
+                    segment = f"{response}"
                 else:
-                    if auto_start and new_history == "<|ConversationStart|><|Me|>":
+                    if auto_start and transcript.text == "<|ConversationStart|><|Me|>":
                         # First response in auto_start mode, don't add another <|Me|>
-                        new_history += f"{response}"
+                        segment = f"{response}"
                     else:
-                        new_history += f"<|Me|>{response}"
+                        segment = f"<|Me|>{response}"
+                transcript.append(segment)
 
                 # Send this response immediately with token IDs
-                print(
-                    f"[generate] Sending response='{response}' with token_ids={token_ids}"
-                )
                 yield f"data: {json.dumps({'response': response, 'token_ids': token_ids})}\n\n"
 
-            # Save final history
-            conversations[session_id] = new_history
-            save_conversation(session_id, new_history, request.headers.get("User-Agent"))
+            # Save final history with its tokens for the next turn
+            chat.set_history(transcript.text, transcript.tokens)
+            conversation_store.save(
+                session_id, transcript.text, request.headers.get("User-Agent")
+            )
 
             # Send final message with updated history
-            yield f"data: {json.dumps({'done': True, 'history': new_history})}\n\n"
+            yield f"data: {json.dumps({'done': True, 'history': transcript.text})}\n\n"
 
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
@@ -187,16 +188,25 @@ def reset():
     data = request.json
     session_id = data.get("session_id", "default")
 
-    if session_id in conversations:
-        del conversations[session_id]
+    sessions.get(session_id).set_history("")
+    # The stored conversation stays for the admin view, but a session
+    # rehydrated from it starts over
+    conversation_store.mark_reset(session_id)
 
     return jsonify({"success": True})
 
 
 @app.route("/api/training-history", methods=["GET"])
 def get_training_history():
-    """Return all training history."""
-    return jsonify(load_training_history())
+    """
+    Return training history, oldest first.
+
+    Optional query params offset and limit page through it; the response
+    includes the total step count.
+    """
+    offset, limit = page_args()
+    steps, total = training_history.page(offset, limit)
+    return jsonify({"steps": steps, "total": total, "offset": offset})
 
 
 @app.route("/api/checkpoints", methods=["GET"])
@@ -205,23 +215,38 @@ def list_checkpoints():
     from model import Model
 
     checkpoints = Model.list_checkpoints()
-    # Add current checkpoint info
-    current = model.current_checkpoint if model else None
+    # Add current checkpoint info (the session's pinned one, if any)
+    session_id = request.args.get("session_id")
+    # Looking the session up must not create or rehydrate it
+    session = sessions.peek(session_id) if session_id else None
+    pinned = session.checkpoint if session is not None else None
+    current = pinned or (model.current_checkpoint if model else None)
     return jsonify({"checkpoints": checkpoints, "current": current})
 
 
 @app.route("/api/switch-model", methods=["POST"])
 def switch_model():
-    """Hot-swap to a different checkpoint."""
+    """
+    Switch checkpoints.
+
+    With a session_id, only that session's chat moves to the checkpoint
+    (loaded into the model pool); without one, the primary model is hot-swapped.
+    """
     from pathlib import Path
 
     data = request.json
     checkpoint_path = data.get("checkpoint_path")
+    session_id = data.get("session_id")
 
     if not checkpoint_path or not Path(checkpoint_path).exists():
         return jsonify({"error": "Invalid checkpoint path"}), 400
 
-    model.reload_checkpoint(checkpoint_path)
+    if session_id:
+        pool.get(checkpoint_path)
+        sessions.get(session_id).checkpoint = checkpoint_path
+        conversation_store.pin_checkpoint(session_id, checkpoint_path)
+    else:
+        model.reload_checkpoint(checkpoint_path)
     return jsonify({"success": True, "loaded": checkpoint_path})
 
 
@@ -256,7 +281,7 @@ def beam_tree():
 
     try:
         raw = data.get("raw", False)
-        tree = model.build_beam_tree(prompt, k=k, n=n, raw=raw)
+        tree = executors.expand.run(model.build_beam_tree, prompt, k=k, n=n, raw=raw)
         return jsonify(tree)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -315,30 +340,30 @@ def expand_depth():
         # Batched forward pass — cached nodes are served from cache, only
         # uncached nodes hit the GPU.  Full distributions are stored so
         # subsequent requests with larger k need zero GPU work.
-        batch_results = model.get_top_k_cached_batch(sequences, path_keys, prompt, k=k)
+        batch_results = executors.expand.run(
+            model.get_top_k_cached_batch, sequences, path_keys, prompt, k=k
+        )
 
         result = {}
-        for path_key, top_tokens in zip(path_keys, batch_results):
-            children = []
-            for token_id, token_str, probability in top_tokens:
-                children.append(
-                    {
-                        "token_id": token_id,
-                        "token_str": token_str,
-                        "probability": probability,
-                        "cumulative_prob": probability,  # Will be updated by frontend
-                        "depth": 0,  # Will be updated by frontend
-                        "children": None,  # Will be loaded lazily
-                    }
-                )
-            result[path_key] = children
+        for path_key, top in zip(path_keys, batch_results):
+            result[path_key] = [
+                {
+                    "token_id": token_id,
+                    "token_str": token_str,
+                    "probability": probability,
+                    "cumulative_prob": probability,  # Will be updated by frontend
+                    "depth": 0,  # Will be updated by frontend
+                    "children": None,  # Will be loaded lazily
+                }
+                for token_id, token_str, probability in zip(top.ids, top.strs, top.probs)
+            ]
 
         # Peak RSS in MB (macOS ru_maxrss is bytes, Linux is KB)
         import sys
         peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
         peak_mb = peak_kb / 1024 if sys.platform == 'linux' else peak_kb / (1024 * 1024)
         cache_entries = len(model._probs_cache)
-        cache_mb = sum(t.nelement() * t.element_size() for pair in model._probs_cache.values() for t in pair) / (1024 * 1024)
+        cache_mb = model._probs_cache.nbytes / (1024 * 1024)
         print(f"[memory] Peak RSS: {peak_mb:.1f} MB | probs_cache: {cache_entries} entries, {cache_mb:.1f} MB")
 
         return jsonify({"children_map": result})
@@ -363,7 +388,10 @@ def grpo_generate():
     Streams:
     - { index: 0-7, token: "...", done: false } per token
     - { index: 0-7, done: true, full_response: "...", tokens: [...] } when response complete
-    - { all_done: true, responses: [...] } when all 8 complete
+    - { all_done: true, responses: [...], truncated: bool } when all 8
+      complete, or when the sample pool's time limit (SAMPLE_TIME_LIMIT, none
+      by default) ended sampling early, with truncated: true and fewer than 8
+      responses
     """
     data = request.json
     prompt_text = data.get("prompt", "").strip()
@@ -378,56 +406,30 @@ def grpo_generate():
     def generate_stream():
         try:
             responses = []
-            seen_texts = set()
             full_prompt = f"<|ConversationStart|><|Them|>{prompt_text}<|Me|>"
-            max_attempts = 24  # Prevent infinite loops if model is too deterministic
-
-            attempts = 0
-            while len(responses) < 8 and attempts < max_attempts:
-                attempts += 1
-                model.prime(full_prompt)
-                current_response = ""
-                response_tokens = []
-                max_tokens = 100
-
-                for _ in range(max_tokens):
-                    token = model.next_token(
-                        temperature=temperature,
-                        top_p=top_p,
-                        top_k=top_k,
-                        use_top_k=use_top_k,
-                    )
 
-                    # Get the token ID from the last position in current_tokens
-                    token_id = int(model.current_tokens[0, -1].item())
-                    response_tokens.append(token_id)
-
-                    # Check for stop tokens
-                    if token in [
-                        "<|Me|>",
-                        "<|Them|>",
-                        "<|endoftext|>",
-                        "<|ConversationStart|>",
-                    ]:
-                        # Remove the stop token from the list
-                        response_tokens.pop()
-                        break
-
-                    current_response += token
-
-                # Check for duplicates before adding
-                response_text = current_response.strip()
-                if response_text in seen_texts:
-                    # Duplicate, skip and try again
-                    continue
-
-                # Unique response - add it and stream to frontend
-                seen_texts.add(response_text)
+            # All candidates decode together on the sample pool; each is
+            # streamed as it completes
+            candidates = executors.sample.stream(
+                model.sample_candidates,
+                full_prompt,
+                n=8,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                use_top_k=use_top_k,
+            )
+            for response_text, response_tokens in candidates:
                 i = len(responses)
 
-                # Stream tokens for this response (decode each token individually)
+                # Stream tokens for this response, split at character boundaries
+                detokenizer = model.detokenizer()
                 for tid in response_tokens:
-                    token_str = model.tokenizer.decode([tid])
+                    token_str = detokenizer.feed(tid)
+                    if token_str:
+                        yield f"data: {json.dumps({'index': i, 'token': token_str, 'done': False})}\n\n"
+                token_str = detokenizer.flush()
+                if token_str:
                     yield f"data: {json.dumps({'index': i, 'token': token_str, 'done': False})}\n\n"
 
                 # Send completion for this response
@@ -435,7 +437,7 @@ def grpo_generate():
                 yield f"data: {json.dumps({'index': i, 'done': True, 'full_response': response_text, 'tokens': response_tokens})}\n\n"
 
             # Send final message with all responses
-            yield f"data: {json.dumps({'all_done': True, 'responses': responses})}\n\n"
+            yield f"data: {json.dumps({'all_done': True, 'responses': responses, 'truncated': candidates.truncated})}\n\n"
 
         except Exception as e:
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
@@ -445,6 +447,53 @@ def grpo_generate():
     )
 
 
+def record_training_step(prompt_text, responses, rewards, training_result) -> str:
+    """
+    Append a finished training step to the history and checkpoint it.
+
+    Must run on the training worker (see Model.do_training_step's on_trained)
+    so the snapshot is of this step's weights. The checkpoint is written in
+    the background; the record's checkpoint_status tracks it. Returns the
+    checkpoint name.
+    """
+    # Determine type based on group size
+    train_type = "pair" if len(responses) == 2 else "group"
+
+    # Decode responses to text for display
+    response_texts = [model.decode_tokens(r) for r in responses]
+
+    # Save to persistent training history
+    step_id = training_history.append(
+        {
+            "timestamp": datetime.now().isoformat(),
+            "type": train_type,
+            "prompt": prompt_text,
+            "responses": responses,
+            "response_texts": response_texts,
+            "rewards": rewards,
+            "probability_changes": training_result["probability_changes"],
+            "l2_diff": training_result["l2_diff"],
+            "kl_divergence": training_result["kl_divergence"],
+            "steps_taken": training_result["steps_taken"],
+            "checkpoint_status": "saving",
+        }
+    )
+    # Steps without a "checkpoint" field use step_<id>
+    checkpoint_name = f"step_{step_id}"
+
+    # Snapshot now, write in the background; the record tracks progress
+    def on_checkpoint_written(path, error):
+        if error is None:
+            training_history.update(step_id, checkpoint_status="saved")
+        else:
+            training_history.update(
+                step_id, checkpoint_status="failed", checkpoint_error=str(error)
+            )
+
+    model.save_checkpoint_async(checkpoint_name, on_done=on_checkpoint_written)
+    return checkpoint_name
+
+
 @app.route("/api/train", methods=["POST"])
 def train():
     """
@@ -454,15 +503,18 @@ def train():
     {
         "prompt": str,
         "responses": [[int, ...], ...],  # Token ID sequences for each response
-        "rewards": [float, ...]          # Reward for each response
+        "rewards": [float, ...],         # Reward for each response
+        "diagnostics": bool              # Optional, default TRAINING_DIAGNOSTICS
     }
 
-    Returns probability changes for each response.
+    Queues the training step and returns {"job_id", "position"} (202); follow
+    /api/train/<job_id>/events for progress and the probability changes.
     """
     data = request.json
     prompt_text = data.get("prompt", "")
     responses = data.get("responses", [])
     rewards = data.get("rewards", [])
+    diagnostics = bool(data.get("diagnostics", TRAINING_DIAGNOSTICS))
 
     if not prompt_text or not responses or not rewards:
         return jsonify({"error": "Missing required fields"}), 400
@@ -470,65 +522,82 @@ def train():
     if len(responses) != len(rewards):
         return jsonify({"error": "responses and rewards must have same length"}), 400
 
-    try:
-        # Tokenize the prompt
-        prompt_tokens = model.tokenizer.encode(prompt_text)
+    # Tokenize the prompt
+    prompt_tokens = model.tokenizer.encode(prompt_text)
+
+    job = training_jobs.create()
+    position = training_jobs.position(job)
+    job.emit({"type": "queued", "job_id": job.id, "position": position})
 
-        # Call unified training step (loops until target KL reached)
-        training_result = model.do_training_step(
-            prompt=prompt_tokens, responses=responses, rewards=rewards
+    def on_progress(step, max_steps):
+        job.emit(
+            {"type": "progress", "step": step, "max_steps": max_steps},
+            status="running",
         )
 
-        probability_changes = training_result["probability_changes"]
-        l2_diff = training_result["l2_diff"]
-        kl_divergence = training_result["kl_divergence"]
-        steps_taken = training_result["steps_taken"]
+    # Recorded on the training worker as soon as the step's weights go live,
+    # so the checkpoint snapshot holds exactly this step's weights
+    def on_trained(result):
+        checkpoint_name = record_training_step(prompt_text, responses, rewards, result)
+        job.emit(
+            {
+                "type": "done",
+                "success": True,
+                "prompt_length": len(prompt_tokens),
+                "probability_changes": result["probability_changes"],
+                "l2_diff": result["l2_diff"],
+                "kl_divergence": result["kl_divergence"],
+                "steps_taken": result["steps_taken"],
+                "checkpoint_saved": checkpoint_name,
+            },
+            status="done",
+        )
 
-        # Determine type based on group size
-        train_type = "pair" if len(responses) == 2 else "group"
+    def on_finished(future):
+        error = future.exception()
+        if error is not None:
+            job.emit({"type": "error", "error": str(error)}, status="failed")
 
-        # Decode responses to text for display
-        response_texts = [model.tokenizer.decode(r) for r in responses]
+    # Call unified training step (loops until target KL reached)
+    model.submit_training_step(
+        prompt=prompt_tokens,
+        responses=responses,
+        rewards=rewards,
+        on_trained=on_trained,
+        diagnostics=diagnostics,
+        on_progress=on_progress,
+    ).add_done_callback(on_finished)
 
-        # Save to persistent training history
-        history = load_training_history()
-        step_num = len(history["steps"]) + 1
+    return jsonify({"job_id": job.id, "position": position}), 202
 
-        checkpoint_name = f"step_{step_num}"
 
-        save_training_step(
-            {
-                "timestamp": datetime.now().isoformat(),
-                "type": train_type,
-                "prompt": prompt_text,
-                "responses": responses,
-                "response_texts": response_texts,
-                "rewards": rewards,
-                "probability_changes": probability_changes,
-                "l2_diff": l2_diff,
-                "kl_divergence": kl_divergence,
-                "steps_taken": steps_taken,
-                "checkpoint": checkpoint_name,
-            }
-        )
+@app.route("/api/train/<job_id>", methods=["GET"])
+def train_job(job_id):
+    """Current status and latest event of a training job."""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.summary())
 
-        # Save checkpoint for this training step
-        checkpoint_path = model.save_checkpoint(checkpoint_name)
 
-        return jsonify(
-            {
-                "success": True,
-                "prompt_length": len(prompt_tokens),
-                "probability_changes": probability_changes,
-                "l2_diff": l2_diff,
-                "kl_divergence": kl_divergence,
-                "steps_taken": steps_taken,
-                "checkpoint_saved": checkpoint_name,
-            }
-        )
+@app.route("/api/train/<job_id>/events", methods=["GET"])
+def train_job_events(job_id):
+    """
+    Stream a training job's events over SSE, from the first one:
+    queued, progress (per optimizer step), then done or error.
+    """
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def event_stream():
+        for event in job.stream():
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"data: {json.dumps(event)}\n\n"
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+    return Response(stream_with_context(event_stream()), mimetype="text/event-stream")
 
 
 @app.route("/api/admin/login", methods=["POST"])
@@ -545,84 +614,64 @@ def admin_login():
 @app.route("/api/admin/training-steps", methods=["GET"])
 @admin_required
 def admin_training_steps():
-    """Return training steps with checkpoint status."""
-    history = load_training_history()
-    checkpoints_dir = Path(os.environ.get("CHECKPOINTS_DIR", "checkpoints"))
-    for step in history["steps"]:
-        cp_name = step.get("checkpoint", f"step_{step['id']}")
-        cp_path = checkpoints_dir / f"{cp_name}.pt"
+    """Return training steps with checkpoint status (paged like /api/training-history)."""
+    offset, limit = page_args()
+    steps, total = training_history.page(offset, limit)
+    for step in steps:
+        cp_path = checkpoint_file(step)
         step["checkpoint_exists"] = cp_path.exists()
         step["checkpoint_path"] = str(cp_path)
-    return jsonify(history)
+    return jsonify({"steps": steps, "total": total, "offset": offset})
+
+
+@app.route("/api/admin/cache-stats", methods=["GET"])
+@admin_required
+def admin_cache_stats():
+    """Return probability cache, prefix KV cache and model pool counters."""
+    return jsonify(
+        {
+            **model.cache_stats(),
+            "model_pool": pool.stats(),
+            "sessions": sessions.stats(),
+            "executors": executors.stats(),
+        }
+    )
 
 
 @app.route("/api/admin/conversations", methods=["GET"])
 @admin_required
 def admin_conversations():
-    """List all saved conversations."""
-    convos = []
-    if CONVERSATIONS_DIR.exists():
-        for f in sorted(CONVERSATIONS_DIR.glob("*.json"), reverse=True):
-            try:
-                data = json.loads(f.read_text())
-                # Parse message count from history
-                hist = data.get("history", "")
-                msg_count = hist.count("<|Them|>") + hist.count("<|Me|>")
-                # Extract first user message as preview
-                preview = ""
-                if "<|Them|>" in hist:
-                    after_them = hist.split("<|Them|>")[1]
-                    preview = after_them.split("<|")[0][:80]
-                elif "<|Me|>" in hist:
-                    after_me = hist.split("<|Me|>")[1]
-                    preview = after_me.split("<|")[0][:80]
-                # Parse user agent into short device label
-                ua = data.get("user_agent", "")
-                device = ""
-                if ua:
-                    if "iPhone" in ua:
-                        device = "iPhone"
-                    elif "iPad" in ua:
-                        device = "iPad"
-                    elif "Android" in ua:
-                        device = "Android"
-                    elif "Macintosh" in ua:
-                        device = "Mac"
-                    elif "Windows" in ua:
-                        device = "Windows"
-                    elif "Linux" in ua:
-                        device = "Linux"
-                convos.append({
-                    "session_id": data.get("session_id", f.stem),
-                    "created_at": data.get("created_at"),
-                    "updated_at": data.get("updated_at"),
-                    "message_count": msg_count,
-                    "preview": preview,
-                    "device": device,
-                })
-            except (json.JSONDecodeError, KeyError):
-                continue
-    return jsonify({"conversations": convos})
+    """
+    List saved conversations, newest first.
+
+    Query params: offset, limit, sort (created_at, updated_at or
+    message_count) and order (asc or desc).
+    """
+    offset, limit = page_args()
+    sort = request.args.get("sort", "created_at")
+    if sort not in SORT_COLUMNS:
+        return jsonify({"error": f"sort must be one of {', '.join(SORT_COLUMNS)}"}), 400
+    descending = request.args.get("order", "desc") != "asc"
+    convos, total = conversation_store.list(offset, limit, sort, descending)
+    return jsonify({"conversations": convos, "total": total, "offset": offset})
 
 
 @app.route("/api/admin/conversations/<session_id>", methods=["GET"])
 @admin_required
 def admin_conversation_detail(session_id):
     """Return a single conversation's full history."""
-    filepath = safe_conversation_path(session_id)
-    if not filepath or not filepath.exists():
+    data = conversation_store.get(session_id)
+    if not data:
         return jsonify({"error": "Not found"}), 404
-    data = json.loads(filepath.read_text())
     return jsonify(data)
 
 
 @app.route("/api/conversation/<session_id>", methods=["GET"])
 def get_conversation(session_id):
     """Return a conversation's history (public, for replay)."""
-    filepath = safe_conversation_path(session_id)
-    if not filepath or not filepath.exists():
+    data = conversation_store.get(session_id)
+    if not data:
         return jsonify({"error": "Not found"}), 404
-    data = json.loads(filepath.read_text())
     return jsonify({"history": data.get("history", "")})
 
 
@@ -634,22 +683,21 @@ def admin_delete_checkpoint():
     if not step_id:
         return jsonify({"error": "step_id required"}), 400
 
-    history = load_training_history()
-    step = next((s for s in history["steps"] if s["id"] == step_id), None)
+    step = training_history.get(step_id)
     if not step:
         return jsonify({"error": "Step not found"}), 404
+    if step.get("checkpoint_status") == "saving":
+        return jsonify({"error": "Checkpoint is still being written"}), 409
 
     # Delete the checkpoint file
-    cp_name = step.get("checkpoint", f"step_{step_id}")
-    checkpoints_dir = Path(os.environ.get("CHECKPOINTS_DIR", "checkpoints"))
-    cp_path = checkpoints_dir / f"{cp_name}.pt"
+    cp_path = checkpoint_file(step)
     if cp_path.exists():
         cp_path.unlink()
+        # Drop delta blobs no remaining checkpoint refers to
+        model._checkpoint_store.collect_garbage(cp_path.parent)
 
     # Mark as deleted in training history
-    step["deleted"] = True
-    with open(TRAINING_HISTORY_PATH, "w") as f:
-        yaml.dump(history, f, default_flow_style=False)
+    training_history.update(step_id, deleted=True)
 
     return jsonify({"success": True})
 
@@ -662,15 +710,14 @@ def admin_rollback():
     if not step_id:
         return jsonify({"error": "step_id required"}), 400
 
-    history = load_training_history()
-    step = next((s for s in history["steps"] if s["id"] == step_id), None)
+    step = training_history.get(step_id)
     if not step:
         return jsonify({"error": "Step not found"}), 404
 
-    cp_name = step.get("checkpoint", f"step_{step_id}")
-    checkpoints_dir = Path(os.environ.get("CHECKPOINTS_DIR", "checkpoints"))
-    cp_path = checkpoints_dir / f"{cp_name}.pt"
+    if step.get("checkpoint_status") == "saving":
+        return jsonify({"error": "Checkpoint is still being written"}), 409
 
+    cp_path = checkpoint_file(step)
     if not cp_path.exists():
         return jsonify({"error": "Checkpoint file not found (deleted?)"}), 404
 
@@ -729,10 +776,93 @@ if __name__ == "__main__":
         default=os.environ.get("ADMIN_PASSWORD"),
         help="Password for /admin dashboard (or set ADMIN_PASSWORD env var)",
     )
+    arguments.add_argument(
+        "--max-batch",
+        type=int,
+        default=32,
+        help="Maximum number of chat sequences decoded together per step (default: 32)",
+    )
+    arguments.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Decode chat replies speculatively with n-gram drafts",
+    )
+    arguments.add_argument(
+        "--draft-dataset",
+        type=str,
+        default=os.path.join("data", "text_data", "imessages_dataset.txt"),
+        help="Text the speculative drafter builds its n-gram table from"
+        " (default: data/text_data/imessages_dataset.txt)",
+    )
+    arguments.add_argument(
+        "--quantize",
+        action="store_true",
+        help="Serve from int8-quantized weights (or set QUANTIZE=int8)",
+    )
+    arguments.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the decode step (warms up at startup)",
+    )
+    for pool_name, help_text in (
+        ("decode", "chat decode"),
+        ("expand", "beam trees and expand-depth"),
+        ("sample", "GRPO candidate sampling"),
+        ("train", "training steps"),
+    ):
+        arguments.add_argument(
+            f"--{pool_name}-threads",
+            type=int,
+            default=None,
+            help=f"torch intra-op threads for {help_text}"
+            f" (or set {pool_name.upper()}_THREADS)",
+        )
+    arguments.add_argument(
+        "--expand-workers",
+        type=int,
+        default=None,
+        help="Concurrent expansion jobs (or set EXPAND_WORKERS; default: 1)",
+    )
+    arguments.add_argument(
+        "--sample-workers",
+        type=int,
+        default=None,
+        help="Concurrent GRPO sampling streams (or set SAMPLE_WORKERS; default: 2)",
+    )
+    arguments.add_argument(
+        "--sample-time-limit",
+        type=float,
+        default=None,
+        help="Seconds a GRPO sampling stream may run before it ends early"
+        " (or set SAMPLE_TIME_LIMIT; default: no limit)",
+    )
     args = arguments.parse_args()
+    executors.configure(
+        decode_threads=args.decode_threads,
+        expand_threads=args.expand_threads,
+        expand_workers=args.expand_workers,
+        sample_threads=args.sample_threads,
+        sample_workers=args.sample_workers,
+        sample_time_limit=args.sample_time_limit,
+        train_threads=args.train_threads,
+    )
 
     ADMIN_PASSWORD = args.admin_password
-    model = Model(checkpoint_path=args.checkpoint)
+    training_history = TrainingHistory(
+        TRAINING_HISTORY_PATH, legacy_yaml_path=LEGACY_TRAINING_HISTORY_PATH
+    )
+    # Checkpoint writes a previous run didn't finish are now done or lost
+    training_history.resolve_saving(lambda step: checkpoint_file(step).exists())
+    conversation_store = ConversationStore(
+        CONVERSATIONS_DB_PATH, legacy_dir=CONVERSATIONS_DIR
+    )
+    model = Model(checkpoint_path=args.checkpoint, quantize=args.quantize or None)
+    if args.speculative:
+        model.enable_speculation(args.draft_dataset)
+    if args.compile:
+        model.enable_compile()
+    model.scheduler = DecodeScheduler(model, max_batch=args.max_batch).start()
+    pool = ModelPool(model, max_batch=args.max_batch)
 
     # Create static folder if it doesn't exist
     os.makedirs("static", exist_ok=True)
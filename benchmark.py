@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+"""
+Inference benchmarks for MikeGPT.
+
+    python benchmark.py decode --checkpoint checkpoints/pretrained.pt
+    python benchmark.py history-tokens --dataset data/text_data/imessages_dataset.txt
+    python benchmark.py sampling --rows 1 8 32
+    python benchmark.py speculative --dataset data/text_data/imessages_dataset.txt
+    python benchmark.py quantization --dataset data/text_data/imessages_dataset.txt
+    python benchmark.py compile --batches 1 4 16
+    python benchmark.py batching --streams 16
+    python benchmark.py rollback --depth 19
+"""
+
+import argparse
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from checkpoints import DeltaCheckpointStore
+from kv_cache import shift_window_matches
+from model import Model
+from quantization import module_bytes, quantize_int8
+from sampling import ENDOFTEXT_ID, SILENT_TOKENS, sample, suppression_bias
+
+
+def _ms(seconds: float) -> float:
+    return seconds * 1000
+
+
+def bench_decode(args):
+    """Decode ms/token before and after the context window overflows."""
+    model = Model(checkpoint_path=args.checkpoint)
+    prompt = "<|ConversationStart|><|Them|>" + args.prompt + "<|Me|>"
+    total = model.context_length + args.overflow_tokens
+
+    # Like Model.__init__ for KV_WINDOW=shift: only time shifting if the
+    # self-test confirms this model's cache layout and RoPE support it
+    modes = ["reencode"]
+    if shift_window_matches(model.model, model.rope_theta, model.vocab_size):
+        modes.append("shift")
+
+    print(f"{'mode':<10} {'before overflow':>16} {'after overflow':>16}")
+    for mode in modes:
+        model.kv_window = mode
+        torch.manual_seed(0)
+        state = model.prime(prompt, top_p=0.9)
+        before, after = [], []
+        for _ in range(total):
+            overflowed = len(state.tokens) >= model.context_length
+            start = time.perf_counter()
+            model.decode_step([state])
+            elapsed = time.perf_counter() - start
+            (after if overflowed else before).append(elapsed)
+        print(
+            f"{mode:<10} {_ms(sum(before) / len(before)):>13.2f} ms"
+            f" {_ms(sum(after) / max(len(after), 1)):>13.2f} ms"
+        )
+    if "shift" not in modes:
+        print(f"{'shift':<10} skipped: failed its self-test")
+
+
+def _conversations(args) -> list[str]:
+    """Chat histories from --dataset, or else from the conversation database."""
+    if args.dataset:
+        with open(args.dataset, encoding="utf-8") as f:
+            text = f.read()
+        return [
+            "<|ConversationStart|>" + c
+            for c in text.split("<|ConversationStart|>")
+            if c.strip()
+        ][: args.limit]
+    from conversation_store import ConversationStore
+
+    store = ConversationStore(
+        os.path.join(os.path.dirname(__file__), "data", "conversations.db")
+    )
+    rows, _ = store.list(limit=args.limit)
+    return [store.get(row["session_id"])["history"] for row in rows]
+
+
+def bench_history_tokens(args):
+    """Check per-turn incremental history encoding against full re-encoding."""
+    model = Model(checkpoint_path=args.checkpoint)
+    encode = model.tokenizer.encode
+    conversations = _conversations(args)
+
+    mismatches = turns = 0
+    incremental = full = 0.0
+    for history in conversations:
+        # Each turn appends one segment starting at a speaker token, as /api/generate does
+        segments = re.split(r"(?=<\|(?:Them|Me)\|>)", history)
+        text, tokens = "", []
+        for segment in filter(None, segments):
+            start = time.perf_counter()
+            tokens = tokens + encode(segment)
+            incremental += time.perf_counter() - start
+            text += segment
+
+            start = time.perf_counter()
+            expected = encode(text)
+            full += time.perf_counter() - start
+            turns += 1
+            if tokens != expected:
+                mismatches += 1
+                print(f"MISMATCH after {len(text)} chars: ...{text[-60:]!r}")
+                tokens = expected
+
+    print(f"{len(conversations)} conversations, {turns} turns, {mismatches} mismatches")
+    print(
+        f"encode per turn: incremental {_ms(incremental / max(turns, 1)):.3f} ms,"
+        f" full {_ms(full / max(turns, 1)):.3f} ms"
+    )
+    if mismatches:
+        sys.exit(1)
+
+
+def _sample_sorted(logits, temperature, top_p, silent) -> int:
+    """The previous per-row sampler: in-place masking and a full-vocab sort."""
+    last_logits = logits / temperature
+    last_logits[ENDOFTEXT_ID] = float("-inf")
+    last_logits[silent] = float("-inf")
+    probs = torch.softmax(last_logits, dim=-1)
+    sorted_probs, sorted_indices = torch.sort(probs, descending=True)
+    cutoff = torch.searchsorted(torch.cumsum(sorted_probs, dim=-1), top_p) + 1
+    nucleus = sorted_probs[:cutoff] / sorted_probs[:cutoff].sum()
+    return int(sorted_indices[torch.multinomial(nucleus, 1)].item())
+
+
+def bench_sampling(args):
+    """Per-token top-p sampling cost: full sort per row vs batched partial top-k."""
+    vocab_size = 8192
+    bias = suppression_bias(vocab_size, [ENDOFTEXT_ID, *SILENT_TOKENS])
+    torch.manual_seed(0)
+
+    print(f"{'rows':>6} {'sorted per row':>16} {'batched':>16}")
+    for rows in args.rows:
+        # Peaked logits, like a trained model's next-token distributions
+        logits = torch.randn(rows, vocab_size) * args.logit_scale
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            for row in logits:
+                _sample_sorted(row, 1.0, args.top_p, SILENT_TOKENS)
+        sorted_time = (time.perf_counter() - start) / (args.iterations * rows)
+
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            sample(logits, top_p=args.top_p, bias=bias)
+        batched_time = (time.perf_counter() - start) / (args.iterations * rows)
+
+        print(
+            f"{rows:>6} {_ms(sorted_time):>13.3f} ms {_ms(batched_time):>13.3f} ms"
+        )
+
+
+def bench_speculative(args):
+    """Chat decode tokens/s with and without speculative n-gram drafts."""
+    model = Model(checkpoint_path=args.checkpoint)
+    prompt = "<|ConversationStart|><|Them|>" + args.prompt + "<|Me|>"
+
+    print(f"{'mode':<12} {'tokens/s':>10} {'accepted/drafted':>18}")
+    for speculative in (False, True):
+        if speculative:
+            model.enable_speculation()
+            if args.dataset:
+                model.drafter.fit_file_async(args.dataset, model.tokenizer.encode).join()
+        torch.manual_seed(0)
+        produced = 0
+        start = time.perf_counter()
+        for _ in range(args.samples):
+            state = model.prime(prompt, top_p=0.5)
+            while len(state.tokens) < model.context_length - 8:
+                produced += len(model.decode_steps([state])[0])
+        elapsed = time.perf_counter() - start
+        stats = model.cache_stats()["speculative"]
+        rate = f"{stats['accepted']}/{stats['drafted']}" if speculative else "-"
+        print(
+            f"{'speculative' if speculative else 'plain':<12}"
+            f" {produced / elapsed:>10.1f} {rate:>18}"
+        )
+
+
+def bench_quantization(args):
+    """Perplexity, probability drift and speed of int8 vs fp32 inference."""
+    model = Model(checkpoint_path=args.checkpoint, quantize=False)
+    fp32 = model.model
+    int8 = quantize_int8(fp32)
+
+    # Validation set: the tail of the dataset, in context-length windows
+    with open(args.dataset, encoding="utf-8") as f:
+        text = f.read()
+    text = text[int(len(text) * (1 - args.validation_fraction)) :]
+    tokens = model.tokenizer.encode(text)
+    width = model.context_length
+    windows = torch.tensor(
+        [tokens[i : i + width] for i in range(0, len(tokens) - width, width)][
+            : args.windows
+        ],
+        dtype=torch.long,
+    )
+
+    nll = {"fp32": 0.0, "int8": 0.0}
+    elapsed = {"fp32": 0.0, "int8": 0.0}
+    kl_sum = max_drift = agree = positions = 0
+    for batch in windows.split(args.batch_size):
+        inputs, targets = batch[:, :-1], batch[:, 1:]
+        log_probs = {}
+        for name, module in (("fp32", fp32), ("int8", int8)):
+            start = time.perf_counter()
+            logits = module(inputs)
+            elapsed[name] += time.perf_counter() - start
+            log_probs[name] = torch.log_softmax(logits.float(), dim=-1)
+            nll[name] -= (
+                log_probs[name].gather(-1, targets.unsqueeze(-1)).sum().item()
+            )
+        reference, quantized = log_probs["fp32"], log_probs["int8"]
+        kl_sum += (reference.exp() * (reference - quantized)).sum().item()
+        max_drift = max(
+            max_drift, (reference.exp() - quantized.exp()).abs().max().item()
+        )
+        agree += (reference.argmax(-1) == quantized.argmax(-1)).sum().item()
+        positions += targets.numel()
+
+    print(f"{len(windows)} windows, {positions} positions")
+    print(f"{'':<6} {'perplexity':>12} {'forward':>12} {'weights':>10}")
+    for name, module in (("fp32", fp32), ("int8", int8)):
+        print(
+            f"{name:<6} {math.exp(nll[name] / positions):>12.3f}"
+            f" {_ms(elapsed[name] / len(windows)):>9.2f} ms"
+            f" {module_bytes(module) / 2**20:>7.1f} MB"
+        )
+    print(f"mean KL(fp32 || int8): {kl_sum / positions:.5f}")
+    print(f"max |p_fp32 - p_int8|: {max_drift:.5f}")
+    print(f"top-1 agreement:       {agree / positions:.2%}")
+
+
+def bench_compile(args):
+    """Decode step latency per batch size, eager vs torch.compile'd."""
+    model = Model(checkpoint_path=args.checkpoint)
+    prompt = "<|ConversationStart|><|Them|>" + args.prompt + "<|Me|>"
+
+    def step_ms(batch: int) -> float:
+        torch.manual_seed(0)
+        states = [model.prime(prompt, top_p=0.9) for _ in range(batch)]
+        model.decode_step(states)  # the first step only samples the prompt logits
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            model.decode_step(states)
+        return _ms((time.perf_counter() - start) / args.steps)
+
+    eager = {batch: step_ms(batch) for batch in args.batches}
+    model.enable_compile()
+    compiled = {batch: step_ms(batch) for batch in args.batches}
+
+    print(f"{'batch':>6} {'eager':>12} {'compiled':>12} {'speedup':>8}")
+    for batch in args.batches:
+        print(
+            f"{batch:>6} {eager[batch]:>9.2f} ms {compiled[batch]:>9.2f} ms"
+            f" {eager[batch] / compiled[batch]:>7.2f}x"
+        )
+
+
+def bench_batching(args):
+    """Decode tokens/s for concurrent streams whose lengths all differ."""
+    model = Model(checkpoint_path=args.checkpoint)
+    base = model.tokenizer.encode(
+        "<|ConversationStart|><|Them|>" + args.prompt + "<|Me|>"
+    )
+    # Streams that started at different times: every cache length differs
+    prompts = [
+        (base * model.context_length)[: args.min_length + i * args.spread]
+        for i in range(args.streams)
+    ]
+
+    print(f"{'length bucket':>14} {'batches/step':>13} {'tokens/s':>10}")
+    for bucket in sorted({1, *args.buckets}):
+        model.decode_length_bucket = bucket
+        torch.manual_seed(0)
+        states = [model.prime(prompt, top_p=0.9) for prompt in prompts]
+        model.decode_step(states)  # the first step only samples the prompt logits
+        groups = len(model._length_groups(states))
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            model.decode_step(states)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{bucket:>14} {groups:>13}"
+            f" {args.streams * args.steps / elapsed:>10.1f}"
+        )
+
+
+def bench_rollback(args):
+    """Cold load of a deep delta checkpoint vs its flattened copy vs a full .pt."""
+    weights = DeltaCheckpointStore().load(args.checkpoint, part="model")
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path = Path(tmp) / "full.pt"
+        torch.save({"model": weights}, full_path)
+
+        # A chain of small GRPO-like updates, each saved against the last
+        writer = DeltaCheckpointStore(keyframe_every=args.depth + 1)
+        torch.manual_seed(0)
+        parent = None
+        for step in range(args.depth + 1):
+            weights = {
+                name: t + 1e-4 * torch.randn_like(t) if t.is_floating_point() else t
+                for name, t in weights.items()
+            }
+            path = Path(tmp) / f"step_{step}.pt"
+            writer.save({"model": weights, "parent": parent}, path)
+            parent = path
+
+        def cold_load(path) -> float:
+            start = time.perf_counter()
+            state = DeltaCheckpointStore().load(path, part="model")
+            sum(t.sum().item() for t in state.values())  # touch every page
+            return time.perf_counter() - start
+
+        timings = {"delta": cold_load(parent), "flattened": cold_load(parent)}
+        timings["full .pt"] = cold_load(full_path)
+
+    print(f"depth {args.depth} delta chain")
+    for name, elapsed in timings.items():
+        print(f"{name:<10} {_ms(elapsed):>10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MikeGPT inference benchmarks")
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=os.path.join(
+            os.environ.get("CHECKPOINTS_DIR", "checkpoints"), "pretrained.pt"
+        ),
+        help="Model checkpoint to benchmark (default: $CHECKPOINTS_DIR/pretrained.pt)",
+    )
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    decode = subparsers.add_parser("decode", help=bench_decode.__doc__)
+    decode.add_argument("--prompt", type=str, default="hey what are you up to")
+    decode.add_argument(
+        "--overflow-tokens",
+        type=int,
+        default=256,
+        help="Tokens to decode past the context window (default: 256)",
+    )
+    decode.set_defaults(func=bench_decode)
+
+    history_tokens = subparsers.add_parser(
+        "history-tokens", help=bench_history_tokens.__doc__
+    )
+    history_tokens.add_argument(
+        "--dataset",
+        type=str,
+        default=None,
+        help="Text file of <|ConversationStart|>-separated chats"
+        " (default: the saved conversations)",
+    )
+    history_tokens.add_argument(
+        "--limit",
+        type=int,
+        default=200,
+        help="Conversations to check (default: 200)",
+    )
+    history_tokens.set_defaults(func=bench_history_tokens)
+
+    sampling = subparsers.add_parser("sampling", help=bench_sampling.__doc__)
+    sampling.add_argument(
+        "--rows", type=int, nargs="+", default=[1, 8, 32], help="Batch sizes"
+    )
+    sampling.add_argument("--top-p", type=float, default=0.45)
+    sampling.add_argument(
+        "--logit-scale",
+        type=float,
+        default=4.0,
+        help="Std of the random logits; higher means peakier (default: 4.0)",
+    )
+    sampling.add_argument("--iterations", type=int, default=200)
+    sampling.set_defaults(func=bench_sampling)
+
+    speculative = subparsers.add_parser(
+        "speculative", help=bench_speculative.__doc__
+    )
+    speculative.add_argument("--prompt", type=str, default="hey what are you up to")
+    speculative.add_argument(
+        "--dataset",
+        type=str,
+        default=None,
+        help="Text file for the drafter's n-gram table (default: history only)",
+    )
+    speculative.add_argument(
+        "--samples", type=int, default=5, help="Generations per mode (default: 5)"
+    )
+    speculative.set_defaults(func=bench_speculative)
+
+    quantization = subparsers.add_parser(
+        "quantization", help=bench_quantization.__doc__
+    )
+    quantization.add_argument(
+        "--dataset",
+        type=str,
+        default=os.path.join("data", "text_data", "imessages_dataset.txt"),
+        help="Text whose tail is the validation set"
+        " (default: data/text_data/imessages_dataset.txt)",
+    )
+    quantization.add_argument(
+        "--validation-fraction",
+        type=float,
+        default=0.1,
+        help="Trailing fraction of the dataset to evaluate on (default: 0.1)",
+    )
+    quantization.add_argument(
+        "--windows",
+        type=int,
+        default=256,
+        help="Context windows to evaluate (default: 256)",
+    )
+    quantization.add_argument("--batch-size", type=int, default=16)
+    quantization.set_defaults(func=bench_quantization)
+
+    compile_ = subparsers.add_parser("compile", help=bench_compile.__doc__)
+    compile_.add_argument("--prompt", type=str, default="hey what are you up to")
+    compile_.add_argument(
+        "--batches", type=int, nargs="+", default=[1, 4, 16], help="Batch sizes"
+    )
+    compile_.add_argument(
+        "--steps",
+        type=int,
+        default=64,
+        help="Decode steps timed per batch size (default: 64)",
+    )
+    compile_.set_defaults(func=bench_compile)
+
+    batching = subparsers.add_parser("batching", help=bench_batching.__doc__)
+    batching.add_argument("--prompt", type=str, default="hey what are you up to")
+    batching.add_argument(
+        "--streams", type=int, default=16, help="Concurrent generations"
+    )
+    batching.add_argument(
+        "--min-length",
+        type=int,
+        default=24,
+        help="Prompt tokens of the shortest stream (default: 24)",
+    )
+    batching.add_argument(
+        "--spread",
+        type=int,
+        default=3,
+        help="Extra prompt tokens per stream (default: 3)",
+    )
+    batching.add_argument(
+        "--buckets",
+        type=int,
+        nargs="+",
+        default=[4, 8, 16],
+        help="Length buckets to compare against exact-length batching",
+    )
+    batching.add_argument(
+        "--steps",
+        type=int,
+        default=64,
+        help="Decode steps timed per bucket (default: 64)",
+    )
+    batching.set_defaults(func=bench_batching)
+
+    rollback = subparsers.add_parser("rollback", help=bench_rollback.__doc__)
+    rollback.add_argument(
+        "--depth",
+        type=int,
+        default=19,
+        help="Deltas between the keyframe and the loaded step (default: 19)",
+    )
+    rollback.set_defaults(func=bench_rollback)
+
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+"""
+Checkpoint persistence.
+
+Checkpoints are written atomically (temp file + rename), so a crash mid-write
+never leaves a truncated .pt behind. CheckpointWriter moves the write off
+the request path: the caller snapshots the state (a cheap in-memory copy)
+and a background thread does the disk I/O.
+
+DeltaCheckpointStore keeps training checkpoints small. A step_N.pt is a
+manifest naming its parent checkpoint and one content-addressed blob per
+tensor under checkpoints/.store. A blob holds either the full tensor or the
+XOR of its bytes against the same tensor in the parent. After a GRPO step
+the sign/exponent bytes barely change, so the byte-shuffled XOR compresses
+well. Unchanged tensors hash to an existing blob and cost nothing.
+
+Materializing a delta means reading and inflating up to keyframe_every blobs
+per tensor, so the first load of a manifest also writes the result as a full
+checkpoint under checkpoints/.flat. Loading it again (a rollback to a recent
+step, say) memory-maps that instead. Only the most recently used few are
+kept.
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+DELTA_FORMAT = "mikegpt-delta-v1"
+
+
+def clone_state(state):
+    """Copy every tensor in a (nested) state dict so later updates can't touch it."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().clone()
+    if isinstance(state, dict):
+        return {key: clone_state(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(clone_state(value) for value in state)
+    return state
+
+
+def atomic_save(state: dict, path) -> None:
+    """torch.save to a temp file in the same directory, then rename into place."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class CheckpointWriter:
+    """Single background thread that saves queued checkpoint snapshots in order."""
+
+    def __init__(self, save=atomic_save):
+        self._save = save
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, state: dict, path, on_done=None) -> None:
+        """
+        Queue a snapshot for writing.
+
+        on_done(path, error) is called from the writer thread once the file is
+        in place (error=None) or the write failed.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="checkpoint-writer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put((state, str(path), on_done))
+
+    def pending(self) -> int:
+        """Number of snapshots queued or being written."""
+        return self._queue.unfinished_tasks
+
+    def wait(self) -> None:
+        """Block until every queued snapshot has been written."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            state, path, on_done = self._queue.get()
+            error = None
+            try:
+                self._save(state, path)
+            except Exception as e:
+                error = e
+                print(f"[checkpoint] Failed to write {path}: {e}")
+            try:
+                if on_done is not None:
+                    on_done(path, error)
+            finally:
+                self._queue.task_done()
+
+
+def _split_tensors(obj, prefix=""):
+    """Replace every tensor in a nested state with a reference to a flat key."""
+    if isinstance(obj, torch.Tensor):
+        return {"__tensor__": prefix}, {prefix: obj}
+    tensors = {}
+    if isinstance(obj, dict):
+        skeleton = {}
+        for key, value in obj.items():
+            skeleton[key], found = _split_tensors(value, f"{prefix}/{key}")
+            tensors.update(found)
+        return skeleton, tensors
+    if isinstance(obj, (list, tuple)):
+        items = []
+        for i, value in enumerate(obj):
+            item, found = _split_tensors(value, f"{prefix}/{i}")
+            items.append(item)
+            tensors.update(found)
+        return type(obj)(items), tensors
+    return obj, tensors
+
+
+def _join_tensors(skeleton, tensors: dict):
+    """Inverse of _split_tensors."""
+    if isinstance(skeleton, dict):
+        if set(skeleton) == {"__tensor__"}:
+            return tensors[skeleton["__tensor__"]]
+        return {key: _join_tensors(value, tensors) for key, value in skeleton.items()}
+    if isinstance(skeleton, (list, tuple)):
+        return type(skeleton)(_join_tensors(value, tensors) for value in skeleton)
+    return skeleton
+
+
+def _tensor_bytes(tensor) -> np.ndarray:
+    """Raw bytes of a tensor as a flat uint8 array."""
+    flat = tensor.detach().cpu().contiguous().reshape(-1)
+    return flat.view(torch.uint8).numpy()
+
+
+def _shuffle(raw: np.ndarray, itemsize: int) -> bytes:
+    """Group byte i of every element together (byte planes compress better)."""
+    return raw.reshape(-1, itemsize).T.tobytes()
+
+
+def _unshuffle(data: bytes, itemsize: int) -> np.ndarray:
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).reshape(-1)
+
+
+class DeltaCheckpointStore:
+    """
+    Content-addressed checkpoint store with parent-relative tensor deltas.
+
+    Blobs live in a .store directory next to the manifests. A delta chain is
+    cut with a full keyframe every keyframe_every steps so materializing any
+    checkpoint reads a bounded number of blobs. Materialized tensor bytes are
+    kept in an LRU of up to cache_bytes, so switching between recent steps
+    only decodes the links that changed.
+    """
+
+    def __init__(
+        self, keyframe_every: int = None, cache_bytes: int = None, flat_keep: int = None
+    ):
+        if keyframe_every is None:
+            keyframe_every = int(os.environ.get("CHECKPOINT_KEYFRAME_EVERY", 20))
+        if cache_bytes is None:
+            cache_bytes = int(os.environ.get("CHECKPOINT_CACHE_MB", 256)) * 1024 * 1024
+        if flat_keep is None:
+            flat_keep = int(os.environ.get("CHECKPOINT_FLAT_KEEP", 4))
+        self.keyframe_every = keyframe_every
+        self.cache_bytes = cache_bytes
+        self.flat_keep = flat_keep  # flattened manifests kept in .flat (0: none)
+        self._lock = threading.Lock()  # held while writing or collecting blobs
+        self._last_path = None  # manifest written most recently
+        self._last_manifest = None
+        self._raw_cache = OrderedDict()  # digest -> materialized raw bytes
+        self._raw_cache_nbytes = 0
+        self._raw_cache_lock = threading.Lock()
+
+    @staticmethod
+    def _blob_dir(path) -> Path:
+        return Path(path).parent / ".store"
+
+    @staticmethod
+    def _flat_dir(path) -> Path:
+        return Path(path).parent / ".flat"
+
+    def _flat_path(self, path, manifest: dict, part) -> Path:
+        """Where the flattened part of a manifest goes, keyed by its content."""
+        key = {
+            "part": part,
+            "state": manifest["state"],
+            "tensors": manifest["tensors"],
+        }
+        digest = hashlib.blake2b(
+            json.dumps(key, sort_keys=True, default=str).encode(), digest_size=20
+        ).hexdigest()
+        return self._flat_dir(path) / f"{digest}.pt"
+
+    def _save_flat(self, flat_path: Path, state):
+        """Write a flattened checkpoint, keeping only the flat_keep newest."""
+        try:
+            flat_path.parent.mkdir(exist_ok=True)
+            atomic_save(state, flat_path)
+        except OSError as e:
+            print(f"[checkpoint] Couldn't write {flat_path}: {e}")
+            return
+        flats = sorted(
+            flat_path.parent.glob("*.pt"), key=lambda p: p.stat().st_mtime, reverse=True
+        )
+        for stale in flats[self.flat_keep :]:
+            stale.unlink(missing_ok=True)
+
+    def _blob_path(self, blob_dir: Path, digest: str) -> Path:
+        return blob_dir / digest[:2] / digest
+
+    @staticmethod
+    def _read(path):
+        """
+        Memory-map a checkpoint file. Tensors in a full checkpoint are only
+        paged in from disk when they are touched.
+        """
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+
+    @staticmethod
+    def _is_manifest(state) -> bool:
+        return isinstance(state, dict) and state.get("format") == DELTA_FORMAT
+
+    def _read_manifest(self, path):
+        """Return the manifest at path, or None if it is a full checkpoint."""
+        state = self._read(path)
+        return state if self._is_manifest(state) else None
+
+    def _cache_get(self, digest: str):
+        with self._raw_cache_lock:
+            raw = self._raw_cache.get(digest)
+            if raw is not None:
+                self._raw_cache.move_to_end(digest)
+            return raw
+
+    def _cache_put(self, digest: str, raw: np.ndarray):
+        with self._raw_cache_lock:
+            if digest in self._raw_cache:
+                self._raw_cache.move_to_end(digest)
+                return
+            self._raw_cache[digest] = raw
+            self._raw_cache_nbytes += raw.nbytes
+            while self._raw_cache_nbytes > self.cache_bytes and self._raw_cache:
+                _, evicted = self._raw_cache.popitem(last=False)
+                self._raw_cache_nbytes -= evicted.nbytes
+
+    def is_delta(self, path) -> bool:
+        return self._read_manifest(path) is not None
+
+    def save(self, state: dict, path):
+        """
+        Write state as a delta manifest at path.
+
+        state may carry a "parent" entry naming the checkpoint it was trained
+        from; without a readable parent every tensor is stored in full. The
+        saved tensors are kept as the base for the next delta, so they must
+        not be modified afterwards (pass a clone_state() snapshot).
+        """
+        path = Path(path)
+        state = dict(state)
+        parent = state.pop("parent", None)
+        skeleton, tensors = _split_tensors(state)
+        blob_dir = self._blob_dir(path)
+
+        with self._lock:
+            base = self._parent_entries(parent)
+            entries = {}
+            for key, tensor in tensors.items():
+                entries[key] = self._put_tensor(blob_dir, tensor, base.get(key))
+            manifest = {
+                "format": DELTA_FORMAT,
+                "parent": str(parent) if parent else None,
+                "state": skeleton,
+                "tensors": entries,
+            }
+            atomic_save(manifest, path)
+            self._last_path = str(path)
+            self._last_manifest = manifest
+
+    def _parent_entries(self, parent) -> dict:
+        """Flat tensor key -> blob digest for the parent checkpoint."""
+        if not parent:
+            return {}
+        if str(parent) == self._last_path:
+            return self._last_manifest["tensors"]
+        try:
+            manifest = self._read_manifest(parent)
+        except (OSError, RuntimeError):
+            return {}
+        return manifest["tensors"] if manifest else {}
+
+    def _put_tensor(self, blob_dir: Path, tensor, base_digest) -> str:
+        raw = _tensor_bytes(tensor)
+        itemsize = tensor.element_size()
+        header = {
+            "dtype": str(tensor.dtype).removeprefix("torch."),
+            "shape": list(tensor.shape),
+            "itemsize": itemsize,
+        }
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(json.dumps(header, sort_keys=True).encode())
+        hasher.update(raw.tobytes())
+        digest = hasher.hexdigest()
+        # The next save most likely deltas against exactly these bytes
+        self._cache_put(digest, raw)
+
+        blob_path = self._blob_path(blob_dir, digest)
+        if blob_path.exists():
+            return digest
+
+        base_header = None
+        if base_digest is not None:
+            base_path = self._blob_path(blob_dir, base_digest)
+            if base_path.exists():
+                base_header = self._read_header(base_path)
+        if (
+            base_header is None
+            or base_header["depth"] + 1 >= self.keyframe_every
+            or base_header["dtype"] != header["dtype"]
+            or base_header["shape"] != header["shape"]
+        ):
+            header.update(base=None, depth=0)
+            payload = raw
+        else:
+            base_raw = self._materialize_raw(blob_dir, base_digest)
+            header.update(base=base_digest, depth=base_header["depth"] + 1)
+            payload = np.bitwise_xor(raw, base_raw)
+
+        data = zlib.compress(_shuffle(payload, itemsize), 1)
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = blob_path.with_name(f".{digest}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(data)
+        os.replace(tmp_path, blob_path)
+        return digest
+
+    @staticmethod
+    def _read_header(blob_path: Path) -> dict:
+        with open(blob_path, "rb") as f:
+            return json.loads(f.readline())
+
+    def _materialize_raw(self, blob_dir: Path, digest: str) -> np.ndarray:
+        """
+        Rebuild a blob's bytes, following its delta chain back to the nearest
+        cached link or keyframe.
+        """
+        target = digest
+        raw = self._cache_get(digest)
+        if raw is not None:
+            return raw
+        chain = []
+        while digest is not None:
+            with open(self._blob_path(blob_dir, digest), "rb") as f:
+                header = json.loads(f.readline())
+                data = f.read()
+            chain.append((header, data))
+            digest = header["base"]
+            raw = self._cache_get(digest) if digest is not None else None
+            if raw is not None:
+                break
+        for header, data in reversed(chain):
+            payload = _unshuffle(zlib.decompress(data), header["itemsize"])
+            raw = payload if raw is None else np.bitwise_xor(raw, payload)
+        self._cache_put(target, raw)
+        return raw
+
+    def load(self, path, part: str = None):
+        """
+        Load a checkpoint, materializing it if it is a delta manifest.
+
+        part selects one top-level entry ("model" or "optimizer") so the rest
+        is never read; returns None if the checkpoint has no such entry.
+        """
+        state = self._read(path)
+        if not self._is_manifest(state):
+            return state if part is None else state.get(part)
+        manifest = state
+        flat_path = self._flat_path(path, manifest, part)
+        if self.flat_keep and flat_path.exists():
+            flat_path.touch()  # most recently used
+            return self._read(flat_path)
+        loaded = self._materialize(path, manifest, part)
+        if self.flat_keep and loaded is not None:
+            self._save_flat(flat_path, loaded)
+        return loaded
+
+    def _materialize(self, path, manifest: dict, part):
+        """Rebuild a manifest's state (or one part of it) from its blobs."""
+        skeleton = manifest["state"]
+        prefix = ""
+        if part is not None:
+            if part not in skeleton:
+                return None
+            skeleton = skeleton[part]
+            prefix = f"/{part}/"
+        blob_dir = self._blob_dir(path)
+        tensors = {}
+        for key, digest in manifest["tensors"].items():
+            if not key.startswith(prefix):
+                continue
+            header = self._read_header(self._blob_path(blob_dir, digest))
+            raw = self._materialize_raw(blob_dir, digest)
+            tensors[key] = (
+                torch.from_numpy(raw.copy())
+                .view(getattr(torch, header["dtype"]))
+                .reshape(header["shape"])
+            )
+        return _join_tensors(skeleton, tensors)
+
+    def collect_garbage(self, checkpoints_dir) -> int:
+        """
+        Delete blobs no manifest in checkpoints_dir reaches. Returns the count.
+
+        Flattened manifests are dropped too; the next load rebuilds them.
+        """
+        checkpoints_dir = Path(checkpoints_dir)
+        for flat_path in (checkpoints_dir / ".flat").glob("*.pt"):
+            flat_path.unlink(missing_ok=True)
+        blob_dir = checkpoints_dir / ".store"
+        if not blob_dir.exists():
+            return 0
+        with self._lock:
+            live = set()
+            for manifest_path in checkpoints_dir.glob("*.pt"):
+                try:
+                    manifest = self._read_manifest(manifest_path)
+                except (OSError, RuntimeError):
+                    continue
+                if manifest is None:
+                    continue
+                for digest in manifest["tensors"].values():
+                    while digest is not None and digest not in live:
+                        live.add(digest)
+                        blob_path = self._blob_path(blob_dir, digest)
+                        if not blob_path.exists():
+                            break
+                        digest = self._read_header(blob_path)["base"]
+            removed = 0
+            for blob_path in blob_dir.glob("*/*"):
+                if blob_path.name not in live:
+                    blob_path.unlink()
+                    removed += 1
+            return removed
@@ -0,0 +1,152 @@
+"""
+torch.compile'd one-token decode step.
+
+For a model this small, a decode step's time goes mostly to Python dispatch
+inside forward_incremental, which compiling removes. To keep the number of
+compiled graphs bounded, batches are padded up to a fixed set of bucket
+sizes and the cache length is compiled as a dynamic dimension (the cache
+can't be padded to a length bucket: forward_incremental takes no attention
+mask). That is one graph per batch bucket. Batches larger than the biggest
+bucket, caches shorter than 2 positions, and buckets that failed to compile
+run the eager forward instead.
+
+A CompiledDecode owns its module and is compiled once. When the serving
+weights change, load_weights() copies the new ones in rather than building
+another CompiledDecode: dynamo's per-function cache is shared by every
+forward_incremental it has compiled, so each rebuild would add a graph per
+bucket until it hits cache_size_limit and silently runs eager. warmup()
+compiles every bucket with that limit raised just enough to hold them
+(torch._dynamo.config.patch, so the process-wide setting is left alone).
+
+After loading weights, one probe step is checked against the eager module:
+a compiled graph that kept the old weights (say, constants captured from
+int8 packed params) raises instead of serving them.
+"""
+
+import bisect
+import copy
+import threading
+import time
+
+import torch
+
+from kv_cache import kv_first_rows, kv_length, kv_mark_dynamic_length, kv_select
+
+DEFAULT_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+
+
+class CompiledDecode:
+    def __init__(self, model, buckets=DEFAULT_BATCH_BUCKETS, device="cpu"):
+        # A private copy, so load_weights() never mutates a module that is
+        # still serving elsewhere
+        self.model = copy.deepcopy(model)
+        self.device = device
+        self.buckets = sorted(buckets)
+        self._failed = set()
+        self._active = 0  # decode steps running on self.model
+        self._loading = False  # load_weights() waiting or copying
+        self._idle = threading.Condition()
+        self._forward = torch.compile(self.model.forward_incremental)
+
+    def __call__(self, tokens, kv):
+        """
+        forward_incremental(tokens, kv) through the compiled graph.
+
+        tokens is [batch, 1]. Returns (logits, kv) trimmed to the real batch,
+        or None when the shape isn't covered and the caller should run eager.
+        """
+        rows = tokens.size(0)
+        length = kv_length(kv)
+        i = bisect.bisect_left(self.buckets, rows)
+        if tokens.size(1) != 1 or length is None or length < 2:
+            return None
+        if i == len(self.buckets):
+            return None
+        bucket = self.buckets[i]
+        if bucket in self._failed:
+            return None
+
+        with self._idle:
+            self._idle.wait_for(lambda: not self._loading)
+            self._active += 1
+        try:
+            return self._run(tokens, kv, rows, bucket)
+        finally:
+            with self._idle:
+                self._active -= 1
+                if not self._active:
+                    self._idle.notify_all()
+
+    def _run(self, tokens, kv, rows: int, bucket: int):
+        if bucket > rows:
+            # Pad with copies of row 0; rows never attend across the batch
+            index = torch.zeros(bucket, dtype=torch.long, device=tokens.device)
+            index[:rows] = torch.arange(rows, device=tokens.device)
+            tokens = tokens.index_select(0, index)
+            kv = kv_select(kv, index)
+        try:
+            logits, kv = self._forward(tokens, kv_mark_dynamic_length(kv))
+        except Exception as e:
+            print(f"[compile] Batch bucket {bucket} falls back to eager: {e}")
+            self._failed.add(bucket)
+            return None
+        if bucket > rows:
+            logits, kv = logits[:rows], kv_first_rows(kv, rows)
+        return logits, kv
+
+    def load_weights(self, model):
+        """
+        Copy model's weights into the compiled module.
+
+        Waits for running decode steps to finish and holds off new ones while
+        copying, so no step sees a mix of old and new weights. model must
+        have the same structure (and quantization) as the compiled one.
+        Raises RuntimeError if the compiled step doesn't reproduce model's
+        output afterwards; callers should then decode eagerly.
+        """
+        state = model.state_dict()
+        with self._idle:
+            self._loading = True
+            try:
+                self._idle.wait_for(lambda: not self._active)
+                with torch.no_grad():
+                    self.model.load_state_dict(state)
+            finally:
+                self._loading = False
+                self._idle.notify_all()
+        self._check(model)
+
+    def _check(self, reference, length: int = 4):
+        """Compare one compiled step with reference's eager forward."""
+        with torch.no_grad():
+            prompt = torch.zeros(1, length, dtype=torch.long, device=self.device)
+            _, kv = reference.encode_kv(prompt)
+            out = self(prompt[:, :1], kv)
+            if out is None:
+                return  # bucket 1 runs eager anyway
+            expected, _ = reference.forward_incremental(prompt[:, :1], kv)
+        if not torch.allclose(out[0], expected, rtol=1e-3, atol=1e-4):
+            raise RuntimeError("compiled decode step doesn't match the new weights")
+
+    def warmup(self, length: int = 16):
+        """Compile every bucket now instead of on the first request that needs it."""
+        start = time.perf_counter()
+        # One graph per bucket (plus its first, static-shape graph) has to fit
+        # in dynamo's per-function cache
+        cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, 2 * len(self.buckets)
+        )
+        with torch.no_grad(), torch._dynamo.config.patch(
+            cache_size_limit=cache_size_limit
+        ):
+            prompt = torch.zeros(1, length, dtype=torch.long, device=self.device)
+            _, kv = self.model.encode_kv(prompt)
+            for bucket in self.buckets:
+                index = torch.zeros(bucket, dtype=torch.long, device=self.device)
+                self(prompt[:1, :1].expand(bucket, 1), kv_select(kv, index))
+        compiled = [b for b in self.buckets if b not in self._failed]
+        print(
+            f"[compile] Warmed up batch buckets {compiled}"
+            f" in {time.perf_counter() - start:.1f}s"
+        )
+        return self
@@ -0,0 +1,266 @@
+"""
+SQLite-backed chat conversation store.
+
+Each conversation's history lives in the conversations table, and a
+conversation_meta row (created_at, updated_at, message_count, preview,
+device) is rewritten alongside it on every save. The admin list is then a
+single indexed query instead of parsing every conversation.
+
+session_state holds what a chat session needs beyond its history to be
+resumed after it's evicted from memory: its pinned checkpoint and whether
+it was reset since its history was last saved (the stored history is kept
+for the admin view, but the session starts over).
+
+The first time the database is created it imports the per-session JSON
+files from data/conversations/, which are left in place.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+SORT_COLUMNS = ("created_at", "updated_at", "message_count")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    session_id TEXT PRIMARY KEY,
+    history TEXT NOT NULL,
+    user_agent TEXT
+);
+CREATE TABLE IF NOT EXISTS conversation_meta (
+    session_id TEXT PRIMARY KEY REFERENCES conversations(session_id),
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    preview TEXT NOT NULL,
+    device TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS session_state (
+    session_id TEXT PRIMARY KEY,
+    checkpoint TEXT,
+    reset INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS conversation_meta_created
+    ON conversation_meta(created_at);
+CREATE INDEX IF NOT EXISTS conversation_meta_updated
+    ON conversation_meta(updated_at);
+CREATE INDEX IF NOT EXISTS conversation_meta_messages
+    ON conversation_meta(message_count);
+"""
+
+
+def safe_session_id(session_id: str):
+    """Sanitized session ID (alphanumeric, underscore, hyphen), or None if empty."""
+    safe_id = "".join(c for c in session_id if c.isalnum() or c in ("_", "-"))
+    return safe_id or None
+
+
+def message_count(history: str) -> int:
+    return history.count("<|Them|>") + history.count("<|Me|>")
+
+
+def preview(history: str) -> str:
+    """First message of the conversation, truncated to 80 characters."""
+    for marker in ("<|Them|>", "<|Me|>"):
+        if marker in history:
+            return history.split(marker)[1].split("<|")[0][:80]
+    return ""
+
+
+def device_label(user_agent: str) -> str:
+    """Short device label parsed from a User-Agent string."""
+    if not user_agent:
+        return ""
+    for needle, label in (
+        ("iPhone", "iPhone"),
+        ("iPad", "iPad"),
+        ("Android", "Android"),
+        ("Macintosh", "Mac"),
+        ("Windows", "Windows"),
+        ("Linux", "Linux"),
+    ):
+        if needle in user_agent:
+            return label
+    return ""
+
+
+class ConversationStore:
+    def __init__(self, db_path, legacy_dir=None):
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not db_path.exists()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        if is_new and legacy_dir is not None:
+            self._import_json(Path(legacy_dir))
+
+    def _import_json(self, legacy_dir: Path):
+        """Load the old one-JSON-file-per-session conversations (once)."""
+        if not legacy_dir.exists():
+            return
+        imported = 0
+        for f in legacy_dir.glob("*.json"):
+            try:
+                data = json.loads(f.read_text())
+            except json.JSONDecodeError:
+                continue
+            session_id = safe_session_id(data.get("session_id", f.stem))
+            if not session_id:
+                continue
+            created_at = data.get("created_at") or datetime.now().isoformat()
+            self._write(
+                session_id,
+                data.get("history", ""),
+                data.get("user_agent"),
+                created_at,
+                data.get("updated_at") or created_at,
+            )
+            imported += 1
+        if imported:
+            print(f"[conversations] Imported {imported} conversations from {legacy_dir}")
+
+    def _write(self, session_id, history, user_agent, created_at, updated_at):
+        with self._lock, self._conn:
+            # Keep the first save's user agent and created_at
+            self._conn.execute(
+                """
+                INSERT INTO conversations (session_id, history, user_agent)
+                VALUES (?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    history = excluded.history,
+                    user_agent = COALESCE(conversations.user_agent, excluded.user_agent)
+                """,
+                (session_id, history, user_agent),
+            )
+            stored_agent = self._conn.execute(
+                "SELECT user_agent FROM conversations WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()["user_agent"]
+            self._conn.execute(
+                """
+                INSERT INTO conversation_meta
+                    (session_id, created_at, updated_at, message_count, preview, device)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    updated_at = excluded.updated_at,
+                    message_count = excluded.message_count,
+                    preview = excluded.preview,
+                    device = excluded.device
+                """,
+                (
+                    session_id,
+                    created_at,
+                    updated_at,
+                    message_count(history),
+                    preview(history),
+                    device_label(stored_agent or ""),
+                ),
+            )
+            # A save after a reset is the new conversation
+            self._conn.execute(
+                "UPDATE session_state SET reset = 0 WHERE session_id = ?",
+                (session_id,),
+            )
+
+    def save(self, session_id: str, history: str, user_agent: str = None):
+        """Persist a conversation and refresh its metadata row."""
+        session_id = safe_session_id(session_id)
+        if not session_id:
+            return
+        now = datetime.now().isoformat()
+        self._write(session_id, history, user_agent, now, now)
+
+    def pin_checkpoint(self, session_id: str, checkpoint: str):
+        """Remember the checkpoint a session's chat runs on (None: the default)."""
+        self._set_state(session_id, "checkpoint", checkpoint)
+
+    def mark_reset(self, session_id: str):
+        """Record that a session's conversation was reset."""
+        self._set_state(session_id, "reset", 1)
+
+    def _set_state(self, session_id: str, column: str, value):
+        session_id = safe_session_id(session_id)
+        if not session_id:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"""
+                INSERT INTO session_state (session_id, {column}) VALUES (?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET {column} = excluded.{column}
+                """,
+                (session_id, value),
+            )
+
+    def load_session(self, session_id: str):
+        """
+        (history, checkpoint) to resume a chat session from, or None.
+
+        history is empty if the session was reset after its last save;
+        checkpoint is None unless one was pinned.
+        """
+        session_id = safe_session_id(session_id)
+        if not session_id:
+            return None
+        with self._lock:
+            conversation = self._conn.execute(
+                "SELECT history FROM conversations WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            state = self._conn.execute(
+                "SELECT checkpoint, reset FROM session_state WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        if conversation is None and state is None:
+            return None
+        history = conversation["history"] if conversation else ""
+        if state is not None and state["reset"]:
+            history = ""
+        return history, state["checkpoint"] if state else None
+
+    def get(self, session_id: str):
+        """The stored conversation as a dict, or None."""
+        session_id = safe_session_id(session_id)
+        if not session_id:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT c.session_id, m.created_at, m.updated_at, c.history, c.user_agent
+                FROM conversations c JOIN conversation_meta m USING (session_id)
+                WHERE c.session_id = ?
+                """,
+                (session_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list(
+        self,
+        offset: int = 0,
+        limit: int = None,
+        sort: str = "created_at",
+        descending: bool = True,
+    ):
+        """Conversation metadata rows, sorted and paged; returns (rows, total)."""
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {SORT_COLUMNS}")
+        order = "DESC" if descending else "ASC"
+        with self._lock:
+            total = self._conn.execute(
+                "SELECT COUNT(*) FROM conversation_meta"
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""
+                SELECT session_id, created_at, updated_at, message_count, preview, device
+                FROM conversation_meta
+                ORDER BY {sort} {order}, session_id {order}
+                LIMIT ? OFFSET ?
+                """,
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+        return [dict(row) for row in rows], total
@@ -0,0 +1,38 @@
+"""
+Incremental detokenization for streamed generations.
+
+BPE tokens are byte sequences, and a token can end partway through a
+multi-byte UTF-8 character (an emoji fragment that isn't a special token,
+for example). Decoding tokens one at a time turns those fragments into
+replacement characters; IncrementalDetokenizer instead holds the bytes back
+until the character is complete.
+"""
+
+import codecs
+
+_Utf8Decoder = codecs.getincrementaldecoder("utf-8")
+
+
+class IncrementalDetokenizer:
+    """Turns a stream of token IDs into text at valid UTF-8 boundaries."""
+
+    __slots__ = ("_token_bytes", "_decoder")
+
+    def __init__(self, token_bytes: list[bytes]):
+        self._token_bytes = token_bytes
+        self._decoder = _Utf8Decoder(errors="replace")
+
+    def feed(self, token_id: int) -> str:
+        """Add one token; returns the text it completes (possibly empty)."""
+        return self._decoder.decode(self._token_bytes[token_id])
+
+    def flush(self) -> str:
+        """Emit any held-back bytes (as replacement characters) and reset."""
+        return self._decoder.decode(b"", final=True)
+
+
+def decode_tokens(token_bytes: list[bytes], token_ids: list[int]) -> str:
+    """Decode a whole token sequence in one pass."""
+    return b"".join([token_bytes[i] for i in token_ids]).decode(
+        "utf-8", errors="replace"
+    )
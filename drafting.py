@@ -0,0 +1,206 @@
+"""
+N-gram draft proposals for speculative decoding.
+
+Chat replies repeat phrases from the conversation and from the training
+texts a lot, so the next few tokens can often be guessed without a model:
+first by finding the latest earlier occurrence of the sequence's last few
+tokens and copying what followed it (prompt lookup), else by walking a table
+of the most frequent continuation of each n-gram in the dataset. The model
+then verifies a whole draft in one forward pass (see Model.decode_steps).
+A generation keeps a PromptIndex of where each of its n-grams last occurred,
+updated as tokens are appended, so prompt lookup doesn't rescan the whole
+sequence on every step.
+
+Fitting runs in Python next to the serving threads, so it is bounded: a file
+is tokenized and counted line by line, up to DRAFTER_MAX_TOKENS tokens, and
+whenever the counts outgrow DRAFTER_MAX_NGRAMS the rarest n-grams are pruned
+(the frequent continuations the table keeps survive that).
+"""
+
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+
+
+class PromptIndex:
+    """
+    Latest start position of every n-gram in a growing token sequence.
+
+    Only appended tokens are indexed on each update; any other change to the
+    sequence (it got shorter, or its last indexed token differs) rebuilds
+    the index from scratch.
+    """
+
+    def __init__(self, min_ngram: int, max_ngram: int):
+        self.min_ngram = min_ngram
+        self.max_ngram = max_ngram
+        self._reset()
+
+    def _reset(self):
+        # n -> n-gram tuple -> latest start, for n-grams before the last token
+        self._positions = {n: {} for n in range(self.min_ngram, self.max_ngram + 1)}
+        self._length = 0
+        self._last = None
+
+    def update(self, tokens: list[int]):
+        if len(tokens) < self._length or (
+            self._length and tokens[self._length - 1] != self._last
+        ):
+            self._reset()
+        for n, positions in self._positions.items():
+            for start in range(max(self._length - n, 0), len(tokens) - n):
+                positions[tuple(tokens[start : start + n])] = start
+        self._length = len(tokens)
+        self._last = tokens[-1] if tokens else None
+
+    def lookup(self, tokens: list[int], k: int) -> list[int]:
+        """Continuation of the latest earlier occurrence of the last n-gram."""
+        self.update(tokens)
+        for n in range(self.max_ngram, self.min_ngram - 1, -1):
+            if len(tokens) <= n:
+                continue
+            start = self._positions[n].get(tuple(tokens[-n:]))
+            if start is not None:
+                return tokens[start + n : start + n + k]
+        return []
+
+
+class NgramDrafter:
+    def __init__(
+        self,
+        max_ngram: int = 3,
+        min_ngram: int = 2,
+        max_draft: int = 4,
+        max_tokens: int = None,
+        max_ngrams: int = None,
+    ):
+        if max_tokens is None:
+            max_tokens = int(os.environ.get("DRAFTER_MAX_TOKENS", 2_000_000))
+        if max_ngrams is None:
+            max_ngrams = int(os.environ.get("DRAFTER_MAX_NGRAMS", 500_000))
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        self.max_draft = max_draft
+        self.max_tokens = max_tokens  # corpus tokens fit_file_async() reads
+        self.max_ngrams = max_ngrams  # distinct n-grams counted at once
+        self._table = {}  # n-gram tuple -> most frequent next token
+
+    def _count(self, counts: Counter, token_ids: list[int], start: int = 0):
+        """
+        Count the n-grams (with their next token) of token_ids that end at or
+        after index start, pruning the rarest if there are too many.
+        """
+        for n in range(self.min_ngram, self.max_ngram + 1):
+            counts.update(
+                tuple(token_ids[i : i + n + 1])
+                for i in range(max(start - n, 0), len(token_ids) - n)
+            )
+        if len(counts) > self.max_ngrams:
+            self._prune(counts)
+
+    def _prune(self, counts: Counter):
+        """Drop the lowest counts until at most half of max_ngrams are left."""
+        threshold = 1
+        while len(counts) > self.max_ngrams // 2:
+            for gram in [g for g, c in counts.items() if c <= threshold]:
+                del counts[gram]
+            threshold += 1
+
+    def _build(self, counts: Counter):
+        """Keep each context's most frequent next token as the new table."""
+        table, best = {}, {}
+        for gram, count in counts.items():
+            context = gram[:-1]
+            if count > best.get(context, 0):
+                best[context] = count
+                table[context] = gram[-1]
+        self._table = table  # swapped in whole; proposals never see a partial table
+
+    def fit(self, token_ids: list[int]):
+        """Build the n-gram table from a token sequence, replacing the old one."""
+        counts = Counter()
+        self._count(counts, token_ids)
+        self._build(counts)
+
+    def fit_file_async(self, path, encode) -> threading.Thread:
+        """
+        Tokenize a text file with encode() and fit on it in the background.
+
+        Until it finishes, proposals come from prompt lookup alone. Only the
+        first max_tokens tokens are used. Returns None if the file doesn't
+        exist.
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+
+        def fit_file():
+            counts = Counter()
+            tail = []  # last max_ngram tokens, for n-grams spanning lines
+            total = 0
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    token_ids = encode(line)[: self.max_tokens - total]
+                    self._count(counts, tail + token_ids, start=len(tail))
+                    tail = (tail + token_ids)[-self.max_ngram :]
+                    total += len(token_ids)
+                    if total >= self.max_tokens:
+                        break
+            self._build(counts)
+            print(f"[drafter] {len(self._table)} n-grams from {total} tokens")
+
+        thread = threading.Thread(target=fit_file, name="drafter-fit", daemon=True)
+        thread.start()
+        return thread
+
+    def prompt_index(self) -> PromptIndex:
+        """A PromptIndex for one generation's tokens (see propose())."""
+        return PromptIndex(self.min_ngram, self.max_ngram)
+
+    def _lookup(self, tokens: list[int], k: int) -> list[int]:
+        """Continuation of the latest earlier occurrence of the last n-gram."""
+        for n in range(self.max_ngram, self.min_ngram - 1, -1):
+            if len(tokens) <= n:
+                continue
+            suffix = tokens[-n:]
+            for start in range(len(tokens) - n - 1, -1, -1):
+                if tokens[start : start + n] == suffix:
+                    return tokens[start + n : start + n + k]
+        return []
+
+    def _next(self, tokens: list[int]):
+        """Most frequent dataset continuation of the longest known suffix."""
+        for n in range(self.max_ngram, self.min_ngram - 1, -1):
+            token = self._table.get(tuple(tokens[-n:]))
+            if token is not None:
+                return token
+        return None
+
+    def propose(
+        self, tokens: list[int], k: int = None, index: PromptIndex = None
+    ) -> list[int]:
+        """
+        Up to k guessed next tokens for a sequence (possibly none).
+
+        Pass the sequence's PromptIndex when proposing for it repeatedly as
+        it grows; without one, prompt lookup scans the whole sequence.
+        """
+        k = self.max_draft if k is None else k
+        if index is not None:
+            draft = index.lookup(tokens, k)
+        else:
+            draft = self._lookup(tokens, k)
+        if draft:
+            return draft
+        context = list(tokens[-self.max_ngram :])
+        while len(draft) < k:
+            token = self._next(context)
+            if token is None:
+                break
+            draft.append(token)
+            context = context[1:] + [token]
+        return draft
+
+    def __len__(self) -> int:
+        return len(self._table)
@@ -0,0 +1,210 @@
+"""
+Separate worker pools for latency-critical and throughput work.
+
+Chat decode forwards one token per sequence per step and someone is waiting
+on every one of them; tree expansion, GRPO candidate sampling and training
+run large batched forwards where only throughput matters. Sharing workers,
+a big expansion stalls every chat, so each kind of work runs on its own
+threads, each of which calls torch.set_num_threads() with its pool's count:
+
+    decode  DecodeScheduler loops              DECODE_THREADS
+    expand  beam trees, expand-depth           EXPAND_THREADS, EXPAND_WORKERS
+    sample  GRPO candidate streams             SAMPLE_THREADS, SAMPLE_WORKERS,
+                                               SAMPLE_TIME_LIMIT
+    train   training steps (one at a time)     TRAIN_THREADS
+
+GRPO sampling streams candidates for as long as it takes to find enough
+distinct ones, so it gets its own workers (2 by default) rather than
+queueing every expansion behind it. SAMPLE_TIME_LIMIT optionally bounds how
+long a stream may hold its worker; a stream cut short says so through its
+truncated flag. There is no limit by default.
+
+The per-pool thread counts are best-effort. Only the OpenMP intra-op pool
+honours torch.set_num_threads() per calling thread; MKL's threads and
+torch's inter-op pool are process-wide, so under those the last count set
+wins. Unset thread counts keep torch's default. configure() (app.py's
+--*-threads flags) overrides the environment before any pool starts.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import torch
+
+
+def _env_int(name: str):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+class Stream:
+    """
+    Items from a generator running on a pool; see Pool.stream().
+
+    truncated is set once the pool's time limit has ended the stream before
+    the generator was exhausted.
+    """
+
+    def __init__(self):
+        self.truncated = False
+        self._items = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._items)
+
+    def close(self):
+        self._items.close()
+
+
+class Pool:
+    def __init__(
+        self,
+        name: str,
+        workers: int = 1,
+        num_threads: int = None,
+        time_limit: float = None,
+    ):
+        self.name = name
+        self.workers = workers
+        self.num_threads = num_threads
+        self.time_limit = time_limit  # seconds a stream() may hold a worker
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_thread(self):
+        """Request this pool's intra-op thread count for the calling thread."""
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix=self.name,
+                    initializer=self.init_thread,
+                )
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Run fn on one of the pool's workers; returns its Future."""
+        return self._get_executor().submit(fn, *args, **kwargs)
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn on the pool and wait for its result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stream(self, fn, *args, **kwargs) -> Stream:
+        """
+        Iterate the generator fn(*args, **kwargs) on the pool.
+
+        Items are handed over as they are produced. Closing the stream early
+        stops the generator after its next item; so does running past the
+        pool's time_limit, which ends the stream after that item and sets
+        its truncated flag.
+        """
+        stream = Stream()
+        stream._items = self._stream_items(stream, fn, args, kwargs)
+        return stream
+
+    def _stream_items(self, stream: Stream, fn, args, kwargs):
+        items = queue.SimpleQueue()
+        done = object()
+        truncated = object()
+        cancelled = threading.Event()
+        time_limit = self.time_limit
+
+        def produce():
+            deadline = None if time_limit is None else time.monotonic() + time_limit
+            generator = fn(*args, **kwargs)
+            try:
+                for item in generator:
+                    if cancelled.is_set():
+                        return
+                    items.put((item, None))
+                    if deadline is not None and time.monotonic() > deadline:
+                        print(
+                            f"[{self.name}] Stream stopped at its"
+                            f" {time_limit:g}s time limit"
+                        )
+                        items.put((truncated, None))
+                        break
+            except Exception as e:
+                items.put((done, e))
+            else:
+                items.put((done, None))
+            finally:
+                generator.close()
+
+        self.submit(produce)
+        try:
+            while True:
+                item, error = items.get()
+                if error is not None:
+                    raise error
+                if item is done:
+                    return
+                if item is truncated:
+                    stream.truncated = True
+                    continue
+                yield item
+        finally:
+            cancelled.set()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "num_threads": self.num_threads or torch.get_num_threads(),
+            "time_limit": self.time_limit,
+        }
+
+
+decode = Pool("decode", num_threads=_env_int("DECODE_THREADS"))
+expand = Pool(
+    "expand",
+    workers=_env_int("EXPAND_WORKERS") or 1,
+    num_threads=_env_int("EXPAND_THREADS"),
+)
+sample = Pool(
+    "sample",
+    workers=_env_int("SAMPLE_WORKERS") or 2,
+    num_threads=_env_int("SAMPLE_THREADS"),
+    time_limit=_env_int("SAMPLE_TIME_LIMIT"),
+)
+# A single worker: training steps run one at a time, in submission order
+train = Pool("train", num_threads=_env_int("TRAIN_THREADS"))
+
+
+def configure(
+    decode_threads: int = None,
+    expand_threads: int = None,
+    expand_workers: int = None,
+    sample_threads: int = None,
+    sample_workers: int = None,
+    sample_time_limit: float = None,
+    train_threads: int = None,
+):
+    """Override pool settings (None keeps the current one); call before use."""
+    for pool, num_threads in (
+        (decode, decode_threads),
+        (expand, expand_threads),
+        (sample, sample_threads),
+        (train, train_threads),
+    ):
+        if num_threads is not None:
+            pool.num_threads = num_threads
+    for pool, workers in ((expand, expand_workers), (sample, sample_workers)):
+        if workers is not None:
+            pool.workers = workers
+    if sample_time_limit is not None:
+        sample.time_limit = sample_time_limit
+
+
+def stats() -> dict:
+    return {pool.name: pool.stats() for pool in (decode, expand, sample, train)}
@@ -0,0 +1,439 @@
+"""
+Helpers for the KV caches returned by TransformerLM.encode_kv().
+
+The cache itself is opaque to MikeGPT: a list of per-layer (keys, values)
+tensors laid out [batch, heads, seq, head_dim], with keys already rotated
+by RoPE. These helpers walk the structure generically, touching only the
+batch and sequence dimensions.
+
+PrefixKVCache stores those caches in a radix tree keyed by token prefix so
+prompts that share a prefix (the conversation header, earlier chat turns,
+a MikeRL prompt) only forward the tokens that differ.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+_SEQ_DIM = -2
+
+
+def _map(fn, kv):
+    """Apply fn to every tensor in a (nested) KV cache."""
+    if isinstance(kv, torch.Tensor):
+        return fn(kv)
+    if isinstance(kv, (list, tuple)):
+        return type(kv)(_map(fn, item) for item in kv)
+    return kv
+
+
+def _zip(fn, kvs):
+    """Combine several identically structured KV caches tensor by tensor."""
+    first = kvs[0]
+    if isinstance(first, torch.Tensor):
+        return fn(list(kvs))
+    if isinstance(first, (list, tuple)):
+        return type(first)(
+            _zip(fn, [kv[i] for kv in kvs]) for i in range(len(first))
+        )
+    return first
+
+
+def kv_cat(kvs):
+    """Stack batch-1 KV caches into one batched cache (same length required)."""
+    if len(kvs) == 1:
+        return kvs[0]
+    return _zip(lambda tensors: torch.cat(tensors, dim=0), kvs)
+
+
+def kv_rows(kv, n: int):
+    """Split a batched KV cache back into n batch-1 caches."""
+    if n == 1:
+        return [kv]
+    return [_map(lambda t, i=i: t[i : i + 1], kv) for i in range(n)]
+
+
+def kv_first_rows(kv, n: int):
+    """The first n batch rows of a KV cache (views, no copy)."""
+    return _map(lambda t: t[:n], kv)
+
+
+def kv_mark_dynamic_length(kv):
+    """Mark every tensor's sequence dimension dynamic for torch.compile."""
+
+    def mark(t):
+        torch._dynamo.mark_dynamic(t, t.dim() + _SEQ_DIM)
+        return t
+
+    return _map(mark, kv)
+
+
+def kv_select(kv, index):
+    """Gather batch rows of a KV cache (index may repeat rows to fork them)."""
+    return _map(lambda t: t.index_select(0, index), kv)
+
+
+def kv_length(kv) -> int:
+    """Number of cached positions in a KV cache (None if it holds no tensors)."""
+    if isinstance(kv, torch.Tensor):
+        return kv.size(_SEQ_DIM)
+    if isinstance(kv, (list, tuple)):
+        for item in kv:
+            length = kv_length(item)
+            if length is not None:
+                return length
+    return None
+
+
+def kv_nbytes(kv) -> int:
+    """Total tensor storage of a KV cache in bytes."""
+    total = 0
+    stack = [kv]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, torch.Tensor):
+            total += item.nelement() * item.element_size()
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+    return total
+
+
+def kv_truncate(kv, length: int):
+    """The first length positions of a KV cache (views, no copy)."""
+    return _map(lambda t: t[..., :length, :], kv)
+
+
+def kv_slice(kv, start: int, end: int = None):
+    """Copy positions [start, end) of a KV cache into standalone tensors."""
+    return _map(lambda t: t[..., start:end, :].clone(), kv)
+
+
+def kv_concat(segments):
+    """Join consecutive position segments of a KV cache."""
+    if len(segments) == 1:
+        return segments[0]
+    return _zip(lambda tensors: torch.cat(tensors, dim=_SEQ_DIM), segments)
+
+
+def kv_shift_window(kv, drop: int, rope_theta: float):
+    """
+    Drop the oldest positions of a per-layer (keys, values) cache.
+
+    Keys are cached after RoPE, so the survivors are rotated back by drop
+    positions: the window then starts at position 0 again and the next
+    token's position (the cache length) stays consistent with every key.
+    """
+    return type(kv)(
+        (_rotate_keys(keys[..., drop:, :], -drop, rope_theta), values[..., drop:, :])
+        for keys, values in kv
+    )
+
+
+def shift_window_matches(
+    model, rope_theta: float, vocab_size: int, length: int = 24, drop: int = 5
+) -> bool:
+    """
+    Check kv_shift_window() against a model's actual cache layout and RoPE.
+
+    Layer-0 keys and values depend only on each token and its position, so
+    after shifting they must equal encode_kv() of the kept window (deeper
+    layers differ by design: they attended to the dropped positions). False
+    if the cache isn't per-layer (keys, values) pairs, the keys don't use
+    interleaved-pair RoPE, or anything else doesn't line up.
+    """
+    device = next(model.parameters()).device
+    generator = torch.Generator().manual_seed(0)
+    tokens = torch.randint(0, vocab_size, (1, length), generator=generator)
+    tokens = tokens.to(device)
+    try:
+        with torch.no_grad():
+            _, kv = model.encode_kv(tokens)
+            _, expected = model.encode_kv(tokens[:, drop:])
+            keys, values = kv_shift_window(kv, drop, rope_theta)[0]
+        expected_keys, expected_values = expected[0]
+        return bool(
+            torch.allclose(keys, expected_keys, rtol=1e-4, atol=1e-4)
+            and torch.allclose(values, expected_values, rtol=1e-4, atol=1e-4)
+        )
+    except (TypeError, ValueError, RuntimeError):
+        return False
+
+
+def _rotate_keys(keys, offset: int, rope_theta: float):
+    """Apply a RoPE rotation by offset positions to interleaved key pairs."""
+    head_dim = keys.size(-1)
+    inv_freq = rope_theta ** (
+        -torch.arange(0, head_dim, 2, device=keys.device, dtype=torch.float32)
+        / head_dim
+    )
+    angle = offset * inv_freq
+    cos, sin = angle.cos().to(keys.dtype), angle.sin().to(keys.dtype)
+    pairs = keys.reshape(*keys.shape[:-1], head_dim // 2, 2)
+    even, odd = pairs[..., 0], pairs[..., 1]
+    rotated = torch.stack((even * cos - odd * sin, even * sin + odd * cos), dim=-1)
+    return rotated.reshape(keys.shape)
+
+
+def extend_kv(model, kv, tokens: list[int], device="cpu"):
+    """
+    Forward tokens on top of an existing batch-1 KV cache.
+
+    Returns (logits, kv) like encode_kv(), with logits only for the new tokens.
+    This relies on a multi-token forward_incremental() being causal within
+    the new tokens, i.e. matching encode_kv() over the whole sequence
+    (checked in tests/test_kv_cache.py).
+    """
+    tokens_tensor = torch.tensor([tokens], device=device, dtype=torch.long)
+    if kv is None:
+        return model.encode_kv(tokens_tensor)
+    return model.forward_incremental(tokens_tensor, kv)
+
+
+def extend_kv_batch(forward, kvs, sequences: list[list[int]], device="cpu"):
+    """
+    Forward the uncached tail of several sequences in one batched call.
+
+    kvs[i] caches the first kv_length(kvs[i]) tokens of sequences[i]; the
+    caches may differ in length. forward (a forward_incremental) takes no
+    attention mask and applies one position offset to the whole batch, so
+    every cache is cut back to the shortest length and each row re-forwards
+    its tokens past that point, right-padded to a common width. Padding
+    comes after a row's real tokens, so causal attention keeps it out of
+    their outputs (the same property extend_kv() relies on).
+
+    Returns a list of (logits, kv) per sequence: the next-token logits after
+    its last token, [vocab_size], and its batch-1 cache of every token.
+    """
+    base = min(kv_length(kv) for kv in kvs)
+    rows = [sequence[base:] for sequence in sequences]
+    width = max(len(row) for row in rows)
+    tokens = torch.tensor(
+        [row + [0] * (width - len(row)) for row in rows],
+        device=device,
+        dtype=torch.long,
+    )
+    kv = kv_cat(
+        [kv if kv_length(kv) == base else kv_truncate(kv, base) for kv in kvs]
+    )
+    logits, kv = forward(tokens, kv)
+    return [
+        (
+            logits[i, len(row) - 1],
+            row_kv if len(row) == width else kv_truncate(row_kv, base + len(row)),
+        )
+        for i, (row, row_kv) in enumerate(zip(rows, kv_rows(kv, len(rows))))
+    ]
+
+
+class _Node:
+    __slots__ = (
+        "key",
+        "kv",
+        "logits",
+        "path_kv",
+        "children",
+        "parent",
+        "last_used",
+        "nbytes",
+    )
+
+    def __init__(self, key, kv, parent, logits=None):
+        self.key = key  # tuple of token IDs on the edge into this node
+        self.kv = kv  # KV for exactly those positions
+        self.logits = logits  # next-token logits after the edge, if known
+        self.path_kv = None  # leaves: KV from the root through this edge, once hit
+        self.children = {}  # first token ID -> _Node
+        self.parent = parent
+        self.last_used = 0
+        self.nbytes = self.size()
+
+    def size(self) -> int:
+        nbytes = 0
+        for kv in (self.kv, self.path_kv):
+            if kv is not None:
+                nbytes += kv_nbytes(kv)
+        if self.logits is not None:
+            nbytes += self.logits.nelement() * self.logits.element_size()
+        return nbytes
+
+
+class PrefixKVCache:
+    """
+    Radix tree of batch-1 KV caches keyed by token prefix.
+
+    Each edge stores the K/V for its own positions only, so shared prefixes
+    are stored once. A leaf that lookups reach also keeps its whole path's
+    K/V joined (counted against the budget), so repeat hits return views of
+    it instead of concatenating every segment again.
+
+    Leaves are evicted least-recently-used first once the tree grows past
+    max_bytes, from a leaf LRU kept up to date on every hit and insert. A
+    node left childless by an eviction joins it by its own last use,
+    approximately: ahead of every leaf if it is older than all of them, else
+    behind them.
+
+    version is the weights version the entries were computed with. Lookups
+    and inserts that pass a different version are misses and no-ops, so work
+    that started on replaced weights can't put its K/V back after clear().
+    """
+
+    def __init__(self, max_bytes: int = None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("PREFIX_KV_CACHE_MB", 256)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._root = _Node((), None, None)
+        self._leaves = OrderedDict()  # leaf _Node -> None, least recently used first
+        self._clock = 0
+        self.nbytes = 0
+        self.version = 0
+
+    def clear(self, version: int = None):
+        """Drop every entry; later entries belong to version, if given."""
+        with self._lock:
+            self._root = _Node((), None, None)
+            self._leaves = OrderedDict()
+            self.nbytes = 0
+            if version is not None:
+                self.version = version
+
+    def _stale(self, version) -> bool:
+        return version is not None and version != self.version
+
+    def resize(self, max_bytes: int):
+        """Change the budget, evicting right away if the tree is now too big."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def lookup(self, tokens: list[int], version: int = None):
+        """
+        Find the longest cached prefix of tokens.
+
+        Returns (length, kv, logits): kv covers tokens[:length] (None when
+        nothing matched) and logits are the next-token logits after the full
+        sequence when it is cached exactly, else None. kv may be a view of
+        cached tensors and must not be modified in place.
+        """
+        with self._lock:
+            if self._stale(version):
+                return 0, None, None
+            self._clock += 1
+            node = self._root
+            pos = 0
+            segments = []
+            logits = None
+            deepest = None
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    break
+                matched = _common_length(child.key, tokens, pos)
+                child.last_used = self._clock
+                segments.append(child.kv)
+                deepest = child
+                pos += matched
+                if matched < len(child.key):
+                    break
+                node = child
+                if pos == len(tokens):
+                    logits = child.logits
+            if deepest is None:
+                return 0, None, None
+
+            if deepest in self._leaves:
+                self._leaves.move_to_end(deepest)
+                if deepest.path_kv is None and len(segments) > 1:
+                    deepest.path_kv = kv_concat(segments)
+                    added = kv_nbytes(deepest.path_kv)
+                    deepest.nbytes += added
+                    self.nbytes += added
+                kv = deepest.path_kv if deepest.path_kv is not None else segments[0]
+            else:
+                kv = kv_concat(segments)
+            if pos < kv_length(kv):
+                kv = kv_truncate(kv, pos)
+            self._evict()
+            return pos, kv, logits
+
+    def insert(self, tokens: list[int], kv, logits=None, version: int = None):
+        """Cache kv (covering exactly tokens) and optionally its next-token logits."""
+        if not tokens:
+            return
+        with self._lock:
+            if self._stale(version):
+                return
+            self._clock += 1
+            node = self._root
+            pos = 0
+            while pos < len(tokens):
+                child = node.children.get(tokens[pos])
+                if child is None:
+                    if node in self._leaves:
+                        self._leaves.pop(node)
+                        self._drop_path_kv(node)
+                    leaf = _Node(tuple(tokens[pos:]), kv_slice(kv, pos), node, logits)
+                    leaf.last_used = self._clock
+                    node.children[tokens[pos]] = leaf
+                    self._leaves[leaf] = None
+                    self.nbytes += leaf.nbytes
+                    break
+                matched = _common_length(child.key, tokens, pos)
+                if matched < len(child.key):
+                    child = self._split(child, matched)
+                child.last_used = self._clock
+                if child in self._leaves:
+                    self._leaves.move_to_end(child)
+                pos += matched
+                node = child
+                if pos == len(tokens) and logits is not None and child.logits is None:
+                    child.logits = logits
+                    added = logits.nelement() * logits.element_size()
+                    child.nbytes += added
+                    self.nbytes += added
+            self._evict()
+
+    def _drop_path_kv(self, node):
+        if node.path_kv is not None:
+            removed = kv_nbytes(node.path_kv)
+            node.path_kv = None
+            node.nbytes -= removed
+            self.nbytes -= removed
+
+    def _split(self, node, at: int):
+        """Split node's edge at offset at; returns the new upper node."""
+        upper = _Node(node.key[:at], kv_slice(node.kv, 0, at), node.parent)
+        upper.last_used = node.last_used
+        lower_kv = kv_slice(node.kv, at)
+        self.nbytes -= node.nbytes
+        node.parent.children[node.key[0]] = upper
+        node.key = node.key[at:]
+        node.kv = lower_kv  # path_kv is unchanged: the path is the same
+        node.parent = upper
+        node.nbytes = node.size()
+        upper.children[node.key[0]] = node
+        self.nbytes += upper.nbytes + node.nbytes
+        return upper
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self._leaves:
+            victim, _ = self._leaves.popitem(last=False)
+            parent = victim.parent
+            del parent.children[victim.key[0]]
+            self.nbytes -= victim.nbytes
+            if parent is not self._root and not parent.children:
+                oldest = next(iter(self._leaves), None)
+                self._leaves[parent] = None
+                if oldest is not None and parent.last_used <= oldest.last_used:
+                    self._leaves.move_to_end(parent, last=False)
+
+
+def _common_length(key, tokens, pos: int) -> int:
+    """Length of the common prefix of key and tokens[pos:]."""
+    limit = min(len(key), len(tokens) - pos)
+    i = 0
+    while i < limit and key[i] == tokens[pos + i]:
+        i += 1
+    return i
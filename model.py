@@ -1,12 +1,46 @@
+import copy
+import itertools
 import os
+import threading
+from concurrent.futures import Future
 from pathlib import Path
+from typing import NamedTuple
 from lm.model.model import TransformerLM, TrainableModel
 from lm.training.utils.checkpointing import load_checkpoint
 from lm.tokenization.bpe import Tokenizer
+import executors
+from compiled_decode import DEFAULT_BATCH_BUCKETS, CompiledDecode
+from detokenizer import IncrementalDetokenizer, decode_tokens
+from drafting import NgramDrafter
+from probs_cache import ProbsCache
+from quantization import module_bytes, quantize_int8
+from sampling import (
+    ENDOFTEXT_ID,
+    SILENT_TOKENS,
+    masked_probs,
+    sample,
+    suppression_bias,
+    verify_draft,
+)
+from checkpoints import CheckpointWriter, DeltaCheckpointStore, clone_state
+from kv_cache import (
+    PrefixKVCache,
+    extend_kv,
+    extend_kv_batch,
+    kv_cat,
+    kv_length,
+    kv_nbytes,
+    kv_select,
+    kv_shift_window,
+    kv_truncate,
+    shift_window_matches,
+)
 import torch
-import torch.nn.functional as F
 
-_silent_tokens = [2316, 1902]
+# Maximum frontier rows per batched forward when building beam trees, and
+# the most KV cache memory one of those forwards may fork for its rows
+_TREE_BATCH = 512
+_TREE_BATCH_BYTES = int(os.environ.get("TREE_BATCH_MB", 64)) * 1024 * 1024
 
 
 def _checkpoints_dir() -> Path:
@@ -16,8 +50,79 @@ def _checkpoints_dir() -> Path:
     return Path(__file__).parent / "checkpoints"
 
 
+class TopK(NamedTuple):
+    """Columnar top-k result: parallel lists of token IDs, probabilities and strings."""
+
+    ids: list[int]
+    probs: list[float]
+    strs: list[str]
+
+
+class GenerationState:
+    """
+    Per-generation decode state: token buffer, KV cache and sampling config.
+
+    logits holds the pending next-token logits (set by prime() and consumed
+    by the next decode step); when None, the last token in tokens still has
+    to be forwarded through the model. detokenizer turns the generated
+    tokens back into text for next_token(). version is the weights version
+    the state's K/V was computed with (see Model.weights_version). shifted is
+    set once its cache window has slid (see Model.kv_window): its K/V then no
+    longer equals what its tokens would encode to from position 0.
+    draft_index is its drafting.PromptIndex once speculation drafts for it.
+    """
+
+    __slots__ = (
+        "tokens",
+        "kv_cache",
+        "logits",
+        "temperature",
+        "top_p",
+        "top_k",
+        "use_top_k",
+        "detokenizer",
+        "version",
+        "shifted",
+        "draft_index",
+    )
+
+    def __init__(
+        self,
+        tokens: list[int],
+        kv_cache,
+        logits=None,
+        temperature: float = 1.0,
+        top_p: float = 0.45,
+        top_k: int = 5,
+        use_top_k: bool = False,
+        detokenizer: IncrementalDetokenizer = None,
+        version: int = None,
+    ):
+        self.tokens = list(tokens)
+        self.kv_cache = kv_cache
+        self.logits = logits
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.use_top_k = use_top_k
+        self.detokenizer = detokenizer
+        self.version = version
+        self.shifted = False
+        self.draft_index = None
+
+
 class Model:
-    def __init__(self, checkpoint_path):
+    def __init__(
+        self, checkpoint_path, shared: "Model" = None, quantize: bool = None
+    ):
+        """
+        Load a checkpoint. shared is an already loaded Model whose tokenizer
+        and token tables are reused (for ModelPool replicas).
+
+        quantize serves from an int8 copy of the weights (see
+        quantization.py); self.model stays the fp32 master that training
+        updates. Defaults to shared's setting, else QUANTIZE=int8.
+        """
         self.device = "cpu"
         self.context_length = 256
         d_model = 256
@@ -26,6 +131,15 @@ class Model:
         num_layers = 4
         d_ff = 1344
         rope_theta = 10000
+        self.rope_theta = rope_theta
+        self.vocab_size = vocab_size
+        if quantize is None:
+            quantize = (
+                shared.quantize
+                if shared is not None
+                else os.environ.get("QUANTIZE") == "int8"
+            )
+        self.quantize = quantize
 
         self.model = (
             TransformerLM(
@@ -42,18 +156,108 @@ class Model:
             .eval()
         )
 
-        load_checkpoint(
-            checkpoint_path,
-            self.model,
-            None,
-            self.device,
+        self._checkpoint_store = DeltaCheckpointStore()
+        if self._checkpoint_store.is_delta(checkpoint_path):
+            self.model.load_state_dict(
+                self._checkpoint_store.load(checkpoint_path, part="model")
+            )
+        else:
+            load_checkpoint(
+                checkpoint_path,
+                self.model,
+                None,
+                self.device,
+            )
+        # What inference runs: self.model, or its int8 copy when quantizing
+        self.inference_model = self._inference_copy(self.model)
+
+        # What decode does once a generation outgrows the context window:
+        # "reencode" rebuilds the cache from the trailing window every token,
+        # "shift" slides it. Shifting re-rotates cached keys, which assumes
+        # the cache layout and RoPE convention of lm's TransformerLM, so it is
+        # only used once a self-test on this model confirms them.
+        self.kv_window = os.environ.get("KV_WINDOW", "reencode")
+        if self.kv_window == "shift" and not shift_window_matches(
+            self.model, rope_theta, vocab_size
+        ):
+            print("[kv] KV_WINDOW=shift failed its self-test; re-encoding instead")
+            self.kv_window = "reencode"
+
+        # Training runs on a shadow copy of the weights, built on first use by
+        # a training step or checkpoint save; self.model keeps serving and is
+        # replaced (not mutated) when a step finishes
+        self._shadow = None
+        # Set when the serving model was published from the shadow and still
+        # shares its parameter storage (see _publish_shadow())
+        self._shadow_shares_storage = False
+        self._trainable_model = None
+        self._optimizer_checkpoint = None  # checkpoint to restore its state from
+        self._training_lock = threading.RLock()
+        # Steps run one at a time on the shared training pool (executors.py)
+        self._train_executor = executors.train
+
+        if shared is not None:
+            # Pool replica: reuse the tokenizer and token tables
+            for attr in (
+                "tokenizer",
+                "_token_bytes",
+                "_token_strs",
+                "_reaction_ids",
+                "_stop_ids",
+                "_turn_ids",
+            ):
+                setattr(self, attr, getattr(shared, attr))
+        else:
+            self._load_vocab(vocab_size)
+
+        # Additive logit masks: sampling suppresses <|endoftext|> and the
+        # silent tokens, beam tree children only <|endoftext|>
+        self._suppress = suppression_bias(
+            vocab_size, [ENDOFTEXT_ID, *SILENT_TOKENS], self.device
         )
+        self._suppress_eot = suppression_bias(vocab_size, [ENDOFTEXT_ID], self.device)
 
-        self.trainable_model = TrainableModel(model=self.model)
+        # Continuous batching engine for chat decode (attached by app.py)
+        self.scheduler = None
 
-        # Load vocab to extract emojis
+        # Speculative chat decoding (see enable_speculation()); pool replicas
+        # share the primary's drafter
+        self.drafter = shared.drafter if shared is not None else None
+        self.speculative_max_batch = int(os.environ.get("SPECULATIVE_MAX_BATCH", 4))
+
+        # Chat states whose cache lengths differ by less than this decode in
+        # one batch, the longer ones re-forwarding the difference
+        self.decode_length_bucket = int(os.environ.get("DECODE_LENGTH_BUCKET", 8))
+        self._draft_stats = {"drafted": 0, "accepted": 0}
+
+        # Compiled one-token decode step (see enable_compile())
+        self.compile_buckets = None
+        self._compiled_decode = None
+
+        # Cache sorted probability distributions so repeated/expanding
+        # top-k queries for the same node don't need another forward pass.
+        # Key: (prompt, path_key), Value: (sorted_probs, sorted_indices) CPU tensors
+        self._probs_cache = ProbsCache()
+        self._cache_prompt = None  # (prompt, tokens) of the last MikeRL prompt
+        self.current_checkpoint = checkpoint_path
+
+        # Prefix KV cache shared by every prompt: chat turns, tree expansions
+        # and GRPO prompts reuse the K/V of whatever prefix they have in common
+        self._prefix_kv = PrefixKVCache()
+
+        # Bumped whenever the serving weights change. Cache entries carry the
+        # version they were computed with, so work still running on replaced
+        # weights can't repopulate the caches after they're cleared.
+        self.weights_version = 0
+
+        # Writes training checkpoints (as deltas) off the request path
+        self._checkpoint_writer = CheckpointWriter(save=self._checkpoint_store.save)
+
+    def _load_vocab(self, vocab_size: int):
+        """Build the tokenizer and per-token lookup tables."""
         import json
 
+        # Load vocab to extract emojis
         with open(f"vocab/mikegpt_vocab_{vocab_size}.json") as f:
             vocab_json = json.load(f)
 
@@ -85,26 +289,33 @@ class Model:
             special_tokens=special_tokens,
         )
 
-        self.current_tokens = None  # running token buffer on device
-
-        # Cache full sorted probability distributions so repeated/expanding
-        # top-k queries for the same node don't need another forward pass.
-        # Key: path_key string, Value: (sorted_probs, sorted_indices) CPU tensors
-        self._probs_cache = {}
-        self._cache_prompt = None
-        self.current_checkpoint = checkpoint_path
+        # Raw bytes of every token ID, for incremental UTF-8 detokenization
+        self._token_bytes = [
+            bytes.fromhex(vocab_json[str(i)])
+            if str(i) in vocab_json
+            else self.tokenizer.decode([i]).encode("utf-8")
+            for i in range(vocab_size)
+        ]
+        # Decoded string of every token ID, so top-k results never call decode()
+        self._token_strs = [self.tokenizer.decode([i]) for i in range(vocab_size)]
+        reactions = [
+            "<|Liked|>",
+            "<|Laughed at|>",
+            "<|Loved|>",
+            "<|Disliked|>",
+            "<|Questioned|>",
+            "<|Emphasized|>",
+        ]
+        self._reaction_ids = {self.tokenizer.encode(r)[0]: r for r in reactions}
 
-        # Prompt-level KV cache: computed once per prompt, reused for all tree expansions
-        self._prompt_kv_cache = None  # opaque cache from model.encode_kv()
-        self._prompt_kv_tokens = None  # token list used to build the cache
-        self._prompt_kv_logits = None  # logits from encode_kv (for primed logits)
-        self._gen_kv_cache = None  # running KV cache for incremental chat decode
-        self._primed_logits = (
-            None  # stored logits from prime(), used by first next_token()
-        )
+        # Stop tokens that end a chat reply; a GRPO candidate also ends at <|Me|>
+        self._stop_ids = {
+            self.tokenizer.encode(t)[0]
+            for t in ["<|Them|>", "<|endoftext|>", "<|ConversationStart|>"]
+        }
+        self._turn_ids = self._stop_ids | {self.tokenizer.encode("<|Me|>")[0]}
 
-    def save_checkpoint(self, name: str = None) -> str:
-        """Save current model state and optimizer state. Returns the checkpoint path."""
+    def _checkpoint_path(self, name: str = None) -> Path:
         from datetime import datetime
 
         checkpoints_dir = _checkpoints_dir()
@@ -113,31 +324,146 @@ class Model:
         if name is None:
             name = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-        checkpoint_path = checkpoints_dir / f"{name}.pt"
-        torch.save(
-            {
-                "model": self.model.state_dict(),
-                "optimizer": self.trainable_model.grpo_optimizer.state_dict(),
-            },
-            checkpoint_path,
+        return checkpoints_dir / f"{name}.pt"
+
+    def _checkpoint_state(self) -> dict:
+        """Snapshot of model and optimizer state, stored relative to its parent."""
+        with self._training_lock:
+            state = clone_state(
+                {
+                    "model": self.model.state_dict(),
+                    "optimizer": self.trainable_model.grpo_optimizer.state_dict(),
+                }
+            )
+            state["parent"] = self.current_checkpoint
+        return state
+
+    def save_checkpoint(self, name: str = None) -> str:
+        """Save current model state and optimizer state. Returns the checkpoint path."""
+        checkpoint_path = self._checkpoint_path(name)
+        self._checkpoint_store.save(self._checkpoint_state(), checkpoint_path)
+        self.current_checkpoint = str(checkpoint_path)
+        return str(checkpoint_path)
+
+    def save_checkpoint_async(self, name: str = None, on_done=None) -> str:
+        """
+        Snapshot model and optimizer state now and write it in the background.
+
+        Returns the checkpoint path immediately; on_done(path, error) is called
+        from the writer thread once the file is in place or the write failed.
+        """
+        checkpoint_path = self._checkpoint_path(name)
+        self._checkpoint_writer.submit(
+            self._checkpoint_state(), checkpoint_path, on_done
         )
         self.current_checkpoint = str(checkpoint_path)
         return str(checkpoint_path)
 
+    def _inference_copy(self, model):
+        """The module to serve model's weights from (int8 copy if quantizing)."""
+        return quantize_int8(model) if self.quantize else model
+
+    def enable_compile(self, buckets=DEFAULT_BATCH_BUCKETS):
+        """
+        Run one-token decode steps through torch.compile (see compiled_decode.py).
+
+        Every batch bucket is compiled right away, once: when the inference
+        weights are replaced they are copied into the compiled module (which
+        keeps its own copy of them). Pool replicas stay eager.
+        """
+        self.compile_buckets = tuple(buckets)
+        self._compiled_decode = CompiledDecode(
+            self.inference_model, self.compile_buckets, self.device
+        ).warmup()
+
+    def _load_compiled(self, inference_model):
+        """Copy inference_model's weights into the compiled decode step, if any."""
+        compiled_decode = self._compiled_decode
+        if compiled_decode is None:
+            return
+        try:
+            compiled_decode.load_weights(inference_model)
+        except (RuntimeError, KeyError) as e:
+            print(f"[compile] Can't load new weights, decoding eagerly: {e}")
+            self._compiled_decode = None
+
+    def _forward_incremental(self, tokens, kv):
+        """forward_incremental on the inference model, compiled when covered."""
+        compiled_decode = self._compiled_decode
+        if compiled_decode is not None:
+            out = compiled_decode(tokens, kv)
+            if out is not None:
+                return out
+        return self.inference_model.forward_incremental(tokens, kv)
+
+    @property
+    def trainable_model(self) -> TrainableModel:
+        """
+        TrainableModel wrapping the shadow copy of the serving weights.
+
+        Created lazily so hot-swapping checkpoints doesn't pay for optimizer
+        state until a training step (or checkpoint save) actually needs it.
+        """
+        if self._trainable_model is None:
+            self._shadow = copy.deepcopy(self.model)
+            self._shadow_shares_storage = False
+            trainable_model = TrainableModel(model=self._shadow)
+            if self._optimizer_checkpoint is not None:
+                optimizer_state = self._checkpoint_store.load(
+                    self._optimizer_checkpoint, part="optimizer"
+                )
+                if optimizer_state is not None:
+                    trainable_model.grpo_optimizer.load_state_dict(optimizer_state)
+            self._trainable_model = trainable_model
+        return self._trainable_model
+
     def reload_checkpoint(self, checkpoint_path: str):
-        """Hot-swap model weights and optimizer state from a different checkpoint."""
-        state = torch.load(checkpoint_path, weights_only=False)
-        self.model.load_state_dict(state["model"])
-        # Reinitialize trainable model with new weights
-        self.trainable_model = TrainableModel(model=self.model)
-        # Restore optimizer state if available
-        if "optimizer" in state:
-            self.trainable_model.grpo_optimizer.load_state_dict(state["optimizer"])
-        # Clear caches
-        self._probs_cache = {}
-        self._cache_prompt = None
-        self._invalidate_kv()
-        self.current_checkpoint = checkpoint_path
+        """
+        Hot-swap model weights from a different checkpoint.
+
+        The weights go into a new module, built around the loaded tensors (a
+        memory-mapped full checkpoint is only paged in as it's read), which
+        is then swapped in like a trained shadow: other pools may be running
+        a forward on the old module, which is never written to. Its optimizer
+        state is loaded on the next training step.
+        """
+        state = self._checkpoint_store.load(checkpoint_path, part="model")
+        model = self._module_from_state(state)
+        # Waits for a running training step, which would otherwise publish
+        # its weights over the ones loaded here
+        with self._training_lock:
+            inference_model = self._inference_copy(model)
+            self._load_compiled(inference_model)
+            self.model = model
+            self.inference_model = inference_model
+            self._shadow = None
+            self._trainable_model = None
+            self._optimizer_checkpoint = checkpoint_path
+            self._invalidate_caches()
+            self.current_checkpoint = checkpoint_path
+
+    def _module_from_state(self, state: dict):
+        """A copy of self.model's structure whose Parameters are state's tensors."""
+        params = dict(self.model.named_parameters())
+        for name, param in params.items():
+            if name not in state:
+                raise KeyError(f"Checkpoint has no weights for {name}")
+            if state[name].shape != param.shape:
+                raise ValueError(
+                    f"Checkpoint {name} has shape {tuple(state[name].shape)},"
+                    f" expected {tuple(param.shape)}"
+                )
+        memo = {
+            id(param): torch.nn.Parameter(
+                state[name].to(param.dtype), requires_grad=param.requires_grad
+            )
+            for name, param in params.items()
+        }
+        model = copy.deepcopy(self.model, memo=memo).eval()
+        buffers = {name: t for name, t in state.items() if name not in params}
+        with torch.no_grad():
+            model.load_state_dict(buffers, strict=False)
+        return model
 
     @staticmethod
     def list_checkpoints() -> list[dict]:
@@ -157,132 +483,274 @@ class Model:
             )
         return sorted(checkpoints, key=lambda x: x["modified"], reverse=True)
 
-    def _ensure_prompt_kv(self, tokens: list[int]):
-        """Compute prompt KV cache if tokens changed."""
-        if self._prompt_kv_tokens == tokens and self._prompt_kv_cache is not None:
+    def _ensure_prompt_kv(self, tokens: list[int], version: int = None):
+        """
+        Return (kv, logits) for a prompt, reusing the longest cached prefix.
+
+        Only the tokens past the cached prefix are forwarded. logits are the
+        next-token logits after the prompt, shape [1, vocab_size]. version is
+        the weights version the caller started under (default: current).
+        """
+        if version is None:
+            version = self.weights_version
+        cached_len, kv, logits = self._prefix_kv.lookup(tokens, version)
+        if cached_len == len(tokens) and logits is not None:
+            return kv, logits
+        if cached_len == len(tokens):
+            # Cached without logits: re-forward the last token to get them
+            cached_len -= 1
+            kv = kv_truncate(kv, cached_len) if cached_len else None
+        with torch.no_grad():
+            logits, kv = extend_kv(
+                self.inference_model, kv, tokens[cached_len:], self.device
+            )
+        # Own the row: a view would keep the whole [1, T, vocab] tensor alive
+        # in the cache while only one row is counted against its budget
+        logits = logits[:, -1].clone()
+        self._prefix_kv.insert(tokens, kv, logits, version=version)
+        return kv, logits
+
+    def _remember(self, state: GenerationState):
+        """Offer a finished generation's KV cache to the prefix cache."""
+        if state.shifted:
+            # Computed in a longer context than its token key describes
             return
-        prompt_tensor = torch.tensor([tokens], device=self.device, dtype=torch.long)
-        logits, kv = self.model.encode_kv(prompt_tensor)
-        self._prompt_kv_cache = kv
-        self._prompt_kv_logits = logits
-        self._prompt_kv_tokens = list(tokens)
-
-    def _invalidate_kv(self):
-        """Clear all KV caches (after training, checkpoint switch, etc.)."""
-        self._prompt_kv_cache = None
-        self._prompt_kv_tokens = None
-        self._prompt_kv_logits = None
-        self._gen_kv_cache = None
-        self._primed_logits = None
-
-    def prime(self, prompt: str):
-        """Tokenize prompt once and store on device."""
-        tokens = self.tokenizer.encode(prompt)
+        length = kv_length(state.kv_cache)
+        if length:
+            self._prefix_kv.insert(
+                state.tokens[:length], state.kv_cache, version=state.version
+            )
+
+    def _invalidate_caches(self):
+        """
+        Clear the KV and probability caches after the serving weights change.
+
+        Call after swapping the weights in: the version is bumped first, so
+        anything that read the old version (and maybe the old weights) is
+        refused by the cleared caches.
+        """
+        self.weights_version += 1
+        self._prefix_kv.clear(self.weights_version)
+        self._probs_cache.clear(self.weights_version)
+
+    def _encode_prompt(self, prompt) -> list[int]:
+        """
+        Tokenize a prompt (or take its token IDs as given), keeping only the
+        last context_length tokens.
+        """
+        tokens = self.tokenizer.encode(prompt) if isinstance(prompt, str) else prompt
         if len(tokens) > self.context_length:
             tokens = tokens[-self.context_length :]
-        self.current_tokens = torch.tensor(
-            [tokens], device=self.device, dtype=torch.long
-        )
-        # Pre-compute KV cache for the prompt
-        self._ensure_prompt_kv(tokens)
-        # Use full prompt KV cache — no trim needed since we store logits
-        # for the first next_token() call, avoiding the redundant re-forward.
-        self._gen_kv_cache = self._prompt_kv_cache
-        self._primed_logits = self._prompt_kv_logits[0, -1]
-
-    def next_token(
+        return tokens
+
+    def prime(
         self,
+        prompt: str | list[int],
         temperature: float = 1.0,
         top_p: float = 0.45,
         top_k: int = 5,
         use_top_k: bool = False,
-    ) -> str:
+    ) -> GenerationState:
+        """
+        Tokenize a prompt (unless given as token IDs) and pre-compute its KV cache.
+
+        Returns a GenerationState to pass to next_token()/decode_step(). The
+        model itself holds no per-generation state, so any number of states
+        can decode concurrently on the shared weights.
+        """
+        version = self.weights_version
+        tokens = self._encode_prompt(prompt)
+        kv, logits = self._ensure_prompt_kv(tokens, version)
+        # Keep the prompt's last logits so the first next_token() call
+        # doesn't re-forward the last prompt token.
+        return GenerationState(
+            tokens,
+            kv,
+            logits[0],
+            temperature,
+            top_p,
+            top_k,
+            use_top_k,
+            self.detokenizer(),
+            version,
+        )
+
+    def next_token(self, state: GenerationState) -> str:
         """
         Fast next-token generation with temperature and top-p or top-k sampling.
         Uses incremental KV-cached decoding: only the last token is forwarded
         through the model, reusing cached K/V from all prior tokens.
 
-        Args:
-            temperature: Temperature for scaling logits (higher = more random)
-            top_p: Nucleus sampling threshold (used when use_top_k=False)
-            top_k: Number of top tokens to sample from (used when use_top_k=True)
-            use_top_k: If True, use top-k sampling; if False, use top-p sampling (default)
+        Sampling settings come from the state (see prime()). The sampled token
+        is appended to state.tokens and the text it completes is returned
+        (empty while a multi-byte character is still incomplete).
         """
-        if self.current_tokens is None:
-            raise RuntimeError("Must call .prime(prompt) before .next_token()")
+        chosen_id = self.decode_step([state])[0]
+        return state.detokenizer.feed(chosen_id)
 
+    def detokenizer(self) -> IncrementalDetokenizer:
+        """A fresh streaming detokenizer over this model's token bytes."""
+        return IncrementalDetokenizer(self._token_bytes)
+
+    def decode_tokens(self, token_ids: list[int]) -> str:
+        """Decode a token sequence to text via the precomputed bytes table."""
+        return decode_tokens(self._token_bytes, token_ids)
+
+    def decode_step(self, states: list[GenerationState]) -> list[int]:
+        """
+        Advance several generations by one token each.
+
+        States whose cache lengths are within decode_length_bucket of each
+        other share one batched incremental forward (see extend_kv_batch();
+        the longer ones re-forward the few positions they are ahead by). Each
+        state is sampled with its own settings; returns the sampled token IDs
+        in order.
+        """
         with torch.no_grad():
-            if self._primed_logits is not None:
-                # Use stored logits from prime() — avoids re-forwarding the last prompt token
-                last_logits = self._primed_logits / temperature
-                self._primed_logits = None
-            elif (
-                self._gen_kv_cache is not None
-                and self.current_tokens.size(1) < self.context_length
-            ):
-                # Incremental decode: forward only the last token with the running KV cache
-                last_token = self.current_tokens[:, -1:]
-                logits, self._gen_kv_cache = self.model.forward_incremental(
-                    last_token, self._gen_kv_cache
+            pending = []
+            for state in states:
+                if state.logits is not None:
+                    continue
+                overflow = len(state.tokens) - self.context_length
+                if overflow > 0 and self.kv_window == "shift":
+                    # Context overflow: slide the cache window forward and
+                    # keep decoding incrementally
+                    del state.tokens[:overflow]
+                    state.kv_cache = kv_shift_window(
+                        state.kv_cache, overflow, self.rope_theta
+                    )
+                    state.shifted = True
+                elif overflow > 0:
+                    # Context overflow: re-encode the trailing window
+                    del state.tokens[:overflow]
+                    window = torch.tensor(
+                        [state.tokens], device=self.device, dtype=torch.long
+                    )
+                    logits, state.kv_cache = self.inference_model.encode_kv(window)
+                    state.logits = logits[0, -1]
+                    continue
+                pending.append(state)
+
+            for group in self._length_groups(pending):
+                rows = extend_kv_batch(
+                    self._forward_incremental,
+                    [state.kv_cache for state in group],
+                    [state.tokens for state in group],
+                    self.device,
                 )
-                last_logits = logits[0, -1] / temperature
-            else:
-                # Fallback: full forward (context overflow or no cache)
-                logits = self.model(self.current_tokens)
-                last_logits = logits[0, -1] / temperature
-
-            last_logits[0] = float("-inf")  # suppress <|endoftext|>
-            last_logits[2316] = float("-inf")
-            last_logits[1902] = float("-inf")
-            probs = F.softmax(last_logits, dim=-1)
-
-            if use_top_k:
-                # Top-k sampling
-                top_probs, top_idx = torch.topk(probs, k=top_k)
-                top_probs = top_probs / top_probs.sum()  # renormalize to sum to 1
-
-                # Sample one token from the top-k distribution
-                choice = torch.multinomial(top_probs, 1)
-                chosen_id = int(top_idx[choice].item())
-            else:
-                # Top-p (nucleus) sampling
-                # Sort probabilities in descending order
-                sorted_probs, sorted_indices = torch.sort(probs, descending=True)
+                for state, (logits, kv) in zip(group, rows):
+                    state.logits = logits
+                    state.kv_cache = kv
+
+            # Sample every state in one batch, each with its own settings
+            chosen_ids = sample(
+                torch.stack([state.logits for state in states]),
+                [state.temperature for state in states],
+                [state.top_p for state in states],
+                [state.top_k for state in states],
+                [state.use_top_k for state in states],
+                bias=self._suppress,
+            )
+            for state, chosen_id in zip(states, chosen_ids):
+                state.tokens.append(chosen_id)
+                state.logits = None
+        return chosen_ids
 
-                # Compute cumulative probabilities
-                cumulative_probs = torch.cumsum(sorted_probs, dim=-1)
+    def _length_groups(self, states: list[GenerationState]):
+        """
+        Split states into batches whose cache lengths span less than
+        decode_length_bucket positions (1: identical lengths only).
+        """
+        groups = []
+        for state in sorted(states, key=lambda state: len(state.tokens)):
+            if groups and (
+                len(state.tokens) - len(groups[-1][0].tokens)
+                < self.decode_length_bucket
+            ):
+                groups[-1].append(state)
+            else:
+                groups.append([state])
+        return groups
 
-                # Find the cutoff index where cumulative probability exceeds top_p
-                # Keep at least one token
-                cutoff_index = torch.searchsorted(cumulative_probs, top_p) + 1
+    def enable_speculation(self, dataset_path=None, max_draft: int = 4):
+        """
+        Decode chat replies speculatively with n-gram drafts.
 
-                # Select tokens up to cutoff
-                nucleus_probs = sorted_probs[:cutoff_index]
-                nucleus_indices = sorted_indices[:cutoff_index]
+        Drafts come from the conversation so far and, once it has been
+        tokenized in the background, from the n-gram table of dataset_path.
+        """
+        self.drafter = NgramDrafter(max_draft=max_draft)
+        if dataset_path is not None:
+            self.drafter.fit_file_async(dataset_path, self.tokenizer.encode)
 
-                # Renormalize to sum to 1
-                nucleus_probs = nucleus_probs / nucleus_probs.sum()
+    def decode_steps(self, states: list[GenerationState]) -> list[list[int]]:
+        """
+        Advance several generations by one or more tokens each.
 
-                # Sample one token from the nucleus distribution
-                choice = torch.multinomial(nucleus_probs, 1)
-                chosen_id = int(nucleus_indices[choice].item())
+        Without a drafter (or with a batch larger than speculative_max_batch)
+        this is decode_step(), one token per state. Otherwise each state the
+        drafter has a guess for verifies it in a single incremental forward
+        and keeps the accepted tokens plus one sampled token; the others
+        share one batched decode_step(). Returns each state's new token IDs.
+        """
+        if self.drafter is None or len(states) > self.speculative_max_batch:
+            return [[token_id] for token_id in self.decode_step(states)]
+
+        drafts = [self._draft(state) for state in states]
+        plain = [state for state, draft in zip(states, drafts) if not draft]
+        plain_ids = iter(self.decode_step(plain) if plain else [])
+        return [
+            self._verify_draft(state, draft) if draft else [next(plain_ids)]
+            for state, draft in zip(states, drafts)
+        ]
+
+    def _draft(self, state: GenerationState) -> list[int]:
+        """Draft tokens for a state, short enough to stay inside the context."""
+        room = self.context_length - len(state.tokens) - 1
+        if room <= 0:
+            return []
+        if state.draft_index is None:
+            state.draft_index = self.drafter.prompt_index()
+        return self.drafter.propose(
+            state.tokens, min(room, self.drafter.max_draft), index=state.draft_index
+        )
 
-        # Append new token on GPU, cropping if needed
-        new_token = torch.tensor([[chosen_id]], device=self.device)
-        if self.current_tokens.size(1) >= self.context_length:
-            self.current_tokens = torch.cat(
-                [self.current_tokens[:, 1:], new_token], dim=1
+    def _verify_draft(self, state: GenerationState, draft: list[int]) -> list[int]:
+        """Forward a draft once and append the tokens verify_draft() keeps."""
+        with torch.no_grad():
+            if state.logits is None:
+                # The last sampled token hasn't been forwarded yet
+                inputs = [state.tokens[-1]] + draft
+            else:
+                inputs = draft
+            logits, kv = extend_kv(
+                self.inference_model, state.kv_cache, inputs, self.device
+            )
+            rows = logits[0]  # next-token logits after each input
+            if state.logits is not None:
+                rows = torch.cat([state.logits.unsqueeze(0), rows])
+            accepted = verify_draft(
+                rows,
+                draft,
+                state.temperature,
+                state.top_p,
+                state.top_k,
+                state.use_top_k,
+                bias=self._suppress,
             )
-            # Rebuild KV cache from truncated sequence (minus last token
-            # for the next_token() pattern) to restore incremental decoding
-            with torch.no_grad():
-                _, self._gen_kv_cache = self.model.encode_kv(
-                    self.current_tokens[:, :-1]
-                )
-        else:
-            self.current_tokens = torch.cat([self.current_tokens, new_token], dim=1)
 
-        return self.tokenizer.decode([chosen_id])
+        # Keep K/V up to the last accepted draft token; the final sampled
+        # token is forwarded by the next step like any other. Dropping the
+        # rejected positions takes views, not a copy of the whole cache
+        keep = len(state.tokens) + len(accepted) - 1
+        if keep < kv_length(kv):
+            kv = kv_truncate(kv, keep)
+        state.kv_cache = kv
+        state.tokens.extend(accepted)
+        state.logits = None
+        self._draft_stats["drafted"] += len(draft)
+        self._draft_stats["accepted"] += len(accepted) - 1
+        return accepted
 
     def get_top_k_tokens(self, tokens_tensor, k: int = 20, temperature: float = 1.0):
         """
@@ -294,24 +762,14 @@ class Model:
             k: Number of top tokens to return
 
         Returns:
-            List of tuples: [(token_id, token_str, probability), ...]
+            TopK columns (ids, probs, strs)
         """
         with torch.no_grad():
-            logits = self.model(tokens_tensor)
-            last_logits = logits[0, -1] / temperature
-            last_logits[0] = float("-inf")  # suppress <|endoftext|>
-            probs = F.softmax(last_logits, dim=-1)
+            logits = self.inference_model(tokens_tensor)
+            probs = masked_probs(logits[0, -1], temperature, self._suppress_eot)
 
             top_probs, top_idx = torch.topk(probs, k=k)
-
-            results = []
-            for prob, idx in zip(top_probs, top_idx):
-                token_id = int(idx.item())
-                token_str = self.tokenizer.decode([token_id])
-                probability = float(prob.item())
-                results.append((token_id, token_str, probability))
-
-            return results
+            return self._to_top_k(top_idx, top_probs)
 
     def get_top_k_tokens_batch(
         self, sequences: list, k: int = 20, temperature: float = 1.0
@@ -325,7 +783,7 @@ class Model:
             temperature: Temperature for scaling logits
 
         Returns:
-            List of lists of tuples: [[(token_id, token_str, probability), ...], ...]
+            List of TopK columns (ids, probs, strs), one per sequence
         """
         if not sequences:
             return []
@@ -345,7 +803,7 @@ class Model:
         batch_tensor = torch.tensor(padded, device=self.device, dtype=torch.long)
 
         with torch.no_grad():
-            logits = self.model(batch_tensor)  # [N, max_len, vocab_size]
+            logits = self.inference_model(batch_tensor)  # [N, max_len, vocab_size]
 
             # Gather the logit vector at each sequence's last real token position
             last_indices = torch.tensor(
@@ -353,41 +811,63 @@ class Model:
             )
             # last_indices shape [N] -> [N, 1, 1] expanded to [N, 1, vocab_size]
             gather_idx = last_indices.view(-1, 1, 1).expand(-1, 1, logits.size(-1))
-            last_logits = (
-                logits.gather(1, gather_idx).squeeze(1) / temperature
-            )  # [N, vocab_size]
-            last_logits[:, 0] = float("-inf")  # suppress <|endoftext|>
-            last_logits[:, _silent_tokens] = float("-inf")
-
-            probs = F.softmax(last_logits, dim=-1)  # [N, vocab_size]
+            last_logits = logits.gather(1, gather_idx).squeeze(1)  # [N, vocab_size]
+            probs = masked_probs(last_logits, temperature, self._suppress)
             top_probs, top_idx = torch.topk(probs, k=k, dim=-1)  # [N, k] each
 
-            # Move to CPU once for all decoding
-            top_probs_cpu = top_probs.cpu()
-            top_idx_cpu = top_idx.cpu()
+            # Move to CPU once for all rows
+            ids_rows = top_idx.cpu().tolist()
+            probs_rows = top_probs.cpu().tolist()
+            return [
+                TopK(ids, probs, [self._token_strs[i] for i in ids])
+                for ids, probs in zip(ids_rows, probs_rows)
+            ]
 
-            batch_results = []
-            for i in range(len(sequences)):
-                results = []
-                for j in range(k):
-                    token_id = int(top_idx_cpu[i, j].item())
-                    token_str = self.tokenizer.decode([token_id])
-                    probability = float(top_probs_cpu[i, j].item())
-                    results.append((token_id, token_str, probability))
-                batch_results.append(results)
-
-            return batch_results
+    def _to_top_k(self, indices, probs) -> "TopK":
+        """Materialize 1-D index/probability tensors as TopK columns."""
+        ids = indices.tolist()
+        return TopK(ids, probs.float().tolist(), [self._token_strs[i] for i in ids])
 
     def _extract_top_k(self, cached, k):
         """Extract top-k results from a cached (sorted_probs, sorted_indices) pair."""
         sorted_probs, sorted_indices = cached
-        results = []
-        for j in range(min(k, len(sorted_probs))):
-            token_id = int(sorted_indices[j].item())
-            token_str = self.tokenizer.decode([token_id])
-            probability = float(sorted_probs[j].item())
-            results.append((token_id, token_str, probability))
-        return results
+        return self._to_top_k(sorted_indices[:k], sorted_probs[:k])
+
+    def _rank_probs(self, probs, k: int):
+        """Sort distributions descending, only as far as the probs cache keeps them."""
+        keep = max(self._probs_cache.top_m, k) if self._probs_cache.top_m else 0
+        if keep and keep < probs.size(-1):
+            return torch.topk(probs, keep, dim=-1)
+        return torch.sort(probs, dim=-1, descending=True)
+
+    def cache_stats(self) -> dict:
+        """Probability and prefix KV cache counters for the admin dashboard."""
+        return {
+            "probs_cache": self._probs_cache.stats(),
+            "prefix_kv_cache": {
+                "bytes": self._prefix_kv.nbytes,
+                "max_bytes": self._prefix_kv.max_bytes,
+            },
+            "speculative": {
+                "enabled": self.drafter is not None,
+                "ngrams": len(self.drafter) if self.drafter is not None else 0,
+                **self._draft_stats,
+            },
+        }
+
+    def set_prefix_kv_budget(self, max_bytes: int):
+        """Resize the prefix KV cache (ModelPool splits one budget across replicas)."""
+        self._prefix_kv.resize(max_bytes)
+
+    def memory_bytes(self) -> int:
+        """Resident bytes: weights plus whatever its caches currently hold."""
+        weights = module_bytes(self.model)
+        if self.inference_model is not self.model:
+            weights += module_bytes(self.inference_model)
+        if self._compiled_decode is not None:
+            # The compiled decode step serves from its own copy
+            weights += module_bytes(self._compiled_decode.model)
+        return weights + self._prefix_kv.nbytes + self._probs_cache.nbytes
 
     def get_top_k_cached_batch(
         self, sequences, path_keys, prompt, k=20, temperature=1.0
@@ -404,29 +884,30 @@ class Model:
         Args:
             sequences: List of token lists (potentially different lengths)
             path_keys: List of cache key strings, one per sequence
-            prompt: The prompt string (cache is invalidated if this changes)
+            prompt: The prompt string (part of every cache key)
             k: Number of top tokens to return per sequence
             temperature: Temperature for scaling logits
 
         Returns:
-            List of lists of tuples: [[(token_id, token_str, probability), ...], ...]
+            List of TopK columns (ids, probs, strs), one per sequence
         """
         if not sequences:
             return []
 
-        # Invalidate caches if prompt changed
-        if self._cache_prompt != prompt:
-            self._probs_cache.clear()
-            self._cache_prompt = prompt
-            self._invalidate_kv()
+        version = self.weights_version
+        cached_prompt = self._cache_prompt
+        if cached_prompt is None or cached_prompt[0] != prompt:
+            cached_prompt = (prompt, self._encode_prompt(prompt))
+            self._cache_prompt = cached_prompt
 
         # Separate cached vs uncached
         all_results = [None] * len(sequences)
         uncached = []  # (original_index, sequence)
 
         for i, pk in enumerate(path_keys):
-            if pk in self._probs_cache:
-                all_results[i] = self._extract_top_k(self._probs_cache[pk], k)
+            cached = self._probs_cache.get((prompt, pk), k, version)
+            if cached is not None:
+                all_results[i] = self._extract_top_k(cached, k)
             else:
                 uncached.append((i, sequences[i]))
 
@@ -437,18 +918,15 @@ class Model:
         uncached_seqs = list(uncached_seqs)
 
         # Try to use prompt KV cache: all sequences must share the same prompt prefix
-        prompt_tokens = self._prompt_kv_tokens
-        can_use_kv = (
-            prompt_tokens is not None
-            and self._prompt_kv_cache is not None
-            and all(
-                len(seq) > len(prompt_tokens)
-                and seq[: len(prompt_tokens)] == prompt_tokens
-                for seq in uncached_seqs
-            )
+        prompt_tokens = cached_prompt[1]
+        can_use_kv = all(
+            len(seq) > len(prompt_tokens) and seq[: len(prompt_tokens)] == prompt_tokens
+            for seq in uncached_seqs
         )
 
-        if can_use_kv and len(uncached_seqs) > 0:
+        if can_use_kv:
+            prompt_kv, _ = self._ensure_prompt_kv(prompt_tokens, version)
+
             # Extract suffix tokens (everything after the prompt)
             prompt_len = len(prompt_tokens)
             suffixes = [seq[prompt_len:] for seq in uncached_seqs]
@@ -461,9 +939,7 @@ class Model:
             )
 
             with torch.no_grad():
-                logits = self.model.forward_with_kv(
-                    suffix_tensor, self._prompt_kv_cache
-                )
+                logits = self.inference_model.forward_with_kv(suffix_tensor, prompt_kv)
 
                 # Gather logits at each suffix's last real token position
                 last_indices = torch.tensor(
@@ -472,14 +948,9 @@ class Model:
                     dtype=torch.long,
                 )
                 gather_idx = last_indices.view(-1, 1, 1).expand(-1, 1, logits.size(-1))
-                last_logits = logits.gather(1, gather_idx).squeeze(1) / temperature
-                last_logits[:, 0] = float("-inf")
-                last_logits[:, _silent_tokens] = float("-inf")
-
-                probs = F.softmax(last_logits, dim=-1)
-                sorted_probs, sorted_indices = torch.sort(
-                    probs, dim=-1, descending=True
-                )
+                last_logits = logits.gather(1, gather_idx).squeeze(1)
+                probs = masked_probs(last_logits, temperature, self._suppress)
+                sorted_probs, sorted_indices = self._rank_probs(probs, k)
                 sorted_probs_cpu = sorted_probs.cpu()
                 sorted_indices_cpu = sorted_indices.cpu()
         else:
@@ -487,45 +958,31 @@ class Model:
             lengths = [len(seq) for seq in uncached_seqs]
             max_len = max(lengths)
 
-            # Build prompt KV for future suffix calls
-            if prompt_tokens is None:
-                prompt_tok = self.tokenizer.encode(prompt)
-                if len(prompt_tok) > self.context_length:
-                    prompt_tok = prompt_tok[-self.context_length :]
-                self._ensure_prompt_kv(prompt_tok)
-
             padded = [seq + [0] * (max_len - len(seq)) for seq in uncached_seqs]
             batch_tensor = torch.tensor(padded, device=self.device, dtype=torch.long)
 
             with torch.no_grad():
-                logits = self.model(batch_tensor)  # [N, max_len, vocab_size]
+                logits = self.inference_model(batch_tensor)  # [N, max_len, vocab_size]
 
                 last_indices = torch.tensor(
                     [l - 1 for l in lengths], device=self.device, dtype=torch.long
                 )
                 gather_idx = last_indices.view(-1, 1, 1).expand(-1, 1, logits.size(-1))
-                last_logits = logits.gather(1, gather_idx).squeeze(1) / temperature
-                last_logits[:, 0] = float("-inf")
-                last_logits[:, _silent_tokens] = float("-inf")
-
-                probs = F.softmax(last_logits, dim=-1)
-                sorted_probs, sorted_indices = torch.sort(
-                    probs, dim=-1, descending=True
-                )
+                last_logits = logits.gather(1, gather_idx).squeeze(1)
+                probs = masked_probs(last_logits, temperature, self._suppress)
+                sorted_probs, sorted_indices = self._rank_probs(probs, k)
                 sorted_probs_cpu = sorted_probs.cpu()
                 sorted_indices_cpu = sorted_indices.cpu()
 
-        # Cache full distributions and extract top-k
-        max_cache_entries = int(os.environ.get("PROBS_CACHE_MAX", 2000))
-        overflow = len(self._probs_cache) + len(uncached_indices) - max_cache_entries
-        if overflow > 0:
-            keys_to_evict = list(self._probs_cache.keys())[:overflow]
-            for k_evict in keys_to_evict:
-                del self._probs_cache[k_evict]
-
+        # Cache distributions and extract top-k
         for batch_i, orig_i in enumerate(uncached_indices):
-            cached = (sorted_probs_cpu[batch_i], sorted_indices_cpu[batch_i])
-            self._probs_cache[path_keys[orig_i]] = cached
+            cached = self._probs_cache.put(
+                (prompt, path_keys[orig_i]),
+                sorted_probs_cpu[batch_i],
+                sorted_indices_cpu[batch_i],
+                k=k,
+                version=version,
+            )
             all_results[orig_i] = self._extract_top_k(cached, k)
 
         return all_results
@@ -536,6 +993,13 @@ class Model:
         """
         Build a beam search tree showing top K tokens at each level for N levels.
 
+        The tree is built one level at a time: the prompt KV cache is computed
+        once, then every frontier node of a level is expanded in batched
+        incremental forwards (sized by TREE_BATCH_MB) over its parent's forked
+        KV cache. The child
+        distributions computed along the way seed the probability cache that
+        /api/expand-depth reads from.
+
         Args:
             prompt: Initial prompt to start from
             k: Number of top tokens to explore at each level
@@ -549,53 +1013,198 @@ class Model:
         if not raw:
             prompt = "<|ConversationStart|><|Them|>" + prompt + "<|Me|>"
         tokens = self.tokenizer.encode(prompt)
-        print(f"[build_beam_tree] Input prompt tokens: {tokens}")
-        if len(tokens) > self.context_length:
-            tokens = tokens[-self.context_length :]
+        # Leave room for the n - 1 path tokens forwarded after the prompt, so
+        # every level is an incremental step on the same prompt cache
+        max_prompt_len = max(1, self.context_length - max(n - 1, 0))
+        # Expand-depth sees the same token windows only when nothing was cut
+        seed_cache = len(tokens) <= max_prompt_len
+        if len(tokens) > max_prompt_len:
+            tokens = tokens[-max_prompt_len:]
+
+        tree = {"prompt": prompt, "children": None}
+        if n <= 0:
+            return tree
+
+        if seed_cache:
+            self._cache_prompt = (prompt, list(tokens))
+
+        version = self.weights_version
+        with torch.no_grad():
+            kv, logits = self._ensure_prompt_kv(tokens, version)
+            # Frontier: nodes whose children are built at the current depth
+            frontier = [tree]
+            frontier_paths = [[]]
+            frontier_logits = logits  # [F, vocab_size]
+            frontier_kv = kv
+
+            for depth in range(n):
+                probs = masked_probs(frontier_logits, bias=self._suppress_eot)
+                top_probs, top_idx = torch.topk(probs, k=k, dim=-1)
+
+                if seed_cache and depth > 0:
+                    # Same distribution get_top_k_cached_batch would compute
+                    sorted_probs, sorted_indices = self._rank_probs(
+                        masked_probs(frontier_logits, bias=self._suppress), k
+                    )
+                    for i, path in enumerate(frontier_paths):
+                        self._probs_cache.put(
+                            (prompt, ",".join(map(str, path))),
+                            sorted_probs[i],
+                            sorted_indices[i],
+                            k=k,
+                            version=version,
+                        )
+
+                next_frontier = []
+                next_paths = []
+                for node, path, row_ids, row_probs in zip(
+                    frontier, frontier_paths, top_idx.tolist(), top_probs.tolist()
+                ):
+                    parent_cumulative = node.get("cumulative_prob", 1.0)
+                    children = []
+                    for token_id, probability in zip(row_ids, row_probs):
+                        child = {
+                            "token_id": token_id,
+                            "token_str": self._token_strs[token_id],
+                            "probability": probability,
+                            "cumulative_prob": parent_cumulative * probability,
+                            "depth": depth,
+                            "children": None,
+                        }
+                        children.append(child)
+                        next_frontier.append(child)
+                        next_paths.append(path + [token_id])
+                    node["children"] = children
+
+                if depth + 1 >= n:
+                    break
 
-        initial_tokens = torch.tensor([tokens], device=self.device, dtype=torch.long)
-
-        # Build the tree recursively
-        def build_node(tokens_tensor, depth, cumulative_prob):
-            if depth >= n:
-                return None
-
-            # Get top K tokens for current state
-            top_k = self.get_top_k_tokens(tokens_tensor, k=k)
-
-            children = []
-            for token_id, token_str, probability in top_k:
-                # Create new token sequence with this token appended
-                new_token = torch.tensor([[token_id]], device=self.device)
-
-                # Handle context length limit
-                if tokens_tensor.size(1) >= self.context_length:
-                    new_tokens = torch.cat([tokens_tensor[:, 1:], new_token], dim=1)
-                else:
-                    new_tokens = torch.cat([tokens_tensor, new_token], dim=1)
-
-                # Recursively build children for this token
-                child_node = {
-                    "token_id": token_id,
-                    "token_str": token_str,
-                    "probability": probability,
-                    "cumulative_prob": cumulative_prob * probability,
-                    "depth": depth,
-                    "children": build_node(
-                        new_tokens, depth + 1, cumulative_prob * probability
-                    ),
-                }
-                children.append(child_node)
+                # Fork each parent's cache once per child and run the next
+                # level as batched incremental steps. Every child row copies
+                # its parent's whole cache (prompt included) going in and
+                # again coming out, so chunks are sized by memory, not rows.
+                parent_index = torch.arange(
+                    len(frontier), device=self.device
+                ).repeat_interleave(k)
+                child_tokens = top_idx.reshape(-1, 1)
+                keep_kv = depth + 2 < n
+                row_bytes = kv_nbytes(frontier_kv) // len(frontier)
+                batch = max(1, min(_TREE_BATCH, _TREE_BATCH_BYTES // (2 * row_bytes)))
+                chunk_logits, chunk_kvs = [], []
+                for start in range(0, len(next_frontier), batch):
+                    rows = slice(start, start + batch)
+                    logits, kv = self._forward_incremental(
+                        child_tokens[rows],
+                        kv_select(frontier_kv, parent_index[rows]),
+                    )
+                    chunk_logits.append(logits[:, -1])
+                    if keep_kv:
+                        chunk_kvs.append(kv)
+
+                frontier = next_frontier
+                frontier_paths = next_paths
+                frontier_logits = torch.cat(chunk_logits, dim=0)
+                frontier_kv = kv_cat(chunk_kvs) if keep_kv else None
 
-            return children if children else None
+        return tree
 
-        # Build tree starting from initial prompt
-        tree = {
-            "prompt": prompt,
-            "children": build_node(initial_tokens, 0, 1.0),
-        }
+    def sample_candidates(
+        self,
+        prompt: str,
+        n: int = 8,
+        max_tokens: int = 100,
+        max_attempts: int = 24,
+        temperature: float = 1.0,
+        top_p: float = 0.45,
+        top_k: int = 5,
+        use_top_k: bool = False,
+    ):
+        """
+        Sample n distinct single-turn responses to a prompt in lockstep.
 
-        return tree
+        The prompt is encoded once and its KV cache shared by every row, and
+        all rows advance together through decode_step(). A row that finishes
+        with a duplicate response is replaced on the fly by a fresh row from
+        the prompt, until n unique responses are found or max_attempts rows
+        have been started.
+
+        Yields:
+            Tuples of (response_text, token_ids) as each unique response completes.
+        """
+        version = self.weights_version
+        tokens = self._encode_prompt(prompt)
+        prompt_kv, prompt_logits = self._ensure_prompt_kv(tokens, version)
+
+        def new_row():
+            state = GenerationState(
+                tokens,
+                prompt_kv,
+                prompt_logits[0],
+                temperature,
+                top_p,
+                top_k,
+                use_top_k,
+                version=version,
+            )
+            return state, []
+
+        rows = [new_row() for _ in range(min(n, max_attempts))]
+        started = len(rows)
+        seen_texts = set()
+
+        while rows:
+            token_ids = self.decode_step([state for state, _ in rows])
+
+            running = []
+            for (state, response_tokens), token_id in zip(rows, token_ids):
+                if token_id not in self._turn_ids:
+                    response_tokens.append(token_id)
+                    if len(response_tokens) < max_tokens:
+                        running.append((state, response_tokens))
+                        continue
+
+                response_text = self.decode_tokens(response_tokens).strip()
+                if response_text in seen_texts:
+                    continue
+                seen_texts.add(response_text)
+                yield response_text, response_tokens
+                if len(seen_texts) >= n:
+                    return
+
+            # Top the batch back up for rows that finished as duplicates
+            needed = n - len(seen_texts) - len(running)
+            for _ in range(min(needed, max_attempts - started)):
+                running.append(new_row())
+                started += 1
+            rows = running
+
+    def _stream_token_ids(self, prompt: str | list[int], max_tokens: int, **sampling):
+        """
+        Yield sampled token IDs for a prompt until a stop token or max_tokens.
+
+        Goes through the continuous batching scheduler when one is attached,
+        otherwise decodes directly with prime()/decode_steps().
+        """
+        if self.scheduler is not None:
+            yield from self.scheduler.generate(
+                prompt,
+                max_tokens=max_tokens,
+                stop_ids=self._stop_ids,
+                **sampling,
+            )
+            return
+
+        state = self.prime(prompt, **sampling)
+        try:
+            remaining = max_tokens
+            while remaining > 0:
+                for token_id in self.decode_steps([state])[0][:remaining]:
+                    yield token_id
+                    remaining -= 1
+                    if token_id in self._stop_ids:
+                        return
+        finally:
+            self._remember(state)
 
     def generate_response_stream(
         self,
@@ -603,6 +1212,7 @@ class Model:
         user_message: str,
         auto_start: bool = False,
         auto_start_prompt: str = None,
+        history_tokens: list[int] = None,
     ):
         """
         Generate responses one at a time, yielding each as it's complete.
@@ -612,21 +1222,26 @@ class Model:
             user_message: The new message from the user
             auto_start: If True, MikeGPT starts the conversation (no user message)
             auto_start_prompt: The prompt to use for auto_start mode
+            history_tokens: Token IDs of conversation_history, if already known;
+                only the new message is tokenized then
 
         Yields:
             Tuples of (response_text, token_ids) where token_ids includes
             the leading <|Me|> token for tree navigation.
         """
 
-        # 1. Build initial context and prime the model
+        # 1. Build initial context
         if auto_start and auto_start_prompt:
             # MikeGPT starts first - use the provided prompt directly
             context = auto_start_prompt
         else:
             # Normal mode - user sent a message
             context = conversation_history + f"<|Them|>{user_message}<|Me|>"
-
-        self.prime(context)
+            if history_tokens is not None:
+                # Segments that start with a special token tokenize independently
+                context = history_tokens + self.tokenizer.encode(
+                    f"<|Them|>{user_message}<|Me|>"
+                )
 
         # Get <|Me|> token ID for the leading tag (part of context, not generated)
         me_token_id = self.tokenizer.encode("<|Me|>")[0]
@@ -636,18 +1251,12 @@ class Model:
         response_token_ids = [me_token_id]
         max_tokens = 200  # safety cap
         generated_any = False
+        detokenizer = self.detokenizer()
 
-        for _ in range(max_tokens):
-            token = self.next_token(top_p=0.5)
-            token_id = int(self.current_tokens[0, -1].item())
-
+        for token_id in self._stream_token_ids(context, max_tokens, top_p=0.5):
             # 2. Handle special tokens
-            if token in [
-                "<|Me|>",
-                "<|Them|>",
-                "<|endoftext|>",
-                "<|ConversationStart|>",
-            ]:
+            if token_id in self._turn_ids:
+                current_response += detokenizer.flush()
                 if current_response.strip():
                     yield (current_response.strip(), response_token_ids)
                     generated_any = True
@@ -655,29 +1264,23 @@ class Model:
                     response_token_ids = []
 
                 # stop generating once next speaker starts
-                if token in ["<|Them|>", "<|endoftext|>", "<|ConversationStart|>"]:
+                if token_id in self._stop_ids:
                     break
 
                 # <|Me|> separator — include in next response's token IDs
                 response_token_ids = [token_id]
 
-            elif token in [
-                "<|Liked|>",
-                "<|Laughed at|>",
-                "<|Loved|>",
-                "<|Disliked|>",
-                "<|Questioned|>",
-                "<|Emphasized|>",
-            ]:
+            elif token_id in self._reaction_ids:
                 # Reaction: include any accumulated token IDs (e.g. preceding <|Me|>)
-                yield (token, response_token_ids + [token_id])
+                yield (self._reaction_ids[token_id], response_token_ids + [token_id])
                 generated_any = True
                 response_token_ids = []
 
             else:
-                current_response += token
+                current_response += detokenizer.feed(token_id)
                 response_token_ids.append(token_id)
 
+        current_response += detokenizer.flush()
         if current_response.strip():
             yield (current_response.strip(), response_token_ids)
             generated_any = True
@@ -689,7 +1292,7 @@ class Model:
                 yield ("Hey", [me_token_id] + self.tokenizer.encode("Hey"))
             else:
                 yield from self.generate_response_stream(
-                    conversation_history, user_message
+                    conversation_history, user_message, history_tokens=history_tokens
                 )
 
     def do_training_step(
@@ -699,11 +1302,29 @@ class Model:
         rewards: list[float],
         target_kl: float = 0.05,
         max_steps: int = 100,
+        on_trained=None,
+        diagnostics: bool = True,
+        on_progress=None,
     ) -> dict:
         """
         Unified GRPO-based training for any group size.
         Trains until model KL divergence from pre-training state reaches target_kl.
 
+        Training runs on the shadow model in the training worker while
+        self.model keeps serving; the trained weights are swapped in as a new
+        serving model at the end. Steps run one at a time, in submission
+        order. on_trained(result), if given, runs on the worker right after
+        the swap and before the next step starts (e.g. to snapshot a
+        checkpoint of exactly these weights).
+
+        The still-serving model holds the pre-step weights, so diagnostics
+        compare against it instead of a parameter snapshot. They cost two
+        extra forward passes over the group; diagnostics=False skips them and
+        returns None for probability_changes and l2_diff.
+
+        on_progress(step, max_steps), if given, is called from the worker with
+        step=0 when the step starts and after every optimizer step.
+
         For pair mode: responses=[positive, negative], rewards=[1.0, -1.0]
         For group mode: responses=[resp1..resp8], rewards=[8,7,6,5,4,3,2,1] (from ranks)
 
@@ -713,75 +1334,202 @@ class Model:
         - kl_divergence: float - mean KL(before || after) across response positions
         - steps_taken: int - number of optimizer steps executed
         """
-        from torch.nn.utils.rnn import pad_sequence
-        from lm.training.reinforcement.log_probs import calculate_model_log_probs
+        return self.submit_training_step(
+            prompt,
+            responses,
+            rewards,
+            target_kl=target_kl,
+            max_steps=max_steps,
+            on_trained=on_trained,
+            diagnostics=diagnostics,
+            on_progress=on_progress,
+        ).result()
 
-        group_size = len(responses)
-
-        # Prepare tensors for log prob calculation
-        prompt_tensor = torch.tensor(
-            prompt, dtype=torch.long, device=self.device
-        ).expand(group_size, -1)
-        prompt_lengths = torch.tensor([len(prompt)] * group_size, device=self.device)
-        response_lengths = torch.tensor([len(r) for r in responses], device=self.device)
-        response_tensor = pad_sequence(
-            [torch.tensor(r, dtype=torch.long, device=self.device) for r in responses],
-            batch_first=True,
-            padding_value=0,
+    def submit_training_step(
+        self,
+        prompt: list[int],
+        responses: list[list[int]],
+        rewards: list[float],
+        target_kl: float = 0.05,
+        max_steps: int = 100,
+        on_trained=None,
+        diagnostics: bool = True,
+        on_progress=None,
+    ) -> Future:
+        """Queue do_training_step on the training worker; returns its Future."""
+        return self._train_executor.submit(
+            self._train_and_publish,
+            prompt,
+            responses,
+            rewards,
+            target_kl,
+            max_steps,
+            on_trained,
+            diagnostics,
+            on_progress,
         )
 
-        # Snapshot parameters before training (for L2 diff)
-        param_snapshot = {
-            name: param.detach().clone()
-            for name, param in self.model.named_parameters()
-        }
-
-        # Calculate log probs before training (for probability_changes)
-        with torch.no_grad():
-            before_per_token_log_probs, _ = calculate_model_log_probs(
-                self.model,
-                prompt_tensor,
-                prompt_lengths,
-                response_tensor,
-                response_lengths,
+    def _train_and_publish(
+        self,
+        prompt,
+        responses,
+        rewards,
+        target_kl,
+        max_steps,
+        on_trained,
+        diagnostics,
+        on_progress,
+    ) -> dict:
+        with self._training_lock:
+            result = self._train_shadow(
+                prompt,
+                responses,
+                rewards,
+                target_kl,
+                max_steps,
+                diagnostics,
+                on_progress,
             )
-            before_log_probs = before_per_token_log_probs.sum(dim=-1)
+            self._publish_shadow()
+            if on_trained is not None:
+                on_trained(result)
+            return result
 
-        # Execute the GRPO training step (loops until target KL reached)
-        grpo_result = self.trainable_model.do_grpo_step(
-            prompt=prompt,
-            responses=responses,
-            rewards=rewards,
-            target_kl=target_kl,
-            max_steps=max_steps,
-        )
-
-        # Calculate L2 diff of parameter changes
-        l2_diff = 0.0
-        for name, param in self.model.named_parameters():
-            diff = param - param_snapshot[name]
-            l2_diff += (diff**2).sum().item()
-        l2_diff = l2_diff**0.5
+    def _publish_shadow(self):
+        """
+        Swap the trained shadow weights in as the serving model.
 
-        # Calculate log probs after training (for probability_changes)
+        The serving model gets its own Parameters over the shadow's storage
+        rather than a copy of it; the shadow moves to fresh storage only when
+        the next training step is about to change it (_own_shadow_storage()).
+        Until then a step's publish leaves two copies of the weights alive,
+        the replaced serving model's and the shadow's, not three.
+        """
+        shared = {
+            id(param): torch.nn.Parameter(param.detach(), requires_grad=False)
+            for param in self._shadow.parameters()
+        }
+        serving = copy.deepcopy(self._shadow, memo=shared).eval()
+        self._shadow_shares_storage = True
+        inference_model = self._inference_copy(serving)
+        self._load_compiled(inference_model)
+        self.model = serving
+        self.inference_model = inference_model
+        self._invalidate_caches()
+
+    def _own_shadow_storage(self):
+        """Copy the shadow's weights out of storage the serving model shares."""
+        if not self._shadow_shares_storage:
+            return
         with torch.no_grad():
-            after_per_token_log_probs, _ = calculate_model_log_probs(
-                self.model,
-                prompt_tensor,
-                prompt_lengths,
-                response_tensor,
-                response_lengths,
+            for param in self._shadow.parameters():
+                # Same Parameter objects, so optimizer state stays attached
+                param.data = param.data.clone()
+        self._shadow_shares_storage = False
+
+    def _train_shadow(
+        self,
+        prompt: list[int],
+        responses: list[list[int]],
+        rewards: list[float],
+        target_kl: float,
+        max_steps: int,
+        diagnostics: bool,
+        on_progress=None,
+    ) -> dict:
+        """Run one GRPO step on the shadow model (see do_training_step)."""
+        from torch.nn.utils.rnn import pad_sequence
+        from lm.training.reinforcement.log_probs import calculate_model_log_probs
+
+        trainable_model = self.trainable_model
+        self._own_shadow_storage()
+        shadow = self._shadow
+        # Not yet swapped out, so these are the weights from before this step
+        serving = self.model
+
+        if diagnostics:
+            # Prepare tensors for log prob calculation
+            group_size = len(responses)
+            prompt_tensor = torch.tensor(
+                prompt, dtype=torch.long, device=self.device
+            ).expand(group_size, -1)
+            prompt_lengths = torch.tensor(
+                [len(prompt)] * group_size, device=self.device
+            )
+            response_lengths = torch.tensor(
+                [len(r) for r in responses], device=self.device
+            )
+            response_tensor = pad_sequence(
+                [
+                    torch.tensor(r, dtype=torch.long, device=self.device)
+                    for r in responses
+                ],
+                batch_first=True,
+                padding_value=0,
             )
-            after_log_probs = after_per_token_log_probs.sum(dim=-1)
 
-        # Convert to probability changes (as percentages)
-        before_probs = torch.exp(before_log_probs) * 100
-        after_probs = torch.exp(after_log_probs) * 100
-        prob_changes = (after_probs - before_probs).tolist()
+            # Calculate log probs before training (for probability_changes)
+            with torch.no_grad():
+                before_per_token_log_probs, _ = calculate_model_log_probs(
+                    serving,
+                    prompt_tensor,
+                    prompt_lengths,
+                    response_tensor,
+                    response_lengths,
+                )
+                before_log_probs = before_per_token_log_probs.sum(dim=-1)
+
+        # Execute the GRPO training step (loops until target KL reached)
+        progress_hook = None
+        if on_progress is not None:
+            on_progress(0, max_steps)
+            steps = itertools.count(1)
+            progress_hook = trainable_model.grpo_optimizer.register_step_post_hook(
+                lambda optimizer, args, kwargs: on_progress(next(steps), max_steps)
+            )
+        try:
+            grpo_result = trainable_model.do_grpo_step(
+                prompt=prompt,
+                responses=responses,
+                rewards=rewards,
+                target_kl=target_kl,
+                max_steps=max_steps,
+            )
+        finally:
+            if progress_hook is not None:
+                progress_hook.remove()
+
+        prob_changes = None
+        l2_diff = None
+        if diagnostics:
+            # L2 norm of the parameter update, reduced on-device with one sync
+            with torch.no_grad():
+                l2_diff = torch.linalg.vector_norm(
+                    torch.stack(
+                        [
+                            torch.linalg.vector_norm(after - before)
+                            for after, before in zip(
+                                shadow.parameters(), serving.parameters()
+                            )
+                        ]
+                    )
+                ).item()
+
+            # Calculate log probs after training (for probability_changes)
+            with torch.no_grad():
+                after_per_token_log_probs, _ = calculate_model_log_probs(
+                    shadow,
+                    prompt_tensor,
+                    prompt_lengths,
+                    response_tensor,
+                    response_lengths,
+                )
+                after_log_probs = after_per_token_log_probs.sum(dim=-1)
 
-        # Invalidate caches since model weights changed
-        self._invalidate_kv()
-        self._probs_cache.clear()
+            # Convert to probability changes (as percentages)
+            before_probs = torch.exp(before_log_probs) * 100
+            after_probs = torch.exp(after_log_probs) * 100
+            prob_changes = (after_probs - before_probs).tolist()
 
         return {
             "probability_changes": prob_changes,
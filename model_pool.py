@@ -0,0 +1,129 @@
+"""
+Resident checkpoint replicas for per-session model switching.
+
+The primary Model serves every session that hasn't picked a checkpoint, and
+it is the one /api/train updates. A session that switches checkpoints is
+pinned to a replica loaded from that checkpoint, so other sessions keep
+chatting with whatever they had. Replicas share the primary's tokenizer and
+are evicted least-recently-used once the pool outgrows its memory budget.
+
+Replicas only serve chat, so of the per-model caches only the prefix KV
+cache fills up on them (their probability cache stays empty). Rather than
+each taking the primary's full PREFIX_KV_CACHE_MB, they split one
+MODEL_POOL_CACHE_MB budget evenly between them.
+
+Loading a replica reads its checkpoint from disk, which happens outside the
+pool lock: requests for resident replicas never wait on it, and concurrent
+requests for the same checkpoint wait for the one load in progress.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+from model import Model
+from scheduler import DecodeScheduler
+
+
+class ModelPool:
+    def __init__(
+        self,
+        primary: Model,
+        max_bytes: int = None,
+        max_batch: int = 32,
+        cache_bytes: int = None,
+    ):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("MODEL_POOL_MB", 1024)) * 1024 * 1024
+        if cache_bytes is None:
+            cache_bytes = int(os.environ.get("MODEL_POOL_CACHE_MB", 256)) * 1024 * 1024
+        self.primary = primary
+        self.max_bytes = max_bytes
+        self.max_batch = max_batch
+        self.cache_bytes = cache_bytes  # prefix KV budget shared by all replicas
+        self._replicas = OrderedDict()  # resolved checkpoint path -> Model
+        self._loading = {}  # resolved checkpoint path -> Future of its Model
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(checkpoint_path: str) -> str:
+        return str(Path(checkpoint_path).resolve())
+
+    def get(self, checkpoint_path: str = None) -> Model:
+        """
+        Return the Model serving checkpoint_path, loading it if needed.
+
+        None, or the checkpoint the primary model currently holds, means the
+        primary model.
+        """
+        if checkpoint_path is None:
+            return self.primary
+        key = self._key(checkpoint_path)
+        primary_checkpoint = self.primary.current_checkpoint
+        if primary_checkpoint is not None and key == self._key(primary_checkpoint):
+            return self.primary
+        with self._lock:
+            replica = self._replicas.get(key)
+            if replica is not None:
+                self._replicas.move_to_end(key)
+                return replica
+            loading = self._loading.get(key)
+            if loading is None:
+                loading = self._loading[key] = Future()
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return loading.result()
+
+        try:
+            replica = Model(checkpoint_path, shared=self.primary)
+            replica.scheduler = DecodeScheduler(
+                replica, max_batch=self.max_batch
+            ).start()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._replicas[key] = replica
+            self._evict(keep=key)
+            self._split_cache_budget()
+        loading.set_result(replica)
+        return replica
+
+    def _split_cache_budget(self):
+        """Give every resident replica an equal share of cache_bytes."""
+        share = self.cache_bytes // max(len(self._replicas), 1)
+        for replica in self._replicas.values():
+            replica.set_prefix_kv_budget(share)
+
+    def _evict(self, keep: str):
+        """Drop least-recently-used replicas until the pool fits its budget."""
+        while len(self._replicas) > 1 and self.nbytes() > self.max_bytes:
+            key = next(iter(self._replicas))
+            if key == keep:
+                break
+            replica = self._replicas.pop(key)
+            # Requests already holding the replica finish; its loop then exits
+            replica.scheduler.stop()
+            print(f"[pool] Evicted {key}")
+
+    def nbytes(self) -> int:
+        return self.primary.memory_bytes() + sum(
+            replica.memory_bytes() for replica in self._replicas.values()
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "resident": list(self._replicas),
+                "bytes": self.nbytes(),
+                "max_bytes": self.max_bytes,
+                "cache_bytes": self.cache_bytes,
+                "loading": list(self._loading),
+            }
@@ -0,0 +1,115 @@
+"""
+Byte-budgeted LRU cache of next-token distributions for MikeRL.
+
+Each entry is a node's (sorted_probs, sorted_indices) pair, sorted by
+descending probability. Entries can be stored truncated to their top M
+tokens and/or in a compact fp16/int16 form; sizes are tracked as entries
+come and go, so reporting the cache size never walks the tensors.
+
+Like PrefixKVCache, entries belong to a weights version: get() and put()
+calls for another version are misses and no-ops.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class ProbsCache:
+    def __init__(self, max_bytes: int = None, top_m: int = None, compact: bool = None):
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("PROBS_CACHE_MB", 192)) * 1024 * 1024
+        if top_m is None:
+            top_m = int(os.environ.get("PROBS_CACHE_TOP_M", 0))
+        if compact is None:
+            compact = os.environ.get("PROBS_CACHE_COMPACT", "0") == "1"
+        self.max_bytes = max_bytes
+        self.top_m = top_m  # 0 keeps the full distribution
+        self.compact = compact  # fp16 probabilities + int16 token IDs
+
+        self._entries = OrderedDict()  # key -> (probs, indices, nbytes)
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.version = 0
+
+    def _stale(self, version) -> bool:
+        return version is not None and version != self.version
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, k: int, version: int = None):
+        """Return the cached (probs, indices) for key if it holds at least k tokens."""
+        with self._lock:
+            entry = None if self._stale(version) else self._entries.get(key)
+            if entry is None or len(entry[0]) < k:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, sorted_probs, sorted_indices, k: int = 0, version: int = None):
+        """
+        Cache a sorted distribution, keeping at least its top k tokens.
+
+        Returns the (probs, indices) pair as stored (or as it would have been,
+        when version is stale).
+        """
+        if self.top_m:
+            keep = max(self.top_m, k)
+            sorted_probs = sorted_probs[:keep]
+            sorted_indices = sorted_indices[:keep]
+        if self.compact:
+            probs = sorted_probs.to(torch.float16)
+            indices = sorted_indices.to(torch.int16)
+        else:
+            # Own the storage so a row never pins the whole batch tensor
+            probs = sorted_probs.clone()
+            indices = sorted_indices.clone()
+        nbytes = (
+            probs.nelement() * probs.element_size()
+            + indices.nelement() * indices.element_size()
+        )
+
+        with self._lock:
+            if self._stale(version):
+                return probs, indices
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._entries[key] = (probs, indices, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_bytes
+                self.evictions += 1
+        return probs, indices
+
+    def clear(self, version: int = None):
+        """Drop every entry; later entries belong to version, if given."""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            if version is not None:
+                self.version = version
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "top_m": self.top_m,
+                "compact": self.compact,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
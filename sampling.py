@@ -0,0 +1,141 @@
+"""
+Next-token sampling shared by chat, GRPO candidates and beam trees.
+
+Suppressed tokens are masked with a precomputed additive bias instead of
+writing -inf into the logits on every call. Nucleus sampling takes a partial
+top-k of the distribution and applies the top-p cutoff inside it, so the
+whole vocabulary is only sorted when a row's nucleus doesn't fit in those
+candidates. Everything works on [rows, vocab_size] batches with per-row
+sampling settings.
+"""
+
+import torch
+import torch.nn.functional as F
+
+# Never sampled: <|endoftext|>, and tokens that render as nothing
+ENDOFTEXT_ID = 0
+SILENT_TOKENS = [2316, 1902]
+
+# Candidates the top-p cutoff is applied within before a full sort is needed
+NUCLEUS_CANDIDATES = 64
+
+
+def suppression_bias(vocab_size: int, token_ids, device="cpu"):
+    """Additive [vocab_size] logit mask: -inf at token_ids, 0 elsewhere."""
+    bias = torch.zeros(vocab_size, device=device)
+    bias[list(token_ids)] = float("-inf")
+    return bias
+
+
+def _column(values, rows: int, device, dtype):
+    """A per-row setting as a [rows, 1] tensor; scalars are broadcast."""
+    if isinstance(values, (bool, int, float)):
+        return torch.full((rows, 1), values, device=device, dtype=dtype)
+    return torch.tensor(values, device=device, dtype=dtype).view(rows, 1)
+
+
+def masked_probs(logits, temperature=1.0, bias=None):
+    """
+    Softmax of logits / temperature + bias over the last dimension.
+
+    temperature is a scalar or, for [rows, vocab_size] logits, one value per
+    row. The input tensor is not modified.
+    """
+    if not isinstance(temperature, (int, float)):
+        temperature = _column(temperature, logits.size(0), logits.device, logits.dtype)
+    scaled = logits / temperature
+    if bias is not None:
+        scaled = scaled + bias
+    return F.softmax(scaled, dim=-1)
+
+
+def _truncate(probs, top_p, top_k, use_top_k):
+    """
+    Top-k / nucleus truncation of [rows, vocab_size] probabilities.
+
+    Returns (candidates, token_ids): each row's leading tokens by
+    probability and their probabilities, zeroed past the row's cutoff.
+    """
+    rows, vocab_size = probs.shape
+    device = probs.device
+    use_top_k = _column(use_top_k, rows, device, torch.bool)
+    top_k = _column(top_k, rows, device, torch.long)
+    top_p = _column(top_p, rows, device, probs.dtype)
+
+    # Partial sort: enough candidates for every top-k row and a typical nucleus
+    width = max(NUCLEUS_CANDIDATES, int(top_k.masked_fill(~use_top_k, 0).max()))
+    width = min(width, vocab_size)
+    top_probs, top_idx = torch.topk(probs, width, dim=-1)
+    cumulative = top_probs.cumsum(dim=-1)
+    if width < vocab_size and bool(((cumulative[:, -1:] < top_p) & ~use_top_k).any()):
+        # A nucleus is wider than the candidates: rank the full vocabulary
+        top_probs, top_idx = torch.sort(probs, dim=-1, descending=True)
+        cumulative = top_probs.cumsum(dim=-1)
+
+    # Keep everything up to the token where the cumulative probability reaches top_p
+    nucleus = torch.searchsorted(cumulative, top_p) + 1
+    keep = torch.where(use_top_k, top_k, nucleus)
+    positions = torch.arange(top_probs.size(-1), device=device)
+    return top_probs.masked_fill(positions >= keep, 0.0), top_idx
+
+
+def sample(
+    logits,
+    temperature=1.0,
+    top_p=0.45,
+    top_k=5,
+    use_top_k=False,
+    bias=None,
+) -> list[int]:
+    """
+    Sample one token ID per row of [rows, vocab_size] logits.
+
+    Each setting is a scalar or a sequence with one value per row. Rows with
+    use_top_k sample among their top_k tokens; the others among the fewest
+    top tokens whose cumulative probability reaches top_p (at least one).
+    """
+    probs = masked_probs(logits, temperature, bias)
+    candidates, top_idx = _truncate(probs, top_p, top_k, use_top_k)
+    # multinomial renormalizes each row over the kept candidates
+    choice = torch.multinomial(candidates, 1)
+    return top_idx.gather(1, choice).view(-1).tolist()
+
+
+def verify_draft(
+    logits,
+    draft: list[int],
+    temperature: float = 1.0,
+    top_p: float = 0.45,
+    top_k: int = 5,
+    use_top_k: bool = False,
+    bias=None,
+) -> list[int]:
+    """
+    Accept a prefix of a drafted continuation, as sample() would have chosen.
+
+    logits holds len(draft) + 1 rows: the next-token logits before each
+    draft token and after the last. Draft token i is accepted with its
+    probability p_i under sample()'s truncated distribution; the first
+    rejected position is resampled from p_i with the draft token removed,
+    and if every draft token is accepted one more token is sampled from the
+    last row. Since drafts are deterministic, every returned token has
+    exactly the distribution of sampling one token at a time.
+
+    Returns the accepted draft tokens followed by one sampled token.
+    """
+    probs = masked_probs(logits, temperature, bias)
+    candidates, top_idx = _truncate(probs, top_p, top_k, use_top_k)
+    target = torch.zeros_like(probs).scatter_(1, top_idx, candidates)
+    target = target / target.sum(dim=-1, keepdim=True)
+
+    k = len(draft)
+    draft_ids = torch.tensor(draft, device=logits.device, dtype=torch.long)
+    accept_probs = target[torch.arange(k, device=logits.device), draft_ids]
+    accepted = torch.rand(k, device=logits.device) < accept_probs
+    n = int(accepted.long().cumprod(dim=0).sum())
+
+    row = target[n]
+    if n < k:
+        row = row.clone()
+        row[draft[n]] = 0.0
+    return draft[:n] + [int(torch.multinomial(row, 1))]
@@ -0,0 +1,185 @@
+"""
+Continuous batching decode scheduler.
+
+Owns a Model's TransformerLM and merges every active generation into one
+batched incremental decode step per tick. Each sequence keeps its own
+GenerationState (token buffer + KV cache); sequences join the batch as soon
+as they are submitted and leave it when they hit a stop token, their token
+budget, or the client disconnects. If a batched step fails, the requests
+are retried one by one so only the ones that fail on their own see the error.
+"""
+
+import queue
+import threading
+
+import executors
+
+
+class _Request:
+    """An in-flight generation: its decode state plus delivery bookkeeping."""
+
+    __slots__ = ("state", "stop_ids", "remaining", "out", "cancelled")
+
+    def __init__(self, state, max_tokens, stop_ids):
+        self.state = state
+        self.stop_ids = frozenset(stop_ids)
+        self.remaining = max_tokens
+        self.out = queue.SimpleQueue()
+        self.cancelled = False
+
+
+class DecodeScheduler:
+    def __init__(self, model, max_batch: int = 32):
+        self.model = model
+        self.max_batch = max_batch
+        self._pending = queue.SimpleQueue()
+        self._active = []
+        self._thread = None
+        self._stopping = False
+        self._lock = threading.Lock()  # guards starting/exiting the decode loop
+
+    def start(self):
+        """Start the background decode loop (idempotent)."""
+        with self._lock:
+            self._start_locked()
+        return self
+
+    def _start_locked(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="decode-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """
+        Let the decode loop exit once it runs out of work.
+
+        A request submitted afterwards still runs: the loop restarts for it
+        and exits again when idle.
+        """
+        self._stopping = True
+        self._pending.put(None)  # wake an idle loop
+
+    def generate(
+        self,
+        prompt: str | list[int],
+        max_tokens: int = 200,
+        temperature: float = 1.0,
+        top_p: float = 0.45,
+        top_k: int = 5,
+        use_top_k: bool = False,
+        stop_ids=(),
+    ):
+        """
+        Submit a prompt and yield sampled token IDs as the scheduler produces them.
+
+        The prompt is prefilled on the caller's thread so a long prompt never
+        stalls the running batch. A stop token is yielded before the stream
+        ends. Closing the generator early removes the sequence from the batch
+        on the next tick.
+        """
+        state = self.model.prime(
+            prompt,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            use_top_k=use_top_k,
+        )
+        req = _Request(state, max_tokens, stop_ids)
+        with self._lock:
+            self._pending.put(req)
+            self._start_locked()
+        try:
+            while True:
+                item = req.out.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            req.cancelled = True
+
+    def _admit(self, req):
+        if req is not None:
+            self._active.append(req)
+
+    def _run(self):
+        executors.decode.init_thread()
+        while True:
+            if not self._active:
+                with self._lock:
+                    if self._stopping and self._pending.empty():
+                        self._thread = None
+                        return
+                # Idle: block until someone submits work
+                self._admit(self._pending.get())
+                if not self._active:
+                    continue
+            while len(self._active) < self.max_batch:
+                try:
+                    self._admit(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._tick()
+            except Exception as e:
+                for req in self._active:
+                    req.out.put(e)
+                self._active = []
+
+    def _tick(self):
+        """Advance every active request by one token (more when speculating)."""
+        active = []
+        for req in self._active:
+            if req.cancelled:
+                self.model._remember(req.state)
+            else:
+                active.append(req)
+        if not active:
+            self._active = []
+            return
+        new_tokens = self._decode(active)
+
+        survivors = []
+        for req, token_ids in zip(active, new_tokens):
+            if token_ids is None:
+                continue  # failed on its own; the error was delivered
+            finished = False
+            for token_id in token_ids:
+                req.remaining -= 1
+                req.out.put(token_id)
+                if token_id in req.stop_ids or req.remaining <= 0:
+                    finished = True
+                    break
+            if finished:
+                req.out.put(None)
+                # Its K/V is the prefix of this conversation's next turn
+                self.model._remember(req.state)
+            else:
+                survivors.append(req)
+        self._active = survivors
+
+    def _decode(self, active: list[_Request]) -> list:
+        """
+        New token IDs per request, or None for a request whose step failed.
+
+        A failing batched step is retried row by row; each request that still
+        fails is sent the error. A lone request's failure is raised.
+        """
+        try:
+            return self.model.decode_steps([req.state for req in active])
+        except Exception as e:
+            if len(active) == 1:
+                raise
+            print(f"[scheduler] Batched decode step failed ({e}); retrying per row")
+        new_tokens = []
+        for req in active:
+            try:
+                new_tokens.append(self.model.decode_steps([req.state])[0])
+            except Exception as e:
+                req.out.put(e)
+                new_tokens.append(None)
+        return new_tokens
@@ -0,0 +1,133 @@
+"""
+Bounded in-memory store of active chat sessions.
+
+Each session keeps its history text, the token IDs of that history (so a
+new turn only has to tokenize the new message) and the checkpoint it has
+pinned. Sessions idle for longer than the TTL are dropped, and the least
+recently used ones are evicted once the store is full. A session that
+isn't in memory is rehydrated lazily from the conversation store; its
+tokens are recomputed the next time they're needed.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class Transcript:
+    """
+    Chat history text and its token IDs, extended one segment at a time.
+
+    Every appended segment must start with a special token (<|Them|>,
+    <|Me|>, a reaction) or follow text that ends with one. The tokenizer
+    splits on special tokens before anything else, so encoding such a
+    segment on its own gives exactly the IDs it gets inside the full text,
+    and only the new segment is ever tokenized.
+    """
+
+    def __init__(self, encode, text: str = "", tokens: list[int] = None):
+        self._encode = encode
+        self.text = text
+        self.tokens = encode(text) if tokens is None else list(tokens)
+
+    def append(self, segment: str):
+        self.text += segment
+        self.tokens += self._encode(segment)
+
+
+class Session:
+    __slots__ = ("session_id", "history", "tokens", "checkpoint", "last_used")
+
+    def __init__(self, session_id: str, history: str = ""):
+        self.session_id = session_id
+        self.history = history
+        self.tokens = None  # token IDs of history, or None until computed
+        self.checkpoint = None  # checkpoint pinned via /api/switch-model
+        self.last_used = time.monotonic()
+
+    def set_history(self, history: str, tokens: list[int] = None):
+        """Replace the history; tokens must encode exactly history (or be None)."""
+        self.history = history
+        self.tokens = tokens
+
+
+class SessionStore:
+    def __init__(self, load=None, max_sessions: int = None, ttl: float = None):
+        """
+        load(session_id) returns a persisted (history, checkpoint) pair (or
+        None) and is used to rehydrate sessions that aren't in memory.
+        """
+        if max_sessions is None:
+            max_sessions = int(os.environ.get("SESSION_STORE_MAX", 1000))
+        if ttl is None:
+            ttl = float(os.environ.get("SESSION_TTL_SECONDS", 3600))
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._load = load
+        self._sessions = OrderedDict()  # session_id -> Session, oldest first
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Session:
+        """Return the session, rehydrating or creating it as needed."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+                return session
+
+        # Rehydrate outside the lock; another request may race us here
+        loaded = self._load(session_id) if self._load is not None else None
+        history, checkpoint = loaded or ("", None)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, history)
+                session.checkpoint = checkpoint
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def peek(self, session_id: str) -> Session | None:
+        """
+        Return the session without creating, rehydrating or refreshing it.
+
+        A session that isn't in memory is loaded into a Session that isn't
+        kept; None when there is nothing to load.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is not None:
+            return session
+        loaded = self._load(session_id) if self._load is not None else None
+        if loaded is None:
+            return None
+        history, checkpoint = loaded
+        session = Session(session_id, history)
+        session.checkpoint = checkpoint
+        return session
+
+    def _expire(self, now: float):
+        """Drop sessions idle for longer than the TTL (callers hold _lock)."""
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl,
+            }
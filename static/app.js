@@ -435,7 +435,7 @@ if (replayParam) {
 }
 
 // Initialize: fetch checkpoint count for badge
-fetch('/api/checkpoints')
+fetch(`/api/checkpoints?session_id=${encodeURIComponent(SESSION_ID)}`)
     .then(res => res.json())
     .then(data => {
         if (data.checkpoints) {
@@ -453,7 +453,7 @@ let currentCheckpoint = null;
 // Load checkpoints and populate the list
 async function loadCheckpoints() {
     try {
-        const response = await fetch('/api/checkpoints');
+        const response = await fetch(`/api/checkpoints?session_id=${encodeURIComponent(SESSION_ID)}`);
         const data = await response.json();
         const list = document.getElementById('checkpoint-list');
 
@@ -508,7 +508,7 @@ async function selectCheckpoint(checkpointPath) {
         const response = await fetch('/api/switch-model', {
             method: 'POST',
             headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({checkpoint_path: checkpointPath})
+            body: JSON.stringify({checkpoint_path: checkpointPath, session_id: SESSION_ID})
         });
 
         if (!response.ok) {
@@ -919,3 +919,56 @@ async function loadNextLayer(nodes, pathToNodes) {
         console.error('Error loading depth:', error);
     }
 }
+
+// --- Training jobs ---
+// /api/train queues a job and returns its ID; progress and the final result
+// arrive as SSE events. Resolves with the "done" event, which carries the
+// probability changes, KL and L2 diff.
+async function runTrainingJob(body, onProgress) {
+    const response = await fetch('/api/train', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body)
+    });
+
+    const job = await response.json();
+
+    if (!response.ok) {
+        throw new Error(job.error || 'Training failed');
+    }
+
+    const events = await fetch(`/api/train/${job.job_id}/events`);
+    const reader = events.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+
+        // Process complete SSE lines
+        const lines = buffer.split('\n');
+        buffer = lines.pop() || ''; // Keep incomplete line in buffer
+
+        for (const line of lines) {
+            if (!line.startsWith('data: ')) continue;
+            const event = JSON.parse(line.slice(6));
+
+            if (event.type === 'done') {
+                reader.cancel();
+                return event;
+            }
+            if (event.type === 'error') {
+                reader.cancel();
+                throw new Error(event.error || 'Training failed');
+            }
+            if (onProgress) onProgress(event);
+        }
+    }
+
+    throw new Error('Training stream ended unexpectedly');
+}
@@ -18,8 +18,8 @@ document.addEventListener('DOMContentLoaded', () => {
             if (data.steps && data.steps.length > 0) {
                 trainingHistory = data.steps.map(step => ({
                     timestamp: new Date(step.timestamp).getTime(),
-                    positiveChange: step.probability_changes?.[0] ?? 0,
-                    negativeChange: step.probability_changes?.[step.probability_changes?.length - 1] ?? 0,
+                    positiveChange: step.probability_changes?.[0] ?? null,
+                    negativeChange: step.probability_changes?.[step.probability_changes?.length - 1] ?? null,
                     // Use response_texts (decoded text) if available, fall back to responses (token IDs) for old entries
                     positivePaths: (step.response_texts || step.responses)?.slice(0, Math.ceil((step.response_texts || step.responses)?.length / 2)) || [],
                     negativePaths: (step.response_texts || step.responses)?.slice(Math.ceil((step.response_texts || step.responses)?.length / 2)) || [],
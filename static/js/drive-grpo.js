@@ -91,7 +91,9 @@ async function startGrpoGeneration() {
                         for (let i = 0; i < 8; i++) {
                             const textEl = document.getElementById(`grpo-text-${i}`);
                             const rowEl = document.getElementById(`grpo-row-${i}`);
-                            textEl.textContent = grpoResponses[i]?.text || '(empty)';
+                            textEl.textContent = grpoResponses[i]?.text
+                                || (i >= grpoResponses.length && data.truncated
+                                    ? '(stopped at the time limit)' : '(empty)');
                             textEl.classList.remove('streaming', 'empty');
                             rowEl.classList.remove('generating');
                         }
@@ -251,23 +253,11 @@ async function submitGrpoRankings() {
         const responses = grpoRankings.map(responseIndex => grpoResponses[responseIndex].tokens);
         const rewards = grpoRankings.map((_, rankIndex) => n - rankIndex);  // rank 1 → n, rank n → 1
 
-        const response = await fetch('/api/train', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                prompt: `<|ConversationStart|><|Them|>${originalPrompt}<|Me|>`,
-                responses: responses,
-                rewards: rewards
-            })
-        });
-
-        const result = await response.json();
-
-        if (!response.ok) {
-            throw new Error(result.error || 'Training failed');
-        }
+        const result = await runTrainingJob({
+            prompt: `<|ConversationStart|><|Them|>${originalPrompt}<|Me|>`,
+            responses: responses,
+            rewards: rewards
+        }, event => showTrainingProgress('btn-grpo-execute', event));
 
         // Add to training history
         addGrpoToHistory(result);
@@ -280,6 +270,7 @@ async function submitGrpoRankings() {
         alert('Training error: ' + error.message);
     } finally {
         trainingInProgress = false;
+        showTrainingProgress('btn-grpo-execute', null);
     }
 }
 
@@ -296,8 +287,8 @@ function addGrpoToHistory(result) {
     trainingHistory.push({
         timestamp: Date.now(),
         type: 'group',
-        positiveChange: result.probability_changes[0] || 0,
-        negativeChange: result.probability_changes[7] || 0,
+        positiveChange: result.probability_changes ? result.probability_changes[0] || 0 : null,
+        negativeChange: result.probability_changes ? result.probability_changes[7] || 0 : null,
         positivePaths: rankedPaths.slice(0, 4),
         negativePaths: rankedPaths.slice(4, 8),
         allChanges: result.probability_changes,
@@ -184,10 +184,10 @@ function updateTrainingHistory() {
         div.innerHTML = `
             <div class="history-timestamp">#${trainingHistory.length - idx} - ${timestamp}</div>
             ${pathsHtml}
-            <div class="history-changes">
+            ${item.positiveChange != null ? `<div class="history-changes">
                 <div class="prob-change prob-positive">+${formatPercent(item.positiveChange)}%</div>
                 <div class="prob-change prob-negative">${formatPercent(item.negativeChange)}%</div>
-            </div>
+            </div>` : ''}
             <div class="history-metrics">
                 <div class="metric-item">L2: ${formatMetric(item.l2Diff)}</div>
                 <div class="metric-item">KL: ${formatMetric(item.klDivergence)}</div>
@@ -217,23 +217,11 @@ async function exportSelections() {
     trainingInProgress = true;
     try {
         // Use unified training endpoint with responses + rewards
-        const response = await fetch('/api/train', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({
-                prompt: treeData.prompt,
-                responses: [positiveTokenIds[0], negativeTokenIds[0]],
-                rewards: [1.0, -1.0]
-            })
-        });
-
-        const result = await response.json();
-
-        if (!response.ok) {
-            throw new Error(result.error || 'Training failed');
-        }
+        const result = await runTrainingJob({
+            prompt: treeData.prompt,
+            responses: [positiveTokenIds[0], negativeTokenIds[0]],
+            rewards: [1.0, -1.0]
+        }, event => showTrainingProgress('btn-execute', event));
 
         // Add to training history
         const positivePaths = selectedPaths.filter(p => p.type === 'positive').map(p => p.path);
@@ -241,8 +229,9 @@ async function exportSelections() {
 
         trainingHistory.push({
             timestamp: Date.now(),
-            positiveChange: result.probability_changes[0],
-            negativeChange: result.probability_changes[1],
+            // null unless the step ran with diagnostics
+            positiveChange: result.probability_changes?.[0] ?? null,
+            negativeChange: result.probability_changes?.[1] ?? null,
             positivePaths: positivePaths,
             negativePaths: negativePaths,
             l2Diff: result.l2_diff,
@@ -261,5 +250,20 @@ async function exportSelections() {
         alert('Training error: ' + error.message);
     } finally {
         trainingInProgress = false;
+        showTrainingProgress('btn-execute', null);
+    }
+}
+
+// Show queue position / optimizer step on a Train button (null restores it)
+function showTrainingProgress(buttonId, event) {
+    const button = document.getElementById(buttonId);
+    if (!button) return;
+
+    if (!event) {
+        button.textContent = 'Train';
+    } else if (event.type === 'queued' && event.position > 0) {
+        button.textContent = `Queued (${event.position} ahead)`;
+    } else if (event.type === 'progress') {
+        button.textContent = `Training ${event.step}/${event.max_steps}`;
     }
 }
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def tiny_lm():
+    """A small randomly initialized TransformerLM (skips without torch/lm)."""
+    torch = pytest.importorskip("torch")
+    model_module = pytest.importorskip("lm.model.model")
+    torch.manual_seed(0)
+    return model_module.TransformerLM(
+        d_model=32,
+        vocab_size=64,
+        context_length=32,
+        num_layers=2,
+        num_heads=2,
+        d_ff=64,
+        rope_theta=10000,
+        device="cpu",
+    ).eval()
+
+
+@pytest.fixture
+def model_class():
+    """model.Model (skips without torch/lm), for exercising its methods."""
+    pytest.importorskip("torch")
+    pytest.importorskip("lm")
+    return pytest.importorskip("model").Model
@@ -0,0 +1,107 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from checkpoints import DeltaCheckpointStore  # noqa: E402
+
+
+def _chain(tmp_path, depth, keyframe_every=20):
+    """Save depth + 1 steps of small updates; return the paths and states."""
+    store = DeltaCheckpointStore(keyframe_every=keyframe_every, cache_bytes=0)
+    generator = torch.Generator().manual_seed(0)
+    weights = {"w": torch.randn(16, 8, generator=generator), "step": torch.tensor(0)}
+    paths, states, parent = [], [], None
+    for step in range(depth + 1):
+        weights = {
+            "w": weights["w"] + 1e-3 * torch.randn(16, 8, generator=generator),
+            "step": torch.tensor(step),
+        }
+        path = tmp_path / f"step_{step}.pt"
+        store.save({"model": weights, "parent": parent}, path)
+        paths.append(path)
+        states.append(weights)
+        parent = path
+    return store, paths, states
+
+
+def test_cold_load_of_a_deep_delta_is_flattened(tmp_path):
+    _, paths, states = _chain(tmp_path, depth=19)
+
+    cold = DeltaCheckpointStore(cache_bytes=0)
+    loaded = cold.load(paths[-1], part="model")
+    assert torch.equal(loaded["w"], states[-1]["w"])
+    assert len(list((tmp_path / ".flat").glob("*.pt"))) == 1
+
+    # Another cold store reads the flattened copy instead of the blob chain
+    for blob in (tmp_path / ".store").glob("*/*"):
+        blob.unlink()
+    again = DeltaCheckpointStore(cache_bytes=0).load(paths[-1], part="model")
+    assert torch.equal(again["w"], states[-1]["w"])
+    assert again["step"].item() == 19
+
+
+def test_flattened_copies_are_bounded(tmp_path):
+    _, paths, _ = _chain(tmp_path, depth=4)
+    store = DeltaCheckpointStore(cache_bytes=0, flat_keep=2)
+    for path in paths:
+        store.load(path, part="model")
+    assert len(list((tmp_path / ".flat").glob("*.pt"))) == 2
+
+
+def _blob_depth(store, path, tmp_path, suffix):
+    manifest = store._read_manifest(path)
+    (digest,) = [d for key, d in manifest["tensors"].items() if key.endswith(suffix)]
+    return store._read_header(store._blob_path(tmp_path / ".store", digest))["depth"]
+
+
+def test_delta_chain_round_trips_with_nested_state(tmp_path):
+    store = DeltaCheckpointStore(cache_bytes=0, flat_keep=0)
+    weights = {"w": torch.zeros(4, 4), "b": torch.zeros(4, dtype=torch.float16)}
+    parent, saved = None, []
+    for step in range(6):
+        weights = {name: t + step * 0.25 for name, t in weights.items()}
+        state = {
+            "model": weights,
+            "optimizer": {
+                "state": {0: {"step": step, "exp_avg": weights["w"] * 2}},
+                "param_groups": [{"lr": 0.01, "params": [0]}],
+            },
+        }
+        path = tmp_path / f"step_{step}.pt"
+        store.save({**state, "parent": parent}, path)
+        saved.append((path, state))
+        parent = path
+
+    for path, state in saved:
+        loaded = DeltaCheckpointStore(cache_bytes=0, flat_keep=0).load(path)
+        for name, tensor in state["model"].items():
+            assert loaded["model"][name].dtype == tensor.dtype
+            assert torch.equal(loaded["model"][name], tensor)
+        optimizer = loaded["optimizer"]
+        assert optimizer["param_groups"] == state["optimizer"]["param_groups"]
+        assert optimizer["state"][0]["step"] == state["optimizer"]["state"][0]["step"]
+        assert torch.equal(
+            optimizer["state"][0]["exp_avg"], state["optimizer"]["state"][0]["exp_avg"]
+        )
+
+
+def test_keyframe_every_bounds_delta_depth(tmp_path):
+    store, paths, _ = _chain(tmp_path, depth=6, keyframe_every=3)
+    depths = [_blob_depth(store, path, tmp_path, "w") for path in paths]
+    assert depths == [0, 1, 2, 0, 1, 2, 0]
+
+
+def test_collect_garbage_keeps_chains_surviving_manifests_reach(tmp_path):
+    store, paths, states = _chain(tmp_path, depth=3)
+    branch = {"w": states[1]["w"] * 2, "step": torch.tensor(100)}
+    store.save({"model": branch, "parent": paths[1]}, tmp_path / "branch.pt")
+
+    # step_1 and the branch survive; step_1's blobs delta against step_0's
+    for step in (0, 2, 3):
+        paths[step].unlink()
+    assert store.collect_garbage(tmp_path) == 4  # "w" and "step" of steps 2, 3
+
+    for path, expected in ((paths[1], states[1]), (tmp_path / "branch.pt", branch)):
+        loaded = DeltaCheckpointStore(cache_bytes=0).load(path, part="model")
+        for name, tensor in expected.items():
+            assert torch.equal(loaded[name], tensor)
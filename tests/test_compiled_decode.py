@@ -0,0 +1,79 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from compiled_decode import CompiledDecode  # noqa: E402
+
+
+def _step(model, compiled, tokens, kv):
+    out = compiled(tokens, kv)
+    return out if out is not None else model.forward_incremental(tokens, kv)
+
+
+def test_load_weights_serves_new_weights_without_recompiling(tiny_lm):
+    compiled = CompiledDecode(tiny_lm, buckets=(1, 2)).warmup(length=8)
+    updated = copy.deepcopy(tiny_lm)
+    with torch.no_grad():
+        for param in updated.parameters():
+            param.add_(0.01 * torch.randn_like(param))
+
+    forward = compiled._forward
+    compiled.load_weights(updated)
+    # Same compiled function; the weights were copied into it
+    assert compiled._forward is forward
+
+    with torch.no_grad():
+        prompt = torch.randint(0, 64, (2, 6))
+        _, kv = updated.encode_kv(prompt)
+        tokens = torch.randint(0, 64, (2, 1))
+        logits, _ = _step(updated, compiled, tokens, kv)
+        expected, _ = updated.forward_incremental(tokens, kv)
+    torch.testing.assert_close(logits, expected, rtol=1e-4, atol=1e-5)
+
+
+def test_compiled_module_is_a_private_copy(tiny_lm):
+    compiled = CompiledDecode(tiny_lm, buckets=(1,))
+    before = [p.clone() for p in tiny_lm.parameters()]
+    updated = copy.deepcopy(tiny_lm)
+    with torch.no_grad():
+        for param in updated.parameters():
+            param.zero_()
+    compiled.load_weights(updated)
+    # Loading new weights never touches the module it was built from
+    for param, old in zip(tiny_lm.parameters(), before):
+        assert torch.equal(param, old)
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_compiled_output_matches_eager_after_load_weights(tiny_lm, quantize):
+    from quantization import quantize_int8
+
+    def serving(module):
+        return quantize_int8(module) if quantize else module
+
+    compiled = CompiledDecode(serving(tiny_lm), buckets=(1, 2)).warmup(length=8)
+    updated = copy.deepcopy(tiny_lm)
+    with torch.no_grad():
+        for param in updated.parameters():
+            param.add_(0.05 * torch.randn_like(param))
+    updated = serving(updated)
+
+    try:
+        compiled.load_weights(updated)
+    except RuntimeError:
+        # Refusing int8 weights is fine (the caller decodes eagerly); serving
+        # stale ones isn't. fp32 weights must always load
+        if not quantize:
+            raise
+        return
+
+    with torch.no_grad():
+        prompt = torch.randint(0, 64, (2, 6))
+        _, kv = updated.encode_kv(prompt)
+        tokens = torch.randint(0, 64, (2, 1))
+        out = compiled(tokens, kv)
+        expected, _ = updated.forward_incremental(tokens, kv)
+    assert out is not None
+    torch.testing.assert_close(out[0], expected, rtol=1e-3, atol=1e-4)
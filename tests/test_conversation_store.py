@@ -0,0 +1,46 @@
+import pytest
+
+from conversation_store import ConversationStore
+
+
+def _history(messages: int) -> str:
+    return "<|ConversationStart|>" + "<|Them|>hey" * messages
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(tmp_path / "conversations.db")
+    # a, b, c saved in that order, with 2, 3 and 1 messages
+    for session_id, messages in (("a", 2), ("b", 3), ("c", 1)):
+        store.save(session_id, _history(messages))
+    return store
+
+
+def _ids(rows):
+    return [row["session_id"] for row in rows]
+
+
+def test_list_sorts_by_each_column(store):
+    rows, total = store.list()
+    assert total == 3
+    assert _ids(rows) == ["c", "b", "a"]  # newest first by default
+    assert _ids(store.list(descending=False)[0]) == ["a", "b", "c"]
+    by_count, _ = store.list(sort="message_count")
+    assert _ids(by_count) == ["b", "a", "c"]
+    assert [row["message_count"] for row in by_count] == [3, 2, 1]
+
+    store.save("a", _history(4))  # a is now the most recently updated
+    assert _ids(store.list(sort="updated_at")[0])[0] == "a"
+    assert _ids(store.list(sort="created_at")[0]) == ["c", "b", "a"]
+
+
+def test_list_pages_with_a_stable_order(store):
+    pages = [store.list(offset=offset, limit=2) for offset in (0, 2, 4)]
+    assert [_ids(rows) for rows, _ in pages] == [["c", "b"], ["a"], []]
+    assert {total for _, total in pages} == {3}
+
+
+def test_list_rejects_unknown_sort_columns(store):
+    with pytest.raises(ValueError):
+        store.list(sort="preview; DROP TABLE conversation_meta")
+    assert store.list()[1] == 3
@@ -0,0 +1,67 @@
+import random
+from collections import Counter
+
+from drafting import NgramDrafter
+
+
+def _encode(line: str) -> list[int]:
+    return [ord(c) for c in line]
+
+
+def _write_corpus(path, lines):
+    path.write_text("".join(lines), encoding="utf-8")
+    return path
+
+
+def test_fit_file_matches_fit_on_whole_corpus(tmp_path):
+    lines = ["the cat sat\n", "on the mat\n", "\n", "the cat ran\n"] * 5
+    path = _write_corpus(tmp_path / "corpus.txt", lines)
+
+    streamed = NgramDrafter()
+    streamed.fit_file_async(path, _encode).join()
+    whole = NgramDrafter()
+    whole.fit(_encode("".join(lines)))
+
+    # Line-by-line counting includes the n-grams spanning line breaks
+    assert streamed._table == whole._table
+
+
+def test_fit_file_stops_at_max_tokens(tmp_path):
+    path = _write_corpus(tmp_path / "corpus.txt", ["abcdefgh\n"] * 100)
+    drafter = NgramDrafter(max_tokens=20)
+    drafter.fit_file_async(path, _encode).join()
+
+    expected = NgramDrafter()
+    expected.fit(_encode("abcdefgh\n" * 3)[:20])
+    assert drafter._table == expected._table
+
+
+def test_pruning_bounds_counts_and_keeps_frequent_ngrams():
+    rng = random.Random(0)
+    frequent = [1, 2, 3, 4]
+    tokens = []
+    for _ in range(500):
+        tokens += frequent + [rng.randrange(100, 10_000) for _ in range(6)]
+
+    drafter = NgramDrafter(max_ngrams=1000)
+    counts = Counter()
+    for start in range(0, len(tokens), 50):
+        chunk = tokens[max(start - drafter.max_ngram, 0) : start + 50]
+        drafter._count(counts, chunk, start=min(start, drafter.max_ngram))
+        assert len(counts) <= drafter.max_ngrams
+    drafter._build(counts)
+
+    assert drafter.propose([9999, 1, 2], k=2) == [3, 4]
+
+
+def test_prompt_index_matches_a_full_scan():
+    rng = random.Random(0)
+    drafter = NgramDrafter()
+    index = drafter.prompt_index()
+    tokens = []
+    for _ in range(300):
+        tokens.append(rng.randrange(6))
+        assert index.lookup(tokens, 4) == drafter._lookup(tokens, 4)
+    # Anything but appending rebuilds the index
+    del tokens[:50]
+    assert index.lookup(tokens, 4) == drafter._lookup(tokens, 4)
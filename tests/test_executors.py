@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+
+from executors import Pool  # noqa: E402
+
+
+def _count(n, delay=0.0, closed=None):
+    try:
+        for i in range(n):
+            time.sleep(delay)
+            yield i
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def test_submit_and_run_use_the_pool_threads():
+    pool = Pool("test", workers=2)
+    assert pool.submit(lambda x: x * 2, 21).result() == 42
+    assert pool.run(lambda: threading.current_thread().name).startswith("test")
+
+
+def test_stream_yields_every_item():
+    stream = Pool("test").stream(_count, 5)
+    assert list(stream) == [0, 1, 2, 3, 4]
+    assert not stream.truncated
+
+
+def test_closing_a_stream_stops_its_generator():
+    closed = threading.Event()
+    pool = Pool("test")
+    stream = pool.stream(_count, 1000, delay=0.001, closed=closed)
+    assert next(stream) == 0
+    stream.close()
+    assert closed.wait(timeout=5)
+    # The worker is free again
+    assert pool.run(lambda: "free") == "free"
+
+
+def test_time_limit_truncates_a_stream():
+    closed = threading.Event()
+    stream = Pool("test", time_limit=0.05).stream(
+        _count, 1000, delay=0.01, closed=closed
+    )
+    items = list(stream)
+    assert 0 < len(items) < 1000
+    assert stream.truncated
+    assert closed.wait(timeout=5)
+
+
+def test_stream_errors_reach_the_consumer():
+    def failing():
+        yield 1
+        raise ValueError("boom")
+
+    stream = Pool("test").stream(failing)
+    assert next(stream) == 1
+    with pytest.raises(ValueError, match="boom"):
+        next(stream)
@@ -0,0 +1,157 @@
+import os
+import re
+
+import pytest
+
+from session_store import Transcript
+
+SPECIAL_TOKENS = [
+    "<|endoftext|>",
+    "<|Me|>",
+    "<|Them|>",
+    "<|ConversationStart|>",
+    "<|Loved|>",
+    "<|Liked|>",
+    "<|Laughed at|>",
+    "<|Disliked|>",
+    "<|Questioned|>",
+    "<|Emphasized|>",
+    "👍",
+    "😂",
+]
+
+# GPT-2 style pretokenization, close enough to lm's for boundary behaviour
+PRETOKENIZE = re.compile(
+    r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+"""
+)
+
+
+class StubTokenizer:
+    """
+    Byte-level BPE with the same shape as lm's Tokenizer: split on special
+    tokens, pretokenize, then apply merges by rank within each pretoken.
+    """
+
+    def __init__(self, merges, special_tokens):
+        self.ranks = {pair: i for i, pair in enumerate(merges)}
+        self.ids = {}
+        for token in special_tokens:
+            self._id(token.encode("utf-8"))
+        ordered = sorted(special_tokens, key=len, reverse=True)
+        self.specials = set(special_tokens)
+        self.split = re.compile("(" + "|".join(map(re.escape, ordered)) + ")")
+
+    def _id(self, token: bytes) -> int:
+        return self.ids.setdefault(token, len(self.ids))
+
+    def _bpe(self, word: bytes) -> list[bytes]:
+        parts = [bytes([b]) for b in word]
+        while len(parts) > 1:
+            ranked = [
+                (self.ranks[pair], i)
+                for i, pair in enumerate(zip(parts, parts[1:]))
+                if pair in self.ranks
+            ]
+            if not ranked:
+                break
+            _, i = min(ranked)
+            parts[i : i + 2] = [parts[i] + parts[i + 1]]
+        return parts
+
+    def encode(self, text: str) -> list[int]:
+        ids = []
+        for chunk in self.split.split(text):
+            if chunk in self.specials:
+                ids.append(self._id(chunk.encode("utf-8")))
+                continue
+            for word in PRETOKENIZE.findall(chunk):
+                ids.extend(self._id(p) for p in self._bpe(word.encode("utf-8")))
+        return ids
+
+
+def _stub_tokenizer():
+    merges = [
+        (b" ", b"t"),
+        (b"h", b"e"),
+        (b" t", b"he"),
+        (b"l", b"l"),
+        (b"\n", b"\n"),
+        (b" ", b" "),
+        (b"o", b"k"),
+        (b"<", b"|"),
+        (b"|", b">"),
+        (b" ", b"<|"),
+        (b"h", b"i"),
+        (b"!", b"!"),
+    ]
+    return StubTokenizer(merges, SPECIAL_TOKENS)
+
+
+def _tokenizers():
+    tokenizers = [pytest.param(_stub_tokenizer(), id="stub")]
+    vocab = "vocab/mikegpt_vocab_8192.json"
+    merges = "vocab/mikegpt_merges_8192.pkl"
+    try:
+        from lm.tokenization.bpe import Tokenizer
+    except ImportError:
+        return tokenizers
+    if os.path.exists(vocab) and os.path.exists(merges):
+        real = Tokenizer.from_files(vocab, merges, special_tokens=SPECIAL_TOKENS)
+        tokenizers.append(pytest.param(real, id="lm"))
+    return tokenizers
+
+
+# (user message, model responses) per turn, covering the awkward boundaries:
+# trailing/leading whitespace and newlines next to special tokens, blank
+# messages, reactions, emoji special tokens and literal special-token text
+TURNS = [
+    ("hey", ["hi", "how are you"]),
+    ("good\n", ["nice\n\n", "<|Liked|>"]),
+    ("\n\nthe end  ", ["the  end"]),
+    ("", ["<|Laughed at|>"]),
+    ("lol 😂", ["😂", "ok👍"]),
+    ("type <|Me|> literally", ["<| not special |>"]),
+    ("  spaces then newline \n", ["'s it's ok!!", "<|Loved|>"]),
+    ("<|Them|>", ["done"]),
+]
+
+
+def _response_segment(response: str, transcript: Transcript, auto_start: bool):
+    # Mirrors /api/generate: reactions stand alone, as does the first reply
+    # after an auto-start prompt (which already ends in <|Me|>)
+    if response.startswith("<|") and response.endswith("|>"):
+        return response
+    if auto_start and transcript.text == "<|ConversationStart|><|Me|>":
+        return response
+    return f"<|Me|>{response}"
+
+
+@pytest.mark.parametrize("tokenizer", _tokenizers())
+@pytest.mark.parametrize("auto_start", [False, True])
+def test_incremental_history_matches_full_encoding(tokenizer, auto_start):
+    encode = tokenizer.encode
+    history, history_tokens = "", None
+    for turn, (message, responses) in enumerate(TURNS):
+        if auto_start and turn == 0:
+            transcript = Transcript(encode, "<|ConversationStart|><|Me|>")
+        elif not history:
+            transcript = Transcript(encode, f"<|ConversationStart|><|Them|>{message}")
+        else:
+            transcript = Transcript(encode, history, history_tokens)
+            transcript.append(f"<|Them|>{message}")
+        assert transcript.tokens == encode(transcript.text)
+
+        for response in responses:
+            transcript.append(_response_segment(response, transcript, auto_start))
+            assert transcript.tokens == encode(transcript.text)
+
+        history, history_tokens = transcript.text, transcript.tokens
+
+
+def test_transcript_copies_given_tokens():
+    encode = _stub_tokenizer().encode
+    tokens = encode("<|Them|>hi")
+    transcript = Transcript(encode, "<|Them|>hi", tokens)
+    transcript.append("<|Me|>hello")
+    # The session's cached token list must not change under it mid-request
+    assert tokens == encode("<|Them|>hi")
@@ -0,0 +1,134 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from kv_cache import (  # noqa: E402
+    PrefixKVCache,
+    extend_kv,
+    extend_kv_batch,
+    kv_slice,
+    shift_window_matches,
+)
+
+
+def _assert_kv_close(actual, expected):
+    if isinstance(expected, torch.Tensor):
+        torch.testing.assert_close(actual, expected, rtol=1e-4, atol=1e-5)
+        return
+    assert len(actual) == len(expected)
+    for a, e in zip(actual, expected):
+        _assert_kv_close(a, e)
+
+
+@pytest.mark.parametrize("prefix_len", [1, 5, 12])
+def test_extend_kv_matches_encode_kv(tiny_lm, prefix_len):
+    tokens = torch.randint(0, 64, (1, 20)).tolist()[0]
+    with torch.no_grad():
+        full_logits, full_kv = tiny_lm.encode_kv(torch.tensor([tokens]))
+        _, prefix_kv = tiny_lm.encode_kv(torch.tensor([tokens[:prefix_len]]))
+        logits, kv = extend_kv(tiny_lm, prefix_kv, tokens[prefix_len:])
+
+    # Multi-token incremental forward: causal within the suffix and at the
+    # right positions, so every suffix logit and cached K/V matches
+    torch.testing.assert_close(
+        logits, full_logits[:, prefix_len:], rtol=1e-4, atol=1e-5
+    )
+    _assert_kv_close(kv, full_kv)
+
+
+def test_extend_kv_from_sliced_prefix(tiny_lm):
+    tokens = torch.randint(0, 64, (1, 16)).tolist()[0]
+    with torch.no_grad():
+        full_logits, full_kv = tiny_lm.encode_kv(torch.tensor([tokens]))
+        logits, _ = extend_kv(tiny_lm, kv_slice(full_kv, 0, 10), tokens[10:])
+    torch.testing.assert_close(logits, full_logits[:, 10:], rtol=1e-4, atol=1e-5)
+
+
+def test_extend_kv_batch_matches_per_row_encode(tiny_lm):
+    # Caches of different lengths, each with one uncached token (a decode
+    # step) or several (the row is ahead and re-forwards the difference)
+    sequences = [torch.randint(0, 64, (n,)).tolist() for n in (7, 12, 9, 10)]
+    cached = [6, 11, 8, 7]
+    with torch.no_grad():
+        kvs = [
+            tiny_lm.encode_kv(torch.tensor([sequence[:n]]))[1]
+            for sequence, n in zip(sequences, cached)
+        ]
+        rows = extend_kv_batch(tiny_lm.forward_incremental, kvs, sequences)
+        for sequence, (logits, kv) in zip(sequences, rows):
+            full_logits, full_kv = tiny_lm.encode_kv(torch.tensor([sequence]))
+            torch.testing.assert_close(
+                logits, full_logits[0, -1], rtol=1e-4, atol=1e-5
+            )
+            _assert_kv_close(kv, full_kv)
+
+
+def test_shift_window_matches_encode_kv(tiny_lm):
+    # Shifted layer-0 keys/values must equal a fresh encode of the kept window;
+    # KV_WINDOW=shift relies on lm's cache layout and interleaved-pair RoPE
+    assert shift_window_matches(tiny_lm, rope_theta=10000, vocab_size=64)
+
+
+def test_shift_window_mismatch_is_detected(tiny_lm):
+    # A wrong RoPE base must fail the check rather than pass silently
+    assert not shift_window_matches(tiny_lm, rope_theta=500, vocab_size=64)
+
+
+def _position_kv(tokens):
+    """A one-layer cache whose entry at each position is its token ID."""
+    values = torch.tensor(tokens, dtype=torch.float32).view(1, 1, -1, 1)
+    return [(values.clone(), values.clone())]
+
+
+def _walk(node):
+    for child in node.children.values():
+        yield child
+        yield from _walk(child)
+
+
+def test_prefix_cache_lookup_joins_the_path_once():
+    cache = PrefixKVCache(max_bytes=1 << 20)
+    cache.insert([1, 2, 3, 4], _position_kv([1, 2, 3, 4]))
+    cache.insert([1, 2, 5], _position_kv([1, 2, 5]))
+
+    length, kv, _ = cache.lookup([1, 2, 3, 4, 9])
+    assert length == 4
+    _assert_kv_close(kv, _position_kv([1, 2, 3, 4]))
+    # A repeat hit reuses the joined path instead of concatenating again
+    _, again, _ = cache.lookup([1, 2, 3, 4])
+    assert again[0][0].data_ptr() == kv[0][0].data_ptr()
+    length, partial, _ = cache.lookup([1, 2, 3, 7])
+    assert length == 3
+    _assert_kv_close(partial, _position_kv([1, 2, 3]))
+
+
+def test_prefix_cache_evicts_least_recently_used_leaf():
+    leaf_bytes = 2 * 2 * 4  # keys and values, two positions of float32
+    cache = PrefixKVCache(max_bytes=3 * leaf_bytes)
+    for first in (10, 20, 30):
+        cache.insert([first, first + 1], _position_kv([first, first + 1]))
+    cache.lookup([10, 11, 12])  # 20 is now the least recently used
+    cache.insert([40, 41], _position_kv([40, 41]))
+
+    assert cache.lookup([20, 21])[0] == 0
+    for first in (10, 30, 40):
+        assert cache.lookup([first, first + 1])[0] == 2
+
+
+def test_prefix_cache_accounting_under_churn():
+    import random
+
+    rng = random.Random(0)
+    cache = PrefixKVCache(max_bytes=2000)
+    for _ in range(300):
+        tokens = [rng.randrange(4) for _ in range(rng.randrange(1, 12))]
+        if rng.random() < 0.5:
+            cache.insert(tokens, _position_kv(tokens))
+        else:
+            length, kv, _ = cache.lookup(tokens)
+            if length:
+                _assert_kv_close(kv, _position_kv(tokens[:length]))
+
+        nodes = list(_walk(cache._root))
+        assert cache.nbytes == sum(node.nbytes for node in nodes) <= 2000
+        assert set(cache._leaves) == {node for node in nodes if not node.children}
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import pytest
+
+model_pool = pytest.importorskip("model_pool")
+
+
+class _FakeModel:
+    """Stands in for a loaded checkpoint: 100 bytes, counts its loads."""
+
+    loads = []
+    gate = None
+
+    def __init__(self, checkpoint_path=None, shared=None):
+        if _FakeModel.gate is not None:
+            assert _FakeModel.gate.wait(timeout=5)
+        _FakeModel.loads.append(checkpoint_path)
+        self.current_checkpoint = checkpoint_path
+
+    def memory_bytes(self):
+        return 100
+
+    def set_prefix_kv_budget(self, max_bytes):
+        self.prefix_kv_budget = max_bytes
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    monkeypatch.setattr(model_pool, "Model", _FakeModel)
+    monkeypatch.setattr(_FakeModel, "loads", [])
+    monkeypatch.setattr(_FakeModel, "gate", None)
+    primary = _FakeModel(str(tmp_path / "primary.pt"))
+    _FakeModel.loads.clear()
+    return model_pool.ModelPool(primary, max_bytes=350, cache_bytes=1000)
+
+
+def test_primary_checkpoint_is_served_by_the_primary(pool, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert pool.get("primary.pt") is pool.primary
+    assert pool.get(None) is pool.primary
+    assert _FakeModel.loads == []
+
+
+def test_least_recently_used_replica_is_evicted(pool):
+    a, b = pool.get("a.pt"), pool.get("b.pt")
+    pool.get("a.pt")  # b is now the least recently used
+    c = pool.get("c.pt")
+
+    resident = pool.stats()["resident"]
+    assert resident == [pool._key("a.pt"), pool._key("c.pt")]
+    assert b.scheduler._stopping
+    assert not a.scheduler._stopping and not c.scheduler._stopping
+    # The survivors split the cache budget between them
+    assert a.prefix_kv_budget == c.prefix_kv_budget == 500
+
+
+def test_concurrent_gets_share_one_load(pool):
+    _FakeModel.gate = threading.Event()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(pool.get("a.pt")))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while not pool.stats()["loading"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    _FakeModel.gate.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(_FakeModel.loads) == 1
+    assert len(results) == 4
+    assert all(replica is results[0] for replica in results)
@@ -0,0 +1,130 @@
+import copy
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+def _perturbed_state(module):
+    return {
+        name: tensor + 0.5 if tensor.is_floating_point() else tensor
+        for name, tensor in module.state_dict().items()
+    }
+
+
+def test_module_from_state_leaves_serving_module_untouched(model_class, tiny_lm):
+    before = {name: t.clone() for name, t in tiny_lm.state_dict().items()}
+    state = _perturbed_state(tiny_lm)
+
+    fresh = model_class._module_from_state(SimpleNamespace(model=tiny_lm), state)
+
+    for name, tensor in tiny_lm.state_dict().items():
+        assert torch.equal(tensor, before[name])
+    for name, tensor in fresh.state_dict().items():
+        assert torch.equal(tensor, state[name])
+    tokens = torch.randint(0, 64, (1, 8))
+    with torch.no_grad():
+        tiny_lm.load_state_dict(state)
+        torch.testing.assert_close(fresh(tokens), tiny_lm(tokens))
+
+
+def test_module_from_state_rejects_mismatched_weights(model_class, tiny_lm):
+    state = tiny_lm.state_dict()
+    name = next(iter(dict(tiny_lm.named_parameters())))
+    with pytest.raises(ValueError):
+        model_class._module_from_state(
+            SimpleNamespace(model=tiny_lm), {**state, name: torch.zeros(3)}
+        )
+    with pytest.raises(KeyError):
+        model_class._module_from_state(
+            SimpleNamespace(model=tiny_lm),
+            {k: v for k, v in state.items() if k != name},
+        )
+
+
+def test_training_l2_diff_is_the_parameter_update_norm(model_class, tiny_lm):
+    from lm.model.model import TrainableModel
+
+    shadow = copy.deepcopy(tiny_lm)
+    before = [param.detach().clone() for param in shadow.parameters()]
+    fake_model = SimpleNamespace(
+        model=tiny_lm,
+        device="cpu",
+        _shadow=shadow,
+        trainable_model=TrainableModel(model=shadow),
+        _own_shadow_storage=lambda: None,
+    )
+
+    result = model_class._train_shadow(
+        fake_model,
+        prompt=[1, 2, 3],
+        responses=[[4, 5, 6], [7, 8]],
+        rewards=[1.0, -1.0],
+        target_kl=10.0,
+        max_steps=3,
+        diagnostics=True,
+    )
+
+    expected = torch.sqrt(
+        sum(
+            ((after.detach() - old) ** 2).sum()
+            for after, old in zip(shadow.parameters(), before)
+        )
+    ).item()
+    assert expected > 0
+    assert result["l2_diff"] == pytest.approx(expected, rel=1e-4)
+    assert len(result["probability_changes"]) == 2
+
+
+def _training_model(model_class, module):
+    """Just enough of a Model to train and publish a shadow of module."""
+    from lm.model.model import TrainableModel
+
+    fake_model = SimpleNamespace(
+        model=module,
+        inference_model=module,
+        device="cpu",
+        _shadow=copy.deepcopy(module),
+        _shadow_shares_storage=False,
+        _inference_copy=lambda serving: serving,
+        _load_compiled=lambda inference_model: None,
+        _invalidate_caches=lambda: None,
+    )
+    fake_model.trainable_model = TrainableModel(model=fake_model._shadow)
+    fake_model._own_shadow_storage = lambda: model_class._own_shadow_storage(
+        fake_model
+    )
+    return fake_model
+
+
+def _train(model_class, fake_model):
+    return model_class._train_shadow(
+        fake_model,
+        prompt=[1, 2, 3],
+        responses=[[4, 5, 6], [7, 8]],
+        rewards=[1.0, -1.0],
+        target_kl=10.0,
+        max_steps=3,
+        diagnostics=False,
+    )
+
+
+def test_published_weights_stay_fixed_until_the_next_publish(model_class, tiny_lm):
+    fake_model = _training_model(model_class, tiny_lm)
+    _train(model_class, fake_model)
+    model_class._publish_shadow(fake_model)
+    served = fake_model.model
+    published = {name: t.clone() for name, t in served.state_dict().items()}
+
+    # The next step trains the shadow while the published model keeps serving
+    _train(model_class, fake_model)
+    assert fake_model.model is served
+    for name, tensor in served.state_dict().items():
+        assert torch.equal(tensor, published[name])
+    trained = fake_model._shadow.state_dict()
+    assert any(not torch.equal(trained[name], t) for name, t in published.items())
+
+    model_class._publish_shadow(fake_model)
+    for name, tensor in fake_model.model.state_dict().items():
+        assert torch.equal(tensor, trained[name])
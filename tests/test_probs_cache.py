@@ -0,0 +1,63 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from probs_cache import ProbsCache  # noqa: E402
+
+
+def _distribution(n=100, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    probs = torch.softmax(torch.randn(n, generator=generator), dim=0)
+    return torch.sort(probs, descending=True)
+
+
+def test_evicts_least_recently_used_within_the_byte_budget():
+    entry_bytes = 100 * 4 + 100 * 8  # float32 probs + int64 indices
+    cache = ProbsCache(max_bytes=3 * entry_bytes, top_m=0, compact=False)
+    for key in "abc":
+        cache.put(key, *_distribution())
+    assert cache.get("a", k=5) is not None  # b is now the oldest
+    cache.put("d", *_distribution())
+
+    assert cache.get("b", k=5) is None
+    assert all(cache.get(key, k=5) is not None for key in "acd")
+    assert cache.nbytes == 3 * entry_bytes
+    assert cache.evictions == 1
+
+
+def test_top_m_entries_miss_for_larger_k():
+    cache = ProbsCache(max_bytes=1 << 20, top_m=10, compact=False)
+    probs, indices = cache.put("a", *_distribution())
+    assert len(probs) == len(indices) == 10
+    assert cache.get("a", k=10) is not None
+    assert cache.get("a", k=11) is None
+
+    # A put for more than top_m keeps what was asked for
+    probs, _ = cache.put("b", *_distribution(), k=30)
+    assert len(probs) == 30
+    assert cache.get("b", k=30) is not None
+
+
+def test_compact_entries_are_fp16_and_int16():
+    cache = ProbsCache(max_bytes=1 << 20, top_m=0, compact=True)
+    sorted_probs, sorted_indices = _distribution()
+    cache.put("a", sorted_probs, sorted_indices)
+
+    probs, indices = cache.get("a", k=5)
+    assert probs.dtype == torch.float16 and indices.dtype == torch.int16
+    assert torch.equal(indices.long(), sorted_indices)
+    torch.testing.assert_close(probs.float(), sorted_probs, rtol=1e-3, atol=1e-4)
+    assert cache.nbytes == 100 * 2 + 100 * 2
+
+
+def test_other_versions_miss_and_are_not_stored():
+    cache = ProbsCache(max_bytes=1 << 20, top_m=0, compact=False)
+    cache.put("a", *_distribution(), version=0)
+    cache.clear(version=1)
+
+    assert cache.get("a", k=1, version=1) is None
+    cache.put("b", *_distribution(), version=0)  # started on the old weights
+    assert len(cache) == 0 and cache.nbytes == 0
+    cache.put("c", *_distribution(), version=1)
+    assert cache.get("c", k=1, version=1) is not None
+    assert cache.get("c", k=1, version=0) is None
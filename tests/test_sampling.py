@@ -0,0 +1,87 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from sampling import (  # noqa: E402
+    NUCLEUS_CANDIDATES,
+    _truncate,
+    masked_probs,
+    sample,
+    verify_draft,
+)
+
+VOCAB = 200
+
+
+def _reference(probs, top_p, top_k, use_top_k):
+    """Dense truncated distributions from a full sort of every row."""
+    dense = torch.zeros_like(probs)
+    for row, p, k, by_k in zip(range(len(probs)), top_p, top_k, use_top_k):
+        sorted_probs, sorted_idx = torch.sort(probs[row], descending=True)
+        if by_k:
+            keep = k
+        else:
+            keep = int(torch.searchsorted(sorted_probs.cumsum(0), torch.tensor(p))) + 1
+        dense[row, sorted_idx[:keep]] = sorted_probs[:keep]
+    return dense / dense.sum(dim=-1, keepdim=True)
+
+
+def _dense(probs, top_p, top_k, use_top_k):
+    candidates, top_idx = _truncate(probs, top_p, top_k, use_top_k)
+    dense = torch.zeros_like(probs).scatter_(1, top_idx, candidates)
+    return dense / dense.sum(dim=-1, keepdim=True)
+
+
+def test_truncate_matches_a_full_sort():
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(6, VOCAB, generator=generator) * 3
+    logits[4] = torch.randn(VOCAB, generator=generator) * 0.01  # nearly flat
+    probs = masked_probs(logits)
+    top_p = [0.45, 0.9, 0.99, 0.45, 0.95, 0.5]
+    top_k = [5, 5, 5, 80, 5, 1]
+    use_top_k = [False, False, False, True, False, True]
+
+    # The flat row's nucleus doesn't fit in the partial top-k candidates
+    flat = torch.sort(probs[4], descending=True).values.cumsum(0)
+    assert int(torch.searchsorted(flat, torch.tensor(0.95))) + 1 > NUCLEUS_CANDIDATES
+
+    torch.testing.assert_close(
+        _dense(probs, top_p, top_k, use_top_k),
+        _reference(probs, top_p, top_k, use_top_k),
+    )
+
+
+def test_sample_follows_the_truncated_distribution():
+    torch.manual_seed(0)
+    logits = torch.randn(1, VOCAB, generator=torch.Generator().manual_seed(1)) * 2
+    expected = _reference(masked_probs(logits), [0.9], [5], [False])[0]
+
+    draws = 20000
+    counts = torch.bincount(
+        torch.tensor(sample(logits.expand(draws, -1), top_p=0.9)), minlength=VOCAB
+    )
+    assert counts[expected == 0].sum() == 0
+    torch.testing.assert_close(counts / draws, expected, rtol=0, atol=0.015)
+
+
+def test_verify_draft_keeps_the_sampling_distribution():
+    torch.manual_seed(0)
+    logits = torch.randn(3, VOCAB, generator=torch.Generator().manual_seed(2)) * 2
+    target = _reference(masked_probs(logits), [0.9] * 3, [5] * 3, [False] * 3)
+    draft = [int(target[0].argmax()), int(target[1].argmax())]
+
+    trials = 20000
+    first = torch.zeros(VOCAB)
+    accepted_first = 0
+    for _ in range(trials):
+        tokens = verify_draft(logits, draft, top_p=0.9)
+        first[tokens[0]] += 1
+        # A rejected draft token is removed before resampling
+        accepted_first += tokens[0] == draft[0]
+        assert 1 <= len(tokens) <= len(draft) + 1
+
+    # The first token is distributed as if sampled directly from row 0
+    torch.testing.assert_close(first / trials, target[0], rtol=0, atol=0.015)
+    assert accepted_first / trials == pytest.approx(
+        float(target[0, draft[0]]), abs=0.015
+    )
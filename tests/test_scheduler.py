@@ -0,0 +1,91 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("torch")
+
+from scheduler import DecodeScheduler  # noqa: E402
+
+
+class _CountingModel:
+    """Each state emits its prompt's first token + 1, + 2, ...; BAD fails."""
+
+    BAD = 999
+
+    def __init__(self):
+        self.batches = []
+        self.remembered = []
+
+    def prime(self, prompt, **settings):
+        return SimpleNamespace(tokens=list(prompt))
+
+    def decode_steps(self, states):
+        self.batches.append(len(states))
+        if not states:
+            raise AssertionError("decode_steps([])")
+        if any(state.tokens[0] == self.BAD for state in states):
+            raise RuntimeError("bad row")
+        for state in states:
+            state.tokens.append(state.tokens[-1] + 1)
+        return [[state.tokens[-1]] for state in states]
+
+    def _remember(self, state):
+        self.remembered.append(state)
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DecodeScheduler(_CountingModel()).start()
+    yield scheduler
+    scheduler.stop()
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_stop_token_is_yielded_and_ends_the_stream(scheduler):
+    tokens = list(scheduler.generate([10], max_tokens=100, stop_ids=(13,)))
+    assert tokens == [11, 12, 13]
+    _wait_for(lambda: scheduler.model.remembered)
+
+
+def test_token_budget_ends_the_stream(scheduler):
+    assert list(scheduler.generate([10], max_tokens=4)) == [11, 12, 13, 14]
+
+
+def test_cancelled_request_leaves_the_batch(scheduler):
+    stream = scheduler.generate([0], max_tokens=10**9)
+    assert next(stream) == 1
+    stream.close()
+
+    _wait_for(lambda: scheduler.model.remembered)
+    # Nothing is left to decode: the loop never steps an empty batch
+    _wait_for(lambda: scheduler._active == [])
+    assert 0 not in scheduler.model.batches
+
+
+def test_failing_request_does_not_fail_the_batch(scheduler):
+    started = threading.Event()
+    good = scheduler.generate([0], max_tokens=10**9)
+    received = []
+
+    def consume():
+        received.append(next(good))
+        started.set()
+        for _ in range(20):
+            received.append(next(good))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    assert started.wait(timeout=5)
+    with pytest.raises(RuntimeError, match="bad row"):
+        list(scheduler.generate([_CountingModel.BAD], max_tokens=5))
+    consumer.join(timeout=5)
+    assert received == list(range(1, 22))
+    good.close()
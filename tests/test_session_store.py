@@ -0,0 +1,67 @@
+from conversation_store import ConversationStore
+from session_store import SessionStore
+
+HISTORY = "<|ConversationStart|><|Them|>hey<|Me|>hi"
+
+
+def _stores(tmp_path, max_sessions=1):
+    conversations = ConversationStore(tmp_path / "conversations.db")
+    sessions = SessionStore(load=conversations.load_session, max_sessions=max_sessions)
+    return conversations, sessions
+
+
+def test_rehydrated_session_keeps_pinned_checkpoint(tmp_path):
+    conversations, sessions = _stores(tmp_path)
+    conversations.save("a", HISTORY)
+    conversations.pin_checkpoint("a", "checkpoints/step_3.pt")
+    sessions.get("b")  # evicts "a"
+
+    session = sessions.get("a")
+    assert session.history == HISTORY
+    assert session.checkpoint == "checkpoints/step_3.pt"
+
+
+def test_pin_without_saved_history(tmp_path):
+    conversations, sessions = _stores(tmp_path)
+    conversations.pin_checkpoint("a", "checkpoints/step_3.pt")
+
+    session = sessions.get("a")
+    assert session.history == ""
+    assert session.checkpoint == "checkpoints/step_3.pt"
+
+
+def test_reset_session_does_not_resurrect_history(tmp_path):
+    conversations, sessions = _stores(tmp_path)
+    conversations.save("a", HISTORY)
+    conversations.mark_reset("a")
+    sessions.get("b")
+
+    assert sessions.get("a").history == ""
+    # The stored conversation itself is kept for the admin view
+    assert conversations.get("a")["history"] == HISTORY
+
+
+def test_save_after_reset_is_the_new_history(tmp_path):
+    conversations, sessions = _stores(tmp_path)
+    conversations.save("a", HISTORY)
+    conversations.mark_reset("a")
+    conversations.save("a", "<|ConversationStart|><|Them|>again")
+    sessions.get("b")
+
+    assert sessions.get("a").history == "<|ConversationStart|><|Them|>again"
+
+
+def test_unknown_session_starts_empty(tmp_path):
+    _, sessions = _stores(tmp_path)
+    session = sessions.get("new")
+    assert session.history == ""
+    assert session.checkpoint is None
+
+
+def test_peek_does_not_create_or_rehydrate_sessions(tmp_path):
+    conversations, sessions = _stores(tmp_path)
+    conversations.pin_checkpoint("a", "checkpoints/step_3.pt")
+
+    assert sessions.peek("a").checkpoint == "checkpoints/step_3.pt"
+    assert sessions.peek("unknown") is None
+    assert len(sessions) == 0
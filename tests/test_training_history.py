@@ -0,0 +1,83 @@
+import pytest
+
+from training_history import TrainingHistory
+
+
+def _step(**fields):
+    return {"prompt": "hey", "checkpoint_status": "saving", **fields}
+
+
+def test_reopen_resolves_interrupted_checkpoint_writes(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = TrainingHistory(path)
+    written = history.append(_step())
+    lost = history.append(_step())
+    done = history.append(_step())
+    history.update(done, checkpoint_status="saved")
+    # The process dies here: neither background write reported back
+
+    reopened = TrainingHistory(path)
+    resolved = reopened.resolve_saving(lambda step: step["id"] == written)
+
+    assert resolved == 2
+    assert reopened.get(written)["checkpoint_status"] == "saved"
+    assert reopened.get(lost)["checkpoint_status"] == "failed"
+    assert reopened.get(done)["checkpoint_status"] == "saved"
+    # Resolutions are persisted like any other patch
+    again = TrainingHistory(path)
+    assert again.resolve_saving(lambda step: False) == 0
+    assert again.get(written)["checkpoint_status"] == "saved"
+
+
+def test_torn_last_line_is_dropped_on_reopen(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = TrainingHistory(path)
+    history.append(_step())
+    second = history.append(_step())
+    with open(path, "ab") as f:
+        f.write(b'{"step": {"prompt": "cut of')  # the process died mid-append
+
+    reopened = TrainingHistory(path)
+    assert len(reopened) == 2
+    third = reopened.append(_step(prompt="after"))
+    assert third == second + 1
+
+    again = TrainingHistory(path)
+    steps, total = again.page()
+    assert total == 3
+    assert [step["prompt"] for step in steps] == ["hey", "hey", "after"]
+
+
+def test_patches_apply_to_get_and_page(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = TrainingHistory(path)
+    ids = [history.append(_step(prompt=str(i))) for i in range(5)]
+    assert history.update(ids[1], checkpoint_status="saved", deleted=True)
+    assert not history.update(999, deleted=True)
+
+    assert history.get(ids[1])["deleted"] is True
+    assert history.get(999) is None
+    steps, total = history.page(offset=1, limit=2, newest_first=True)
+    assert total == 5
+    assert [step["id"] for step in steps] == [ids[3], ids[2]]
+
+    reopened = TrainingHistory(path)
+    step = reopened.page(offset=1, limit=1)[0][0]
+    assert step["checkpoint_status"] == "saved" and step["deleted"] is True
+
+
+def test_legacy_yaml_is_imported_once(tmp_path):
+    yaml = pytest.importorskip("yaml")
+    legacy = tmp_path / "training_history.yml"
+    legacy.write_text(yaml.safe_dump({"steps": [{"id": 1, "prompt": "a"}]}))
+    path = tmp_path / "history.jsonl"
+
+    history = TrainingHistory(path, legacy_yaml_path=legacy)
+    assert history.get(1)["prompt"] == "a"
+    assert history.append(_step()) == 2
+
+    legacy.write_text(yaml.safe_dump({"steps": [{"id": 7, "prompt": "b"}]}))
+    reopened = TrainingHistory(path, legacy_yaml_path=legacy)
+    assert len(reopened) == 2
+    assert reopened.get(7) is None
+    assert legacy.exists()
@@ -0,0 +1,56 @@
+import threading
+
+from training_jobs import TrainingJob, TrainingJobs
+
+
+def test_late_subscriber_replays_every_event():
+    job = TrainingJob()
+    job.emit({"type": "queued"})
+    job.emit({"type": "progress", "step": 1}, status="running")
+    job.emit({"type": "done"}, status="done")
+
+    assert list(job.stream()) == job.events
+    # Any number of readers get the full history
+    assert list(job.stream()) == job.events
+
+
+def test_subscriber_follows_live_after_replay():
+    job = TrainingJob()
+    job.emit({"type": "queued"})
+    received = []
+    first = threading.Event()
+
+    def read():
+        for event in job.stream(timeout=5):
+            received.append(event)
+            first.set()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    assert first.wait(timeout=5)
+    job.emit({"type": "progress", "step": 1}, status="running")
+    job.emit({"type": "done"}, status="done")
+    reader.join(timeout=5)
+
+    assert not reader.is_alive()
+    assert [event for event in received if event is not None] == job.events
+
+
+def test_idle_stream_yields_keep_alives():
+    job = TrainingJob()
+    stream = job.stream(timeout=0.01)
+    assert next(stream) is None
+    job.emit({"type": "failed"}, status="failed")
+    assert list(stream) == [{"type": "failed"}]
+
+
+def test_oldest_finished_jobs_are_forgotten_first():
+    jobs = TrainingJobs(max_jobs=2)
+    running = jobs.create()
+    finished = jobs.create()
+    finished.emit({"type": "done"}, status="done")
+    newest = jobs.create()
+
+    assert jobs.get(finished.id) is None
+    assert jobs.get(running.id) is running
+    assert jobs.position(newest) == 1
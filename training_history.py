@@ -0,0 +1,155 @@
+"""
+Append-only training history.
+
+Every training step is one JSON line in data/training_history.jsonl; later
+changes to a step (checkpoint status, soft-delete) are appended as small
+patch lines instead of rewriting the file. An in-memory index maps step ids
+to the byte offset of their record, so appending is O(1) and a page of
+steps reads only the lines it returns.
+
+The first time the store opens it imports the old training_history.yml,
+which is left in place untouched.
+
+A step's checkpoint is written in the background after its record, so a
+crash can leave a record marked "saving" for good; resolve_saving() settles
+those on startup.
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class TrainingHistory:
+    def __init__(self, path, legacy_yaml_path=None):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._offsets = {}  # step id -> byte offset of its record line
+        self._patches = {}  # step id -> merged fields from patch lines
+        self._next_id = 1
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            self._import_yaml(legacy_yaml_path)
+        self._build_index()
+
+    def _import_yaml(self, legacy_yaml_path):
+        """Convert the old whole-file YAML history into the JSONL log (once)."""
+        steps = []
+        if legacy_yaml_path is not None and Path(legacy_yaml_path).exists():
+            import yaml
+
+            with open(legacy_yaml_path) as f:
+                steps = (yaml.safe_load(f) or {}).get("steps", [])
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            for step in steps:
+                f.write(json.dumps({"step": step}) + "\n")
+        os.replace(tmp_path, self.path)
+        if steps:
+            print(f"[history] Imported {len(steps)} steps from {legacy_yaml_path}")
+
+    def _build_index(self):
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn final line from a crash mid-append
+                self._index_record(json.loads(line), offset)
+                offset += len(line)
+        self._end = offset  # the next append overwrites anything past here
+
+    def _index_record(self, record: dict, offset: int):
+        if "step" in record:
+            step_id = record["step"]["id"]
+            self._offsets[step_id] = offset
+            self._next_id = max(self._next_id, step_id + 1)
+        else:
+            self._patches.setdefault(record["id"], {}).update(record["patch"])
+
+    def _append(self, record: dict) -> int:
+        """Append one record line (callers hold _lock); returns its offset."""
+        offset = self._end
+        line = (json.dumps(record) + "\n").encode()
+        with open(self.path, "ab") as f:
+            if f.tell() != offset:
+                # Drop a torn line left by a crash so the log stays parseable
+                f.truncate(offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._end = offset + len(line)
+        return offset
+
+    def append(self, step: dict) -> int:
+        """Append a step, assigning its id (also set on step). Returns the id."""
+        with self._lock:
+            step["id"] = self._next_id
+            self._offsets[step["id"]] = self._append({"step": step})
+            self._next_id += 1
+        return step["id"]
+
+    def update(self, step_id: int, **fields) -> bool:
+        """Record changed fields of an existing step. False if there's no such step."""
+        with self._lock:
+            if step_id not in self._offsets:
+                return False
+            self._append({"id": step_id, "patch": fields})
+            self._patches.setdefault(step_id, {}).update(fields)
+        return True
+
+    def resolve_saving(self, checkpoint_exists) -> int:
+        """
+        Settle steps left at checkpoint_status "saving" by a previous run.
+
+        checkpoint_exists(step) says whether the step's checkpoint file made
+        it to disk: "saved" if so, "failed" if not. Call before any new
+        checkpoints are queued. Returns the number of steps resolved.
+        """
+        with self._lock:
+            with open(self.path, "rb") as f:
+                stale = [
+                    step
+                    for step in (self._read(f, step_id) for step_id in self._offsets)
+                    if step.get("checkpoint_status") == "saving"
+                ]
+            for step in stale:
+                if checkpoint_exists(step):
+                    patch = {"checkpoint_status": "saved"}
+                else:
+                    patch = {
+                        "checkpoint_status": "failed",
+                        "checkpoint_error": "interrupted before the write finished",
+                    }
+                self._append({"id": step["id"], "patch": patch})
+                self._patches.setdefault(step["id"], {}).update(patch)
+        if stale:
+            print(f"[history] Resolved {len(stale)} interrupted checkpoint writes")
+        return len(stale)
+
+    def _read(self, f, step_id: int) -> dict:
+        f.seek(self._offsets[step_id])
+        step = json.loads(f.readline())["step"]
+        step.update(self._patches.get(step_id, {}))
+        return step
+
+    def get(self, step_id: int):
+        """The step with its patches applied, or None."""
+        with self._lock:
+            if step_id not in self._offsets:
+                return None
+            with open(self.path, "rb") as f:
+                return self._read(f, step_id)
+
+    def page(self, offset: int = 0, limit: int = None, newest_first: bool = False):
+        """Steps in id order (or reversed); returns (steps, total)."""
+        with self._lock:
+            ids = sorted(self._offsets, reverse=newest_first)
+            total = len(ids)
+            ids = ids[offset : None if limit is None else offset + limit]
+            with open(self.path, "rb") as f:
+                return [self._read(f, step_id) for step_id in ids], total
+
+    def __len__(self) -> int:
+        return len(self._offsets)
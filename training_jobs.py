@@ -0,0 +1,99 @@
+"""
+Queued /api/train jobs and their progress events.
+
+A job is created per training request and runs on the model's single
+training worker, in submission order. Its events (queued, progress, done,
+error) are kept on the job so any number of SSE readers can replay them
+from the start and then follow along live.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+FINISHED = ("done", "failed")
+
+
+class TrainingJob:
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"  # queued -> running -> done | failed
+        self.created_at = time.time()
+        self.events = []
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def emit(self, event: dict, status: str = None):
+        """Record an event (and optionally a new status) and wake readers."""
+        with self._cond:
+            if status is not None:
+                self.status = status
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def stream(self, timeout: float = 15.0):
+        """
+        Yield every event from the first one, blocking for new ones until
+        the job finishes. Yields None after timeout seconds without an event
+        so callers can send a keep-alive.
+        """
+        sent = 0
+        while True:
+            with self._cond:
+                if sent == len(self.events) and not self.finished:
+                    self._cond.wait(timeout)
+                pending = self.events[sent:]
+                finished = self.finished
+            sent += len(pending)
+            if not pending and not finished:
+                yield None
+            yield from pending
+            if finished and sent == len(self.events):
+                return
+
+    def summary(self) -> dict:
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "created_at": self.created_at,
+                "last_event": self.events[-1] if self.events else None,
+            }
+
+
+class TrainingJobs:
+    """Registry of recent jobs; the oldest finished jobs are forgotten first."""
+
+    def __init__(self, max_jobs: int = 100):
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self) -> TrainingJob:
+        job = TrainingJob()
+        with self._lock:
+            self._jobs[job.id] = job
+            for job_id in [j.id for j in self._jobs.values() if j.finished]:
+                if len(self._jobs) <= self.max_jobs:
+                    break
+                del self._jobs[job_id]
+        return job
+
+    def get(self, job_id: str) -> TrainingJob:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job: TrainingJob) -> int:
+        """Number of unfinished jobs submitted before job."""
+        with self._lock:
+            ahead = 0
+            for other in self._jobs.values():
+                if other is job:
+                    return ahead
+                if not other.finished:
+                    ahead += 1
+            return ahead